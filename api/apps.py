@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        post_migrate.connect(setup_search_table, sender=self)
+        # registers the signal handlers invalidating the invoice list cache and setting up the SQLite connections
+        from . import cache, database  # noqa: F401
+
+
+def setup_search_table(sender, using, **kwargs):
+    """
+    Creates the full-text search table whenever the tables are created through Django, for example for the test database.
+    """
+    from .search import create_search_table
+
+    create_search_table(using)
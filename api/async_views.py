@@ -0,0 +1,213 @@
+from asgiref.sync import sync_to_async
+from django.db.models import Max
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .cache import invoice_list_cache, invalidates_invoice_list
+from .database import retries_when_locked
+from .filters import FULL_FIELDSET, InvalidFilter, parse_fieldset
+from .metrics import label_response
+from .models import Invoice, InvoiceDetail
+from .pagination import AsyncPageNumberPagination, InvalidCursor
+from .renderers import FastJSONRenderer
+from .serializer import InvoiceDetailSerializer, InvoiceSerializer, invoice_detail_rows, represent_invoices
+from .utils import CustomResponse, conditional_response, invoice_etag, set_validators
+from .views import (
+    InvoiceListMixin, delete_invoice, delete_invoice_detail, save_invoice, save_invoice_detail, save_invoice_detail_update,
+    save_invoice_update
+)
+
+
+class AsyncAPIView(View):
+    """
+    Base of the asynchronous invoice views, a Django view that speaks the subset of Django REST framework the invoice views use.
+
+    The request is wrapped in a DRF `Request`, so `request.data` and `request.query_params` work as in the synchronous views,
+    API exceptions are turned into their error responses, and DRF responses are rendered to JSON right away. Rendering them
+    here rather than letting Django render them later keeps the whole request on the event loop, Django would render a
+    deferred response in a worker thread.
+    """
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    renderer_class = FastJSONRenderer
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # as with APIView, the API is not protected by CSRF tokens
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request, parsers=[parser() for parser in self.parser_classes])
+        try:
+            response = await super().dispatch(request, *args, **kwargs)
+        except APIException as error:
+            response = Response({"detail": error.detail}, status=error.status_code)
+        return self.finalize_response(response)
+
+    def finalize_response(self, response):
+        """
+        Renders a DRF response to a plain `HttpResponse` with the same status, headers and metrics labels.
+        """
+        if not isinstance(response, Response):
+            return response
+        rendered = HttpResponse(
+            self.renderer_class().render(response.data),
+            status=response.status_code,
+            content_type=self.renderer_class.media_type
+        )
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                rendered[header] = value
+        # kept for the test client, as on the responses of the synchronous views
+        rendered.data = response.data
+        labels = getattr(response, 'metrics_labels', None)
+        if labels is not None:
+            label_response(rendered, *labels)
+        return rendered
+
+
+class AsyncInvoiceAPIView(InvoiceListMixin, AsyncAPIView):
+    """
+    Asynchronous version of `InvoiceAPIView`, with the same requests and responses.
+    The invoices are read with the async ORM, the new invoice is saved in a worker thread
+    since the whole invoice is written in a single transaction.
+    """
+    page_number_pagination_class = AsyncPageNumberPagination
+
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def post(self, request):
+        serializer = InvoiceSerializer(data=request.data, context={"request": request})
+        # validation runs no query, duplicates are only caught by the unique index when saving
+        if serializer.is_valid():
+            return await sync_to_async(save_invoice)(serializer)
+        return CustomResponse("invoice", "creation", data=serializer.errors).failure_response()
+
+    async def get(self, request):
+        cache_key = invoice_list_cache.key(request)
+        response = self.cached_list_response(request, cache_key)
+        if response is not None:
+            return response
+
+        try:
+            fieldset = parse_fieldset(request.query_params)
+            invoices, paginator = self.get_list_queryset(request, fieldset[0])
+            page = await paginator.apaginate_queryset(invoices, request)
+        except (InvalidFilter, InvalidCursor) as error:
+            return CustomResponse("invoice", "retrieval").failure_response(message=str(error))
+
+        last_modified = (await invoices.aaggregate(newest=Max('updated_at')))['newest']
+        etag = self.get_list_etag(request, paginator, page)
+        response = conditional_response(request, "invoice", "retrieval", etag, last_modified)
+        if response is not None:
+            return response
+
+        details = [detail async for detail in invoice_detail_rows([invoice['id'] for invoice in page])] if fieldset[1] else []
+        return self.list_response(paginator, page, details, etag, last_modified, cache_key, fieldset)
+
+
+class AsyncSingleInvoiceAPIView(AsyncAPIView):
+    """
+    Asynchronous version of `SingleInvoiceAPIView`, with the same requests and responses.
+    """
+    async def get(self, request, invoice_id):
+        try:
+            fieldset = parse_fieldset(request.query_params)
+        except InvalidFilter as error:
+            return CustomResponse("invoice", "retrieval").failure_response(message=str(error))
+        invoice = await Invoice.objects.filter(id=invoice_id).values(*dict.fromkeys((*fieldset[0], 'id', 'updated_at'))).afirst()
+        if invoice is None:
+            return CustomResponse("invoice", "retrieval").not_found_response()
+        etag = invoice_etag(invoice, None if fieldset == FULL_FIELDSET else fieldset)
+        response = conditional_response(request, "invoice", "retrieval", etag, invoice['updated_at'])
+        if response is not None:
+            return response
+        details = [detail async for detail in invoice_detail_rows([invoice['id']])] if fieldset[1] else []
+        return set_validators(
+            CustomResponse("invoice", "retrieval", data=represent_invoices([invoice], details, *fieldset)[0]).success_response(),
+            etag,
+            invoice['updated_at']
+        )
+
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def put(self, request, invoice_id):
+        return await self.update(request, invoice_id, partial=False)
+
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def patch(self, request, invoice_id):
+        return await self.update(request, invoice_id, partial=True)
+
+    async def update(self, request, invoice_id, partial):
+        invoice = await Invoice.objects.filter(id=invoice_id).afirst()
+        if invoice is None:
+            return CustomResponse("invoice", "update").not_found_response()
+        response = conditional_response(request, "invoice", "update", invoice_etag(invoice), invoice.updated_at)
+        if response is not None:
+            return response
+        context = {"request": request}
+        if 'HTTP_IF_MATCH' in request.META or 'HTTP_IF_UNMODIFIED_SINCE' in request.META:
+            context["expected_updated_at"] = invoice.updated_at
+        serializer = InvoiceSerializer(invoice, data=request.data, partial=partial, context=context)
+        if serializer.is_valid():
+            return await sync_to_async(save_invoice_update)(serializer)
+        return CustomResponse("invoice", "update", data=serializer.errors).failure_response()
+
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def delete(self, request, invoice_id):
+        invoice = await Invoice.objects.filter(id=invoice_id).afirst()
+        if invoice is None:
+            return CustomResponse("invoice", "deletion").not_found_response()
+        return await sync_to_async(delete_invoice)(invoice)
+
+
+class AsyncInvoiceDetailEditAPIView(AsyncAPIView):
+    """
+    Asynchronous version of `InvoiceDetailEditAPIView`, with the same requests and responses.
+    """
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def patch(self, request, invoice_detail_id):
+        invoice_detail = await InvoiceDetail.objects.filter(id=invoice_detail_id).afirst()
+        if invoice_detail is None:
+            return CustomResponse("invoice detail", "update").not_found_response()
+
+        serializer = InvoiceDetailSerializer(invoice_detail, data=request.data, partial=True, context={"request": request})
+        if serializer.is_valid():
+            return await sync_to_async(save_invoice_detail_update)(serializer)
+        return CustomResponse("invoice detail", "update", data=serializer.errors).failure_response()
+
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def delete(self, request, invoice_detail_id):
+        invoice_detail = await InvoiceDetail.objects.filter(id=invoice_detail_id).afirst()
+        if invoice_detail is None:
+            return CustomResponse("invoice detail", "deletion").not_found_response()
+        return await sync_to_async(delete_invoice_detail)(invoice_detail)
+
+
+class AsyncInvoiceDetailCreateAPIView(AsyncAPIView):
+    """
+    Asynchronous version of `InvoiceDetailCreateAPIView`, with the same requests and responses.
+    """
+    @invalidates_invoice_list
+    @retries_when_locked
+    async def post(self, request, invoice_id):
+        invoice = await Invoice.objects.filter(id=invoice_id).afirst()
+        if invoice is None:
+            return CustomResponse(
+                "invoice detail",
+                "creation"
+                ).not_found_response(
+                    message="invoice object not found - invalid invoice id"
+                )
+        serializer = InvoiceDetailSerializer(data=request.data, context={"request": request})
+        if serializer.is_valid():
+            return await sync_to_async(save_invoice_detail)(serializer, invoice)
+        return CustomResponse("invoice detail", "creation", data=serializer.errors).failure_response()
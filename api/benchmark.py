@@ -0,0 +1,638 @@
+import asyncio
+import importlib
+import io
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .cache import invoice_list_cache
+from .database import write_coalescer
+from .models import Invoice, InvoiceDetail
+from .renderers import FastJSONParser, FastJSONRenderer
+from .serializer import INVOICE_FIELDS, InvoiceSerializer, invoice_detail_rows, represent_invoices
+from .views import InvoiceAPIView
+
+SEED = 0
+ITERATIONS = 50
+WARMUP = 3
+THRESHOLD = 0.25
+# differences below this are timer noise rather than regressions, whatever the ratio
+MIN_DELTA_MS = 0.5
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when a benchmarked request does not succeed, since its timing would be meaningless.
+    """
+
+
+def load_data_generator(module: str = 'generate_data'):
+    """
+    Returns a module of the db-scripts directory, which is not a package, the `generate_data` module by default.
+    """
+    scripts_dir = str(settings.BASE_DIR / 'db-scripts')
+    if scripts_dir not in sys.path:
+        sys.path.insert(0, scripts_dir)
+    return importlib.import_module(module)
+
+
+@contextmanager
+def use_database(path, using: str = 'default'):
+    """
+    Points a database connection at another SQLite file for the duration of the block.
+    """
+    connection = connections[using]
+    previous_name = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = str(path)
+    invoice_list_cache.invalidate()
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = previous_name
+        invoice_list_cache.invalidate()
+
+
+@contextmanager
+def copy_database(path):
+    """
+    Copies an SQLite file to a throwaway file next to it for the duration of the block and yields the path of the copy,
+    so a benchmark can commit its writes while the dataset stays the same for every run.
+    The copy goes through the backup API, which includes the pages still in the write-ahead log of the dataset.
+    """
+    descriptor, copy_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix='.copy', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(descriptor)
+    try:
+        source, target = sqlite3.connect(path), sqlite3.connect(copy_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        yield copy_path
+    finally:
+        for leftover in (copy_path, f"{copy_path}-wal", f"{copy_path}-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def sample_ids(queryset, count: int, seed: int = SEED) -> list:
+    """
+    Picks distinct ids spread over the whole table, the same ones on every run over the same data.
+    Each pick is the first id following a random UUID, a single index lookup whatever the size of the table.
+
+    Args:
+        queryset (QuerySet): The rows to pick ids of.
+        count (int): The number of ids to pick, fewer are returned if there are not enough rows.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Returns:
+        list: The picked ids.
+    """
+    rows = queryset.order_by('id').values_list('id', flat=True)
+    generator = random.Random(seed)
+    ids = []
+    for _ in range(count * 4):
+        if len(ids) == count:
+            break
+        picked = rows.filter(id__gte=str(uuid.UUID(int=generator.getrandbits(128), version=4))).first() or rows.first()
+        if picked is not None and picked not in ids:
+            ids.append(picked)
+    return ids
+
+
+def build_scenarios(iterations: int, seed: int = SEED) -> dict:
+    """
+    Builds the requests of every benchmarked endpoint against the invoices of the current database.
+
+    Args:
+        iterations (int): The number of requests of each scenario.
+        seed (int, optional): The seed picking the invoices and details that are requested. Defaults to 0.
+
+    Returns:
+        dict: The list of requests of each scenario keyed by its name, each request being a tuple of
+              the method, the path and the JSON body, and a flag telling whether the list cache has to be cleared first.
+    """
+    invoice_ids = sample_ids(Invoice.objects.all(), iterations, seed)
+    if not invoice_ids:
+        raise BenchmarkError("the database does not hold any invoice")
+    invoices = {invoice.id: invoice for invoice in Invoice.objects.filter(id__in=invoice_ids)}
+    # details of invoices with several lines, so deleting one never empties an invoice,
+    # and of other invoices than the ones whose details are all replaced by the put requests
+    detail_ids = sample_ids(
+        InvoiceDetail.objects.filter(invoice__line_count__gt=1).exclude(invoice_id__in=invoice_ids), iterations, seed + 1
+    )
+    if not detail_ids:
+        raise BenchmarkError("the database does not hold enough invoices with several details")
+    search_words = Invoice.objects.get(id=invoice_ids[0]).first_description.split()[:1] or ['a']
+
+    def cycle(values):
+        return [values[index % len(values)] for index in range(iterations)]
+
+    list_path = reverse('invoice-list')
+    line = {"description": "Benchmark item", "quantity": 2, "unit_price": "12.50"}
+    scenarios = {
+        'list': [('get', list_path, None, True)] * iterations,
+        'search': [('get', f'{list_path}?search={search_words[0]}', None, True)] * iterations,
+        'search_relevance': [('get', f'{list_path}?search={search_words[0]}&sort=relevance', None, True)] * iterations,
+    }
+    for sort_key in InvoiceAPIView.sort_by_fields:
+        if sort_key != 'relevance':
+            scenarios[f'sort_{sort_key}'] = [('get', f'{list_path}?sort={sort_key}', None, True)] * iterations
+    scenarios.update({
+        'get': [('get', reverse('single-invoice', args=[invoice_id]), None, False) for invoice_id in cycle(invoice_ids)],
+        'put': [
+            ('put', reverse('invoice-update', args=[invoice_id]), {
+                "customer_name": invoices[invoice_id].customer_name,
+                "invoice_date": invoices[invoice_id].invoice_date.isoformat(),
+                "invoice_details": [line, line, line]
+            }, False)
+            for invoice_id in cycle(invoice_ids)
+        ],
+        'patch': [
+            ('patch', reverse('invoice-partial-update', args=[invoice_id]), {"customer_name": invoices[invoice_id].customer_name}, False)
+            for invoice_id in cycle(invoice_ids)
+        ],
+        'detail_create': [('post', reverse('invoice-detail-create', args=[invoice_id]), line, False) for invoice_id in cycle(invoice_ids)],
+        'detail_edit': [
+            ('patch', reverse('invoice-detail-partial-update', args=[detail_id]), {"quantity": 3}, False) for detail_id in cycle(detail_ids)
+        ],
+        # every deleted detail is gone for the following requests, so each request deletes a different one
+        'detail_delete': [('delete', reverse('invoice-detail-delete', args=[detail_id]), None, False) for detail_id in detail_ids],
+    })
+    return scenarios
+
+
+def summarize(timings: list) -> dict:
+    """
+    Returns the latency percentiles in milliseconds and the throughput of a list of request durations in seconds.
+    """
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 3),
+        "p50_ms": round(statistics.median(timings) * 1000, 3),
+        "p95_ms": round(timings[min(len(timings) - 1, math.ceil(len(timings) * 0.95) - 1)] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3),
+        "throughput_rps": round(len(timings) / sum(timings), 1),
+    }
+
+
+def run_scenarios(iterations: int = ITERATIONS, warmup: int = WARMUP, seed: int = SEED, only=None) -> dict:
+    """
+    Sends the requests of every scenario through the whole Django stack and measures them.
+    Every write request commits like it does in production, retries and write coalescing included, so the writes stay
+    in the database: run it against a copy of the dataset, see `copy_database`, to start every run from the same data.
+    The invoice list cache is cleared before each list request, the measured time is the one of building the page.
+
+    Args:
+        iterations (int, optional): The number of measured requests of each scenario. Defaults to 50.
+        warmup (int, optional): The number of requests sent before measuring each scenario. Defaults to 3.
+        seed (int, optional): The seed picking the invoices and details that are requested. Defaults to 0.
+        only (iterable, optional): The names of the scenarios to run, all of them by default.
+
+    Returns:
+        dict: The measurements of each scenario keyed by its name.
+
+    Raises:
+        BenchmarkError: If a request does not succeed.
+    """
+    client = Client()
+    results = {}
+    scenarios = build_scenarios(iterations + warmup, seed)
+    for name, requests in scenarios.items():
+        if only and name not in only:
+            continue
+        timings = []
+        for index, (method, path, body, clear_cache) in enumerate(requests):
+            if clear_cache:
+                invoice_list_cache.invalidate()
+            started = time.perf_counter()
+            if body is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, body, content_type='application/json')
+            elapsed = time.perf_counter() - started
+            if response.status_code >= 400:
+                raise BenchmarkError(f"{name}: {method.upper()} {path} returned {response.status_code}")
+            if index >= warmup:
+                timings.append(elapsed)
+        if timings:
+            results[name] = summarize(timings)
+    invoice_list_cache.invalidate()
+    return results
+
+
+def run_serializer_comparison(iterations: int = ITERATIONS, warmup: int = WARMUP, page_size: int = 100) -> dict:
+    """
+    Measures building the JSON of pages of invoices with `InvoiceSerializer` over model instances with prefetched details,
+    against the read-only path of the endpoints over `values()` rows, queries included, and checks both give the same bytes.
+
+    Args:
+        iterations (int, optional): The number of measured pages of each path. Defaults to 50.
+        warmup (int, optional): The number of pages built before measuring. Defaults to 3.
+        page_size (int, optional): The number of invoices per page. Defaults to 100.
+
+    Returns:
+        dict: The measurements of the `serialize_drf` and `serialize_values` scenarios.
+
+    Raises:
+        BenchmarkError: If the two paths do not render the same JSON.
+    """
+    invoices = Invoice.objects.order_by('-invoice_date', 'id')
+    renderer = JSONRenderer()
+
+    def drf_page(offset):
+        page = invoices[offset:offset + page_size].prefetch_related('invoice_details')
+        return renderer.render(InvoiceSerializer(page, many=True).data)
+
+    def values_page(offset):
+        page = list(invoices.values(*INVOICE_FIELDS)[offset:offset + page_size])
+        return renderer.render(represent_invoices(page, invoice_detail_rows([invoice['id'] for invoice in page])))
+
+    count = invoices.count()
+    offsets = [(index * page_size * 7) % max(count - page_size, 1) for index in range(iterations + warmup)]
+    if drf_page(offsets[0]) != values_page(offsets[0]):
+        raise BenchmarkError("the values() representation differs from the serializer output")
+    results = {}
+    for name, build_page in (('serialize_drf', drf_page), ('serialize_values', values_page)):
+        timings = []
+        for index, offset in enumerate(offsets):
+            started = time.perf_counter()
+            build_page(offset)
+            if index >= warmup:
+                timings.append(time.perf_counter() - started)
+        results[name] = summarize(timings)
+    return results
+
+
+def run_json_comparison(iterations: int = ITERATIONS, warmup: int = WARMUP, page_size: int = 1000) -> dict:
+    """
+    Measures rendering a large list response with `JSONRenderer` against `FastJSONRenderer`,
+    and parsing it back with `JSONParser` against `FastJSONParser`, and checks both renderers give the same bytes.
+
+    Args:
+        iterations (int, optional): The number of measured runs of each scenario. Defaults to 50.
+        warmup (int, optional): The number of runs before measuring. Defaults to 3.
+        page_size (int, optional): The number of invoices in the response. Defaults to 1000.
+
+    Returns:
+        dict: The measurements of the `render_stdlib`, `render_fast`, `parse_stdlib` and `parse_fast` scenarios.
+
+    Raises:
+        BenchmarkError: If the two renderers do not give the same JSON.
+    """
+    invoices = list(Invoice.objects.order_by('-invoice_date', 'id').values(*INVOICE_FIELDS)[:page_size])
+    data = {
+        "count": len(invoices),
+        "next": None,
+        "previous": None,
+        "results": {
+            "message": "successfully retrieved invoices",
+            "data": represent_invoices(invoices, invoice_detail_rows([invoice['id'] for invoice in invoices])),
+        },
+    }
+    content = JSONRenderer().render(data)
+    if FastJSONRenderer().render(data) != content:
+        raise BenchmarkError("FastJSONRenderer does not render the same JSON as JSONRenderer")
+    scenarios = {
+        'render_stdlib': lambda: JSONRenderer().render(data),
+        'render_fast': lambda: FastJSONRenderer().render(data),
+        'parse_stdlib': lambda: JSONParser().parse(io.BytesIO(content)),
+        'parse_fast': lambda: FastJSONParser().parse(io.BytesIO(content)),
+    }
+    results = {}
+    for name, run in scenarios.items():
+        timings = []
+        for index in range(iterations + warmup):
+            started = time.perf_counter()
+            run()
+            if index >= warmup:
+                timings.append(time.perf_counter() - started)
+        results[name] = summarize(timings)
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float = THRESHOLD, min_delta_ms: float = MIN_DELTA_MS) -> list:
+    """
+    Compares the median latencies of a benchmark run with the ones of a baseline run.
+
+    Args:
+        results (dict): The measurements of each scenario keyed by dataset size, as written by the benchmark.
+        baseline (dict): The baseline measurements in the same format.
+        threshold (float, optional): The allowed slowdown, 0.25 allows medians up to 25% slower. Defaults to 0.25.
+        min_delta_ms (float, optional): Slowdowns smaller than this many milliseconds are ignored as noise. Defaults to 0.5.
+
+    Returns:
+        list: A description of each scenario that got slower than allowed, empty if none did.
+    """
+    regressions = []
+    for size, scenarios in results.items():
+        for name, measurement in scenarios.items():
+            reference = baseline.get(size, {}).get(name)
+            if reference is None:
+                continue
+            limit = reference["p50_ms"] * (1 + threshold)
+            if measurement["p50_ms"] > limit and measurement["p50_ms"] - reference["p50_ms"] > min_delta_ms:
+                regressions.append(
+                    f"{name} on {size} invoices: median {measurement['p50_ms']:.2f} ms, "
+                    f"baseline {reference['p50_ms']:.2f} ms (+{measurement['p50_ms'] / reference['p50_ms'] - 1:.0%})"
+                )
+    return regressions
+
+
+def build_load_requests(names, count: int = ITERATIONS, seed: int = SEED) -> list:
+    """
+    Builds the requests of a load test against the invoices of the current database, the same ones on every run.
+    Only requests that leave the data as it was are used, so the load test can run against any server for any time.
+
+    Args:
+        names (iterable): The scenarios to mix, among list, search, get and patch.
+        count (int, optional): The number of distinct invoices requested by the get and patch scenarios. Defaults to 50.
+        seed (int, optional): The seed picking the invoices. Defaults to 0.
+
+    Returns:
+        list: The requests, each one a tuple of the method, the path and the JSON body or None.
+    """
+    invoices = list(Invoice.objects.filter(id__in=sample_ids(Invoice.objects.all(), count, seed)))
+    if not invoices:
+        raise BenchmarkError("the database does not hold any invoice")
+    list_path = reverse('invoice-list')
+    search_word = (invoices[0].first_description.split() or ['a'])[0]
+    scenarios = {
+        'list': [('GET', list_path, None)],
+        'search': [('GET', f'{list_path}?search={search_word}', None)],
+        'get': [('GET', reverse('single-invoice', args=[invoice.id]), None) for invoice in invoices],
+        'patch': [
+            ('PATCH', reverse('invoice-partial-update', args=[invoice.id]), {"customer_name": invoice.customer_name})
+            for invoice in invoices
+        ],
+    }
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        raise BenchmarkError(f"unknown load test scenarios: {', '.join(sorted(unknown))}")
+    return [request for name in names for request in scenarios[name]]
+
+
+async def send_request(reader, writer, host: str, method: str, path: str, body) -> int:
+    """
+    Sends a request over an open HTTP/1.1 connection, reads the whole response and returns its status code.
+    """
+    content = b"" if body is None else json.dumps(body).encode()
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(content)}\r\n"
+    if body is not None:
+        head += "Content-Type: application/json\r\n"
+    writer.write(head.encode() + b"\r\n" + content)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by the server")
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while size := int((await reader.readline()).split(b";")[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    if headers.get('connection', '').lower() == 'close':
+        raise ConnectionResetError("connection closed by the server")
+    return int(status_line.split()[1])
+
+
+async def run_load_test(url: str, requests: list, concurrency: int, duration: float) -> dict:
+    """
+    Keeps `concurrency` keep-alive connections busy sending the requests in turn for `duration` seconds,
+    and measures the latency of every response along with the overall throughput.
+
+    Args:
+        url (str): The root url of the server, e.g. http://127.0.0.1:8000.
+        requests (list): The requests to send, as built by `build_load_requests`.
+        concurrency (int): The number of connections open at the same time.
+        duration (float): The number of seconds to send requests for.
+
+    Returns:
+        dict: The latency percentiles, the number of requests per second and the number of failed requests.
+    """
+    target = urlsplit(url)
+    host, port = target.hostname, target.port or 80
+    timings = []
+    failures = 0
+    deadline = time.perf_counter() + duration
+
+    async def connection_worker(offset: int):
+        nonlocal failures
+        reader = writer = None
+        index = offset
+        while time.perf_counter() < deadline:
+            method, path, body = requests[index % len(requests)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                status_code = await send_request(reader, writer, target.netloc, method, path, body)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                failures += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                continue
+            timings.append(time.perf_counter() - started)
+            if status_code >= 400:
+                failures += 1
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection_worker(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if not timings:
+        raise BenchmarkError(f"no request to {url} succeeded")
+    results = summarize(timings)
+    # the connections overlap, so the throughput is the one of the whole run rather than the sum of the latencies
+    results["throughput_rps"] = round(len(timings) / elapsed, 1)
+    results["failures"] = failures
+    results["concurrency"] = concurrency
+    return results
+
+
+@contextmanager
+def use_sqlite_profile(profile: str, using: str = 'default'):
+    """
+    Applies another SQLite connection profile for the duration of the block, reconnecting so it takes effect.
+    The journal mode is stored in the database file, so the profile of the block stays in place afterwards
+    until the next connection sets its own.
+    """
+    connections[using].close()
+    try:
+        with override_settings(SQLITE_PROFILE=profile, SQLITE_PRAGMAS={}):
+            yield
+    finally:
+        connections[using].close()
+
+
+def run_contention(readers: int, writers: int, duration: float, seed: int = SEED) -> dict:
+    """
+    Reads and writes invoices from several threads at once for `duration` seconds, each thread with its own connection,
+    and counts the requests that succeeded and the ones that failed because the database was locked.
+    The readers get single invoices and the writers partially update invoices with their own customer name,
+    which goes through the whole write path, retries included, while leaving the invoices as they were.
+
+    Args:
+        readers (int): The number of reading threads.
+        writers (int): The number of writing threads.
+        duration (float): The number of seconds to run for.
+        seed (int, optional): The seed picking the invoices. Defaults to 0.
+
+    Returns:
+        dict: The number of reads and writes per second, their median latency and the number of failed requests.
+    """
+    invoices = list(Invoice.objects.filter(id__in=sample_ids(Invoice.objects.all(), ITERATIONS, seed)))
+    if not invoices:
+        raise BenchmarkError("the database does not hold any invoice")
+    connections['default'].close()
+    timings = {"read": [], "write": []}
+    failures = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(kind: str, offset: int):
+        client = Client(raise_request_exception=False)
+        index = offset
+        try:
+            while time.perf_counter() < deadline:
+                invoice = invoices[index % len(invoices)]
+                index += 1
+                started = time.perf_counter()
+                if kind == "read":
+                    response = client.get(reverse('single-invoice', args=[invoice.id]))
+                else:
+                    response = client.patch(
+                        reverse('invoice-partial-update', args=[invoice.id]), {"customer_name": invoice.customer_name},
+                        content_type='application/json'
+                    )
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if response.status_code >= 400:
+                        failures[kind] += 1
+                    else:
+                        timings[kind].append(elapsed)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=("read", offset)) for offset in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write", offset)) for offset in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    invoice_list_cache.invalidate()
+    return {
+        kind: {
+            "per_second": round(len(timings[kind]) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings[kind]) * 1000, 3) if timings[kind] else None,
+            "failures": failures[kind],
+        }
+        for kind in ("read", "write")
+    }
+
+
+def run_write_coalescing(concurrency_levels, duration: float, seed: int = SEED) -> dict:
+    """
+    Edits invoice details from a growing number of threads for `duration` seconds per level, without and then with
+    the write coalescer, to draw the write throughput against the concurrency. Each thread has its own connection
+    and writes details back with their own quantity, which goes through the whole write path.
+
+    Args:
+        concurrency_levels (list): The numbers of writing threads to measure.
+        duration (float): The number of seconds each level runs for, in each mode.
+        seed (int, optional): The seed picking the invoice details. Defaults to 0.
+
+    Returns:
+        dict: For each number of threads and each mode ("off" and "on"), the number of writes per second,
+              their median and 95th percentile latency, the number of failed requests and the average batch size.
+    """
+    details = list(
+        InvoiceDetail.objects.filter(id__in=sample_ids(InvoiceDetail.objects.all(), ITERATIONS * 4, seed)).values('id', 'quantity')
+    )
+    if not details:
+        raise BenchmarkError("the database does not hold any invoice detail")
+    connections['default'].close()
+
+    def measure(writers: int) -> dict:
+        timings = []
+        failures = 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def worker(offset: int):
+            nonlocal failures
+            client = Client(raise_request_exception=False)
+            index = offset
+            try:
+                while time.perf_counter() < deadline:
+                    detail = details[index % len(details)]
+                    index += writers
+                    started = time.perf_counter()
+                    response = client.patch(
+                        reverse('invoice-detail-partial-update', args=[detail['id']]), {"quantity": detail['quantity']},
+                        content_type='application/json'
+                    )
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        if response.status_code >= 400:
+                            failures += 1
+                        else:
+                            timings.append(elapsed)
+            finally:
+                connections.close_all()
+
+        write_coalescer.reset_stats()
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        return {
+            "per_second": round(len(timings) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings) * 1000, 3) if timings else None,
+            "p95_ms": round(timings[math.ceil(len(timings) * 0.95) - 1] * 1000, 3) if timings else None,
+            "failures": failures,
+            "average_batch": write_coalescer.stats()["average_batch"] or 1,
+        }
+
+    results = {}
+    for writers in concurrency_levels:
+        results[writers] = {}
+        for mode, enabled in (("off", False), ("on", True)):
+            with override_settings(WRITE_COALESCING=enabled):
+                results[writers][mode] = measure(writers)
+    invoice_list_cache.invalidate()
+    return results
@@ -0,0 +1,177 @@
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Invoice, InvoiceDetail
+
+LIST_CACHE_ALIAS = 'invoice_list'
+GENERATION_FILE = 'invoice-list.generation'
+
+
+class InvoiceListCache:
+    """
+    Caches the responses of the invoice list, keyed by the normalized query parameters of the request.
+
+    Every key contains the current generation of the cache. Writes simply bump the generation,
+    which makes every entry unreachable at once without enumerating the keys; the orphaned entries
+    are evicted by the cache backend as the least recently used ones or when their TTL expires.
+
+    The entries live in the memory of each worker process, but the generation is kept in a file of the
+    INVOICE_LIST_CACHE_DIR directory, so a write served by one worker invalidates the entries of all of them.
+    """
+    def __init__(self, alias: str = LIST_CACHE_ALIAS, generation_dir: str = None):
+        """
+        Initializes an `InvoiceListCache` instance.
+
+        Args:
+            alias (str, optional): The alias of the cache in the CACHES setting. Defaults to 'invoice_list'.
+            generation_dir (str, optional): The directory of the generation file, shared by the worker processes.
+                                            Defaults to the INVOICE_LIST_CACHE_DIR setting.
+        """
+        self.alias = alias
+        self.generation_dir = generation_dir
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def generation_path(self) -> str:
+        return os.path.join(self.generation_dir or settings.INVOICE_LIST_CACHE_DIR, GENERATION_FILE)
+
+    def read_generation(self):
+        try:
+            with open(self.generation_path, encoding='ascii') as file:
+                return int(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def generation(self) -> int:
+        """
+        Returns the current generation of the cache, read from the generation file shared by the worker processes.
+        A missing counter is started from the current time, so it can never go back to a generation that was used before.
+        """
+        generation = self.read_generation()
+        if generation is None:
+            generation = self.invalidate()
+        return generation
+
+    def key(self, request) -> str:
+        """
+        Returns the cache key of a list request.
+        The query parameters are sorted and the first page is treated the same as no page,
+        the page links in the response are built from the same sorted parameters so such requests get identical responses.
+        The host is part of the key because the page links are absolute.
+
+        Args:
+            request (Request): The list request.
+
+        Returns:
+            str: The key of the response in the current generation.
+        """
+        params = sorted(
+            (name, value)
+            for name, values in request.query_params.lists()
+            for value in values
+            if not (name == 'page' and value == '1')
+        )
+        digest = hashlib.md5(repr((request.get_host(), request.path, params)).encode(), usedforsecurity=False).hexdigest()
+        return f"page:{self.generation()}:{digest}"
+
+    def get(self, key: str):
+        """
+        Returns the cached entry stored under the key, or None, and counts the hit or miss.
+        """
+        entry = self.cache.get(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def set(self, key: str, entry: dict):
+        self.cache.set(key, entry)
+
+    def invalidate(self) -> int:
+        """
+        Makes every cached response of every worker process unreachable by moving to the next generation.
+        The generation only ever grows and is written to a temporary file first, so a worker never reads
+        a half written generation nor one it has already used, even when several workers write at once.
+
+        Returns:
+            int: The new generation.
+        """
+        generation = max(time.time_ns(), (self.read_generation() or 0) + 1)
+        path = self.generation_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, 'w', encoding='ascii') as file:
+            file.write(str(generation))
+        os.replace(temporary_path, path)
+        return generation
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counts of this process along with the size limits of the cache.
+        """
+        options = settings.CACHES[self.alias]
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "max_entries": options.get('OPTIONS', {}).get('MAX_ENTRIES'),
+            "timeout": options.get('TIMEOUT'),
+        }
+
+
+invoice_list_cache = InvoiceListCache()
+
+
+def invalidates_invoice_list(method):
+    """
+    Decorates a write method of a view so the invoice list cache is invalidated once the write has been committed.
+    Failed requests do not change any invoice and leave the cache untouched.
+    Works on the methods of the asynchronous views as well.
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            response = await method(self, request, *args, **kwargs)
+            if response.status_code < 400:
+                invoice_list_cache.invalidate()
+            return response
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        response = method(self, request, *args, **kwargs)
+        if response.status_code < 400:
+            invoice_list_cache.invalidate()
+        return response
+    return wrapper
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=InvoiceDetail)
+@receiver(post_delete, sender=InvoiceDetail)
+def invalidate_on_model_write(sender, **kwargs):
+    """
+    Invalidates the list cache for writes made outside of the views, e.g. from the shell or a management command.
+    Bulk operations do not send these signals and have to invalidate the cache themselves.
+    """
+    invoice_list_cache.invalidate()
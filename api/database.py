@@ -0,0 +1,261 @@
+import asyncio
+import functools
+import inspect
+import logging
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# PRAGMAs run on every new SQLite connection, by profile name
+SQLITE_PROFILES = {
+    # the defaults of SQLite: a rollback journal, readers and the writer block each other
+    "rollback": {
+        "journal_mode": "delete",
+        "synchronous": "full",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "default",
+        "busy_timeout": 5000,
+    },
+    # a write-ahead log: readers are never blocked by the writer, and commits only sync the log at checkpoints
+    "wal": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -65536,
+        "mmap_size": 0,
+        "temp_store": "memory",
+        "busy_timeout": 5000,
+    },
+    # the write-ahead log with the database file mapped in memory, so reads do not copy the pages out of the OS cache
+    "wal-mmap": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+        "busy_timeout": 5000,
+    },
+}
+PRAGMA_VALUE = re.compile(r"^-?\w+$")
+LOCKED_MESSAGES = ("database is locked", "database table is locked")
+
+
+def sqlite_pragmas(profile: str = None) -> dict:
+    """
+    Returns the PRAGMAs of a connection profile, with the ones of the SQLITE_PRAGMAS setting taking precedence.
+
+    Args:
+        profile (str, optional): The name of the profile. Defaults to the SQLITE_PROFILE setting.
+
+    Raises:
+        ImproperlyConfigured: If the profile does not exist or a PRAGMA is not one of the profiles.
+    """
+    profile = profile or settings.SQLITE_PROFILE
+    if profile not in SQLITE_PROFILES:
+        raise ImproperlyConfigured(f"unknown SQLite profile {profile!r}, choose one of {', '.join(SQLITE_PROFILES)}")
+    pragmas = {**SQLITE_PROFILES[profile], **settings.SQLITE_PRAGMAS}
+    for name, value in pragmas.items():
+        # the values are written into the statements, PRAGMAs take no parameters
+        if name not in SQLITE_PROFILES["rollback"] or not PRAGMA_VALUE.match(str(value)):
+            raise ImproperlyConfigured(f"invalid SQLite PRAGMA {name} = {value!r}")
+    return pragmas
+
+
+@receiver(connection_created)
+def apply_sqlite_profile(sender, connection, **kwargs):
+    """
+    Sets the PRAGMAs of the SQLite profile on every new connection.
+    The raw connection is used, so the PRAGMAs are not counted as queries of the request that opened the connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.connection.cursor()
+    try:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def is_locked_error(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and any(message in str(error) for message in LOCKED_MESSAGES)
+
+
+def retry_delays():
+    """
+    Yields the pauses before each retry of a write, doubling every time from SQLITE_RETRY_BACKOFF seconds,
+    with some jitter so the writers that collided do not collide again.
+    """
+    for attempt in range(settings.SQLITE_WRITE_RETRIES):
+        yield settings.SQLITE_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+def can_retry(error: Exception) -> bool:
+    # a write nested in the transaction of a caller cannot be replayed on its own, the caller has to roll back first
+    return is_locked_error(error) and not transaction.get_connection().in_atomic_block
+
+
+def retries_when_locked(method):
+    """
+    Decorates a write method of a view so it is run again, after a growing pause, when SQLite reports the database as locked.
+    The busy timeout already waits for the lock, but SQLite gives up at once when waiting could deadlock, for instance
+    when a transaction that has read the database wants to write after another one did. Replaying the whole method is
+    safe since the failed transaction was rolled back. The error is raised once SQLITE_WRITE_RETRIES retries failed.
+    Works on the methods of the asynchronous views as well.
+    """
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            for delay in (*retry_delays(), None):
+                try:
+                    return await method(self, request, *args, **kwargs)
+                except OperationalError as error:
+                    if delay is None or not can_retry(error):
+                        raise
+                    logger.warning("%s %s retried in %.3f s: %s", request.method, request.path, delay, error)
+                    await asyncio.sleep(delay)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        for delay in (*retry_delays(), None):
+            try:
+                return method(self, request, *args, **kwargs)
+            except OperationalError as error:
+                if delay is None or not can_retry(error):
+                    raise
+                logger.warning("%s %s retried in %.3f s: %s", request.method, request.path, delay, error)
+                time.sleep(delay)
+    return wrapper
+
+
+class PendingWrite:
+    """
+    A write handed to the `WriteCoalescer`, with its outcome once its batch is committed.
+    """
+    def __init__(self, write):
+        self.write = write
+        # the statements of the write are reported to the query instrumentation of the request that submitted it
+        self.execute_wrappers = list(transaction.get_connection().execute_wrappers)
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    Group commit of small concurrent writes, enabled by the WRITE_COALESCING setting.
+
+    SQLite has a single writer and every transaction pays for its commit, so many clients each adding a line
+    to an invoice queue up on the lock one commit at a time. The coalescer runs the writes that arrive together
+    in a single transaction instead: the first write becomes the leader of a batch, waits WRITE_COALESCING_WINDOW
+    seconds or until WRITE_COALESCING_MAX_BATCH writes joined, then waits for the batch committing before it,
+    which lets more writes join, and runs the whole batch. Each write runs in its own savepoint, so a failing
+    write is rolled back on its own and its error is raised in the thread that submitted it, the others still
+    commit. If the commit itself fails every write of the batch gets the error, as a single write would have.
+
+    The writes of a process are coalesced across its threads, the worker processes of a server each have their own.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.commit_lock = threading.Lock()
+        self.pending = []
+        self.collecting = False
+        self.batches = 0
+        self.writes = 0
+
+    def run(self, write):
+        """
+        Runs a write in a transaction, together with the concurrent writes when coalescing is enabled.
+
+        Args:
+            write (callable): The write, called without arguments.
+
+        Returns:
+            The value returned by the write.
+
+        Raises:
+            Exception: The error raised by the write, or by the commit of its batch.
+        """
+        # a write nested in the transaction of a caller is committed with it, it cannot join a batch of other threads
+        if not settings.WRITE_COALESCING or transaction.get_connection().in_atomic_block:
+            with transaction.atomic():
+                return write()
+
+        item = PendingWrite(write)
+        with self.condition:
+            self.pending.append(item)
+            leader = not self.collecting
+            self.collecting = True
+            self.condition.notify_all()
+        if leader:
+            self.lead()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def lead(self):
+        """
+        Collects the writes of a batch and commits them, run by the thread of the first write of the batch.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.pending) >= settings.WRITE_COALESCING_MAX_BATCH, timeout=settings.WRITE_COALESCING_WINDOW
+            )
+        with self.commit_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+                self.collecting = False
+            self.commit(batch)
+
+    def commit(self, batch: list):
+        connection = transaction.get_connection()
+        execute_wrappers = connection.execute_wrappers
+        try:
+            with transaction.atomic():
+                for item in batch:
+                    connection.execute_wrappers = item.execute_wrappers
+                    try:
+                        with transaction.atomic():
+                            item.result = item.write()
+                    except Exception as error:
+                        item.error = error
+                    finally:
+                        connection.execute_wrappers = execute_wrappers
+        except Exception as error:
+            for item in batch:
+                item.result, item.error = None, error
+        finally:
+            with self.condition:
+                self.batches += 1
+                self.writes += len(batch)
+            for item in batch:
+                item.done.set()
+
+    def stats(self) -> dict:
+        """
+        Returns the number of batches committed and of writes in them, and the average batch size.
+        """
+        with self.condition:
+            return {
+                "batches": self.batches,
+                "writes": self.writes,
+                "average_batch": round(self.writes / self.batches, 2) if self.batches else 0,
+            }
+
+    def reset_stats(self):
+        with self.condition:
+            self.batches = self.writes = 0
+
+
+write_coalescer = WriteCoalescer()
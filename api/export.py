@@ -0,0 +1,69 @@
+import csv
+from itertools import islice
+
+from .models import InvoiceDetail
+from .renderers import dumps
+from .serializer import DETAIL_FIELDS, INVOICE_FIELDS, invoice_representation
+
+BATCH_SIZE = 500
+
+CSV_HEADER = (
+    'invoice_id', 'customer_name', 'invoice_date', 'total_amount', 'line_count',
+    'detail_id', 'description', 'quantity', 'unit_price', 'price'
+)
+
+
+def iter_invoice_batches(invoices, batch_size: int = BATCH_SIZE):
+    """
+    Walks the invoices with a chunked iterator and yields them in batches, each invoice along with its details.
+    The details of a whole batch are fetched with a single query, so only one batch is held in memory at a time.
+
+    Args:
+        invoices (QuerySet): The invoices to walk, in the order they should be exported.
+        batch_size (int, optional): The number of invoices per batch. Defaults to 500.
+
+    Yields:
+        list: Pairs of an invoice and the list of its details, both as dictionaries of field values.
+    """
+    rows = invoices.values(*INVOICE_FIELDS).iterator(chunk_size=batch_size)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        details = {invoice['id']: [] for invoice in batch}
+        for detail in InvoiceDetail.objects.filter(invoice_id__in=details).order_by('invoice_id', '-created_at').values('invoice_id', *DETAIL_FIELDS):
+            details[detail.pop('invoice_id')].append(detail)
+        yield [(invoice, details[invoice['id']]) for invoice in batch]
+
+
+def export_ndjson(invoices, batch_size: int = BATCH_SIZE):
+    """
+    Yields the invoices as newline delimited JSON, one invoice with its details per line,
+    in the same representation and detail order as the invoice endpoints, and encoded as their JSON responses are.
+    """
+    for batch in iter_invoice_batches(invoices, batch_size):
+        yield b'\n'.join(dumps(invoice_representation(invoice, details)) for invoice, details in batch) + b'\n'
+
+
+class LineBuffer:
+    """
+    A file-like object that hands back whatever is written to it, so `csv.writer` can format rows without buffering them.
+    """
+    def write(self, value):
+        return value
+
+
+def export_csv(invoices, batch_size: int = BATCH_SIZE):
+    """
+    Yields the invoices as CSV with a header, one row per invoice detail with the invoice columns repeated.
+    Invoices without details get a single row with empty detail columns.
+    """
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(CSV_HEADER)
+    for batch in iter_invoice_batches(invoices, batch_size):
+        rows = []
+        for invoice, details in batch:
+            invoice_columns = [invoice[field] for field in INVOICE_FIELDS]
+            for detail in details or [dict.fromkeys(DETAIL_FIELDS, '')]:
+                rows.append(writer.writerow(invoice_columns + [detail[field] for field in DETAIL_FIELDS]))
+        yield ''.join(rows)
@@ -0,0 +1,134 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .search import search_invoices
+from .serializer import INVOICE_FIELDS
+
+
+class InvalidFilter(ValueError):
+    """
+    Raised when a filter query parameter has a value that cannot be used.
+    """
+
+
+def parse_amount(param: str, value: str) -> Decimal:
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise InvalidFilter(f"{param} must be a number")
+    return amount
+
+
+def parse_date(param: str, value: str):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise InvalidFilter(f"{param} must be a date in the YYYY-MM-DD format")
+
+
+def parse_timestamp(param: str, value: str) -> datetime:
+    """
+    Parses a date and time in the ISO 8601 format, or a date alone meaning its midnight.
+    A time without a time zone is taken in the time zone of the project.
+    """
+    try:
+        timestamp = parse_datetime(value)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise InvalidFilter(f"{param} must be a date and time in the ISO 8601 format, e.g. 2024-01-31T12:00:00Z, or a date")
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def parse_month(param: str, value: str):
+    """
+    Returns the first day of a month given in the YYYY-MM format.
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise InvalidFilter(f"{param} must be a month in the YYYY-MM format")
+
+
+def parse_limit(param: str, value: str, maximum: int) -> int:
+    if not value.isdigit() or not 1 <= int(value) <= maximum:
+        raise InvalidFilter(f"{param} must be a number between 1 and {maximum}")
+    return int(value)
+
+
+# the whole invoices, details included
+FULL_FIELDSET = (INVOICE_FIELDS, True)
+
+
+def parse_fieldset(query_params) -> tuple:
+    """
+    Reads the parts of the invoices a client asks for from the `fields` and `include` query parameters.
+
+    `fields` is a comma separated list of invoice fields, all of them by default. The details of the invoices are
+    returned with `include=details`, or when `invoice_details` is one of the fields. Without either parameter the
+    invoices are returned whole, details included, as they always were.
+
+    Args:
+        query_params (QueryDict): The query parameters of the request.
+
+    Returns:
+        tuple: The invoice fields to return, in the order of the full representation, and whether to return the details.
+
+    Raises:
+        InvalidFilter: If a field or an included part does not exist.
+    """
+    if 'fields' not in query_params and 'include' not in query_params:
+        return FULL_FIELDSET
+    requested = {field.strip() for field in query_params.get('fields', '').split(',') if field.strip()}
+    included = {part.strip() for part in query_params.get('include', '').split(',') if part.strip()}
+    unknown = requested - {*INVOICE_FIELDS, 'invoice_details'}
+    if unknown:
+        raise InvalidFilter(f"unknown fields {', '.join(sorted(unknown))}, choose among {', '.join(INVOICE_FIELDS)} and invoice_details")
+    if included - {'details'}:
+        raise InvalidFilter("include only accepts details")
+    fields = tuple(field for field in INVOICE_FIELDS if field in requested) if requested - {'invoice_details'} else INVOICE_FIELDS
+    return fields, 'details' in included or 'invoice_details' in requested
+
+
+def filter_invoices(invoices, query_params):
+    """
+    Applies the filters shared by the invoice list and the invoice export to a queryset of invoices.
+
+    The supported query parameters are:
+        search (str): words matching the customer name or invoice detail descriptions, using the full-text index.
+        min_total, max_total (number): bounds of the total amount of the invoices.
+        date_from, date_to (YYYY-MM-DD): bounds of the invoice date, both included.
+        created_since (ISO 8601 date and time, or YYYY-MM-DD): earliest creation time of the invoices, included.
+
+    Args:
+        invoices (QuerySet): The invoices to filter.
+        query_params (QueryDict): The query parameters of the request.
+
+    Returns:
+        QuerySet: The filtered invoices.
+
+    Raises:
+        InvalidFilter: If a parameter has an invalid value.
+    """
+    search_query = query_params.get('search')
+    if search_query:
+        invoices = search_invoices(invoices, search_query)
+
+    for param, lookup, parse in (
+        ('min_total', 'total_amount__gte', parse_amount),
+        ('max_total', 'total_amount__lte', parse_amount),
+        ('date_from', 'invoice_date__gte', parse_date),
+        ('date_to', 'invoice_date__lte', parse_date),
+        ('created_since', 'created_at__gte', parse_timestamp),
+    ):
+        value = query_params.get(param)
+        if value:
+            invoices = invoices.filter(**{lookup: parse(param, value)})
+    return invoices
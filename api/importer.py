@@ -0,0 +1,469 @@
+import csv
+import json
+import os
+from contextlib import contextmanager
+
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+
+from .cache import invoice_list_cache
+from .models import Invoice, InvoiceDetail
+from .reports import RollupChanges
+from .search import add_search_documents
+from .serializer import (
+    InvoiceDetailSerializer, InvoiceSerializer, duplicate_invoice_error, find_duplicate_invoices, get_totals
+)
+
+BATCH_SIZE = 20000
+VALIDATION_CACHE_SIZE = 100000
+# the indexes of the invoices are keyed by random ids, the default 2 MB page cache of SQLite makes
+# every insert read pages back from disk once the indexes outgrow it
+IMPORT_CACHE_SIZE_KIB = 262144
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+CSV_REQUIRED_COLUMNS = ('customer_name', 'description', 'quantity', 'unit_price')
+
+INVOICE_COLUMNS = (
+    'id', 'customer_name', 'invoice_date', 'total_amount', 'line_count', 'total_quantity',
+    'max_price', 'max_unit_price', 'first_description', 'created_at', 'updated_at'
+)
+DETAIL_COLUMNS = ('id', 'invoice', 'description', 'quantity', 'unit_price', 'price', 'created_at', 'updated_at')
+
+
+class ImportFileError(ValueError):
+    """
+    Raised when an import file cannot be read at all, as opposed to the errors of single rows.
+    """
+
+
+class InvoiceRecord:
+    """
+    A single invoice read from an import file, along with the rows of the file it was read from.
+    """
+    __slots__ = ('first_row', 'last_row', 'invoice', 'details', 'detail_rows', 'error')
+
+    def __init__(self, first_row: int, last_row: int, invoice: dict = None, details: list = None, detail_rows: list = None, error: dict = None):
+        """
+        Initializes an `InvoiceRecord` instance.
+
+        Args:
+            first_row (int): The number of the first row of the invoice in the file.
+            last_row (int): The number of the last row of the invoice in the file.
+            invoice (dict, optional): The raw invoice fields.
+            details (list, optional): The raw fields of each invoice detail.
+            detail_rows (list, optional): The row number of each invoice detail.
+            error (dict, optional): The error of a row that could not be parsed.
+        """
+        self.first_row = first_row
+        self.last_row = last_row
+        self.invoice = invoice or {}
+        self.details = details or []
+        self.detail_rows = detail_rows or []
+        self.error = error
+
+
+def read_csv(lines):
+    """
+    Reads invoices from CSV lines, one row per invoice detail with the invoice columns repeated, as written by the export.
+    Consecutive rows with the same `invoice_id` column, or the same customer name and invoice date if there is no such column,
+    are grouped into one invoice. Rows without description, quantity and unit price add an invoice without that detail.
+
+    Args:
+        lines (iterable): The lines of the file, the first one being the header. Rows are numbered from 1 after the header.
+
+    Yields:
+        InvoiceRecord: The invoices in the order they appear in the file.
+
+    Raises:
+        ImportFileError: If the header is missing a required column.
+    """
+    reader = csv.reader(lines)
+    header = [column.strip().lstrip('\ufeff') for column in next(reader, [])]
+    missing = [column for column in CSV_REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ImportFileError(f"missing columns: {', '.join(missing)}")
+
+    columns = len(header)
+    customer_index = header.index('customer_name')
+    date_index = header.index('invoice_date') if 'invoice_date' in header else None
+    key_index = header.index('invoice_id') if 'invoice_id' in header else None
+    detail_indexes = [(name, header.index(name)) for name in ('description', 'quantity', 'unit_price')]
+
+    record = None
+    record_key = None
+    for row_number, row in enumerate(reader, start=1):
+        if len(row) < columns:
+            row += [''] * (columns - len(row))
+        invoice_date = row[date_index] if date_index is not None else ''
+        key = row[key_index] if key_index is not None and row[key_index] else (row[customer_index], invoice_date)
+        if record is None or key != record_key:
+            if record is not None:
+                yield record
+            invoice = {'customer_name': row[customer_index]}
+            if invoice_date:
+                invoice['invoice_date'] = invoice_date
+            record = InvoiceRecord(row_number, row_number, invoice)
+            record_key = key
+        record.last_row = row_number
+        detail = {name: row[index] for name, index in detail_indexes}
+        if any(detail.values()):
+            record.details.append(detail)
+            record.detail_rows.append(row_number)
+    if record is not None:
+        yield record
+
+
+def read_ndjson(lines):
+    """
+    Reads invoices from newline delimited JSON, one invoice with its `invoice_details` per line, as written by the export.
+
+    Args:
+        lines (iterable): The lines of the file, numbered from 1.
+
+    Yields:
+        InvoiceRecord: The invoices in the order they appear in the file, blank lines are skipped.
+    """
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            yield InvoiceRecord(row_number, row_number, error={"non_field_errors": ["invalid JSON"]})
+            continue
+        if not isinstance(data, dict) or not isinstance(data.get('invoice_details', []), list):
+            yield InvoiceRecord(row_number, row_number, error={"non_field_errors": ["expected an invoice object with a list of invoice details"]})
+            continue
+        details = [detail if isinstance(detail, dict) else {} for detail in data.get('invoice_details', [])]
+        invoice = {field: data[field] for field in ('customer_name', 'invoice_date') if data.get(field) is not None}
+        yield InvoiceRecord(row_number, row_number, invoice, details, [row_number] * len(details))
+
+
+def read_invoices(lines, import_format: str):
+    """
+    Returns the reader of the given format over the lines of an import file.
+
+    Raises:
+        ImportFileError: If the format is not supported.
+    """
+    if import_format == 'csv':
+        return read_csv(lines)
+    if import_format == 'ndjson':
+        return read_ndjson(lines)
+    raise ImportFileError(f"format must be one of {', '.join(IMPORT_FORMATS)}")
+
+
+class InvoiceImporter:
+    """
+    Validates and inserts the invoices read from an import file.
+
+    Every field is validated by the same field objects and `validate_<field>` methods as the invoice and invoice detail
+    serializers, without instantiating a serializer per invoice. The valid invoices are inserted with one `executemany`
+    of a single-row INSERT per table, one transaction per batch of invoice details, and duplicates are looked up once per batch.
+    """
+    def __init__(self, batch_size: int = BATCH_SIZE, on_error=None, on_batch=None, search_documents: bool = True):
+        """
+        Initializes an `InvoiceImporter` instance.
+
+        Args:
+            batch_size (int, optional): The number of invoice details inserted per transaction. Defaults to 20000.
+            on_error (callable, optional): Called with every row error, a dictionary with the row number and its errors.
+                                           The errors of a batch are reported once the batch has been committed.
+            on_batch (callable, optional): Called with the importer once a batch has been committed,
+                                           `last_row` is the last row of the file that has been fully processed.
+            search_documents (bool, optional): Whether the search documents of the invoices are added with each batch.
+                                               A bulk load that rebuilds the search index at the end skips them. Defaults to True.
+        """
+        self.batch_size = batch_size
+        self.search_documents = search_documents
+        self.on_error = on_error or (lambda error: None)
+        self.on_batch = on_batch or (lambda importer: None)
+        self.imported_invoices = 0
+        self.imported_lines = 0
+        self.failed_rows = 0
+        self.last_row = 0
+
+        invoice_serializer = InvoiceSerializer()
+        detail_serializer = InvoiceDetailSerializer()
+        self.invoice_fields = self.get_field_validators(invoice_serializer, ('customer_name', 'invoice_date'))
+        self.detail_fields = self.get_field_validators(detail_serializer, ('description', 'quantity', 'unit_price'))
+
+    @staticmethod
+    def get_field_validators(serializer, field_names) -> list:
+        return [
+            (field_name, serializer.fields[field_name], getattr(serializer, f'validate_{field_name}', None), {})
+            for field_name in field_names
+        ]
+
+    @staticmethod
+    def validate_fields(field_validators, data: dict):
+        """
+        Validates the fields of an invoice or invoice detail.
+        Field validation only depends on the value, so the outcome for each distinct raw value is remembered
+        and historical files, which repeat the same dates, prices and descriptions, are mostly validated by lookups.
+
+        Returns:
+            tuple: The validated fields and the errors of the invalid fields.
+        """
+        validated = {}
+        errors = {}
+        for field_name, field, validate, outcomes in field_validators:
+            value = data.get(field_name, empty)
+            # the type is part of the key since 1, 1.0 and True are equal dictionary keys
+            key = (value.__class__, value)
+            try:
+                outcome = outcomes[key]
+            except (KeyError, TypeError):
+                try:
+                    outcome = (True, field.run_validation(value))
+                    if validate is not None:
+                        outcome = (True, validate(outcome[1]))
+                except SkipField:
+                    outcome = (None, None)
+                except serializers.ValidationError as error:
+                    outcome = (False, error.detail)
+                if len(outcomes) >= VALIDATION_CACHE_SIZE:
+                    outcomes.clear()
+                try:
+                    outcomes[key] = outcome
+                except TypeError:
+                    pass
+            valid, result = outcome
+            if valid:
+                validated[field_name] = result
+            elif valid is False:
+                errors[field_name] = result
+        return validated, errors
+
+    def validate(self, record: InvoiceRecord):
+        """
+        Validates an invoice record.
+
+        Returns:
+            tuple: The validated invoice data and the validated details, or None if the record is invalid.
+                   The errors of an invalid record are added to `errors`.
+        """
+        if record.error:
+            self.errors.append({"row": record.first_row, "errors": record.error})
+            self.failed_rows += 1
+            return None
+
+        invoice, invoice_errors = self.validate_fields(self.invoice_fields, record.invoice)
+        if not record.details:
+            invoice_errors["non_field_errors"] = ["invoice details cannot be empty"]
+        row_errors = {record.first_row: invoice_errors} if invoice_errors else {}
+
+        details = []
+        for detail_data, row in zip(record.details, record.detail_rows):
+            detail, detail_errors = self.validate_fields(self.detail_fields, detail_data)
+            if detail_errors:
+                row_errors.setdefault(row, {}).update({"invoice_details": detail_errors})
+            else:
+                detail['price'] = detail['quantity'] * detail['unit_price']
+                details.append(detail)
+
+        if row_errors:
+            self.errors.extend({"row": row, "errors": errors} for row, errors in row_errors.items())
+            self.failed_rows += record.last_row - record.first_row + 1
+            return None
+        if not invoice.get('invoice_date'):
+            invoice['invoice_date'] = timezone.now().date()
+        return invoice, details
+
+    def run(self, records, resume_after: int = 0):
+        """
+        Imports the invoice records, skipping the ones that were fully processed by a previous run.
+
+        Args:
+            records (iterable): The invoice records, in the order of the rows of the file.
+            resume_after (int, optional): The last row processed by a previous run. Defaults to 0.
+
+        Returns:
+            InvoiceImporter: The importer, holding the counts of imported invoices, lines and failed rows.
+        """
+        self.errors = []
+        with larger_page_cache(connections[router.db_for_write(Invoice)]):
+            pending = []
+            pending_lines = 0
+            read_row = self.last_row = resume_after
+            for record in records:
+                if record.last_row <= resume_after:
+                    continue
+                validated = self.validate(record)
+                if validated is not None:
+                    pending.append((record, validated))
+                    pending_lines += len(validated[1])
+                read_row = record.last_row
+                if pending_lines >= self.batch_size:
+                    self.flush(pending, read_row)
+                    pending = []
+                    pending_lines = 0
+            if read_row > self.last_row:
+                self.flush(pending, read_row)
+        return self
+
+    def flush(self, pending: list, last_row: int):
+        """
+        Inserts a batch of validated invoices in a single transaction, reporting the ones that already exist.
+        """
+        duplicates = find_duplicate_invoices({index: invoice for index, (_, (invoice, _)) in enumerate(pending)})
+        for index, invoice_id in duplicates.items():
+            record = pending[index][0]
+            self.errors.append({"row": record.first_row, "errors": duplicate_invoice_error(invoice_id)})
+            self.failed_rows += record.last_row - record.first_row + 1
+        pending = [item for index, item in enumerate(pending) if index not in duplicates]
+
+        try:
+            with transaction.atomic():
+                self.insert([validated for _, validated in pending])
+        except IntegrityError:
+            # another writer created some of the invoices meanwhile, fall back to one savepoint per invoice
+            inserted = []
+            with transaction.atomic():
+                for record, validated in pending:
+                    try:
+                        with transaction.atomic():
+                            self.insert([validated])
+                    except IntegrityError:
+                        invoice = validated[0]
+                        invoice_id = Invoice.objects.filter(
+                            customer_name=invoice['customer_name'], invoice_date=invoice['invoice_date']
+                        ).values_list('id', flat=True).first()
+                        self.errors.append({"row": record.first_row, "errors": duplicate_invoice_error(invoice_id)})
+                        self.failed_rows += record.last_row - record.first_row + 1
+                    else:
+                        inserted.append((record, validated))
+            pending = inserted
+
+        self.imported_invoices += len(pending)
+        self.imported_lines += sum(len(details) for _, (_, details) in pending)
+        self.last_row = last_row
+        invoice_list_cache.invalidate()
+        for error in sorted(self.errors, key=lambda error: error['row']):
+            self.on_error(error)
+        self.errors = []
+        self.on_batch(self)
+
+    def insert(self, validated_invoices: list):
+        """
+        Inserts validated invoices and their details with one `executemany` of a single-row INSERT per table.
+        The rows are built directly in the format the database stores them in, bypassing the per-field
+        preparation of model instances which would take most of the time of an import.
+        """
+        connection = connections[router.db_for_write(Invoice)]
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        invoice_rows = []
+        detail_rows = []
+        documents = []
+        rollups = RollupChanges()
+        ids = new_ids(len(validated_invoices) + sum(len(details) for _, details in validated_invoices))
+        for invoice_data, details in validated_invoices:
+            invoice_id = next(ids)
+            totals = get_totals(details)
+            invoice_rows.append((
+                invoice_id, invoice_data['customer_name'], invoice_data['invoice_date'].isoformat(),
+                str(totals['total_amount']), totals['line_count'], totals['total_quantity'],
+                str(totals['max_price']), str(totals['max_unit_price']), totals['first_description'], now, now
+            ))
+            detail_rows.extend(
+                (next(ids), invoice_id, detail['description'], detail['quantity'], str(detail['unit_price']), str(detail['price']), now, now)
+                for detail in details
+            )
+            documents.append((invoice_id, invoice_data['customer_name'], [detail['description'] for detail in details]))
+            rollups.add(invoice_data['customer_name'], invoice_data['invoice_date'], details)
+
+        # rows inserted in key order touch the pages of the primary key index one after the other
+        invoice_rows.sort()
+        detail_rows.sort()
+        with connection.cursor() as cursor:
+            cursor.executemany(insert_sql(connection, Invoice, INVOICE_COLUMNS), invoice_rows)
+            cursor.executemany(insert_sql(connection, InvoiceDetail, DETAIL_COLUMNS), detail_rows)
+        if self.search_documents:
+            add_search_documents(documents)
+        rollups.save()
+
+
+def new_ids(count: int):
+    """
+    Yields random version 4 UUIDs in their string form, the same ids as `uuid.uuid4()` gives,
+    from a single read of random bytes instead of one `UUID` object per id.
+    """
+    random_hex = os.urandom(16 * count).hex()
+    for start in range(0, 32 * count, 32):
+        digits = random_hex[start:start + 32]
+        variant = '89ab'[int(digits[16], 16) & 3]
+        yield f"{digits[:8]}-{digits[8:12]}-4{digits[13:16]}-{variant}{digits[17:20]}-{digits[20:]}"
+
+
+@contextmanager
+def larger_page_cache(connection):
+    """
+    Raises the page cache of an SQLite connection for the duration of an import and restores it afterwards.
+    """
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA cache_size")
+        previous = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA cache_size = -{IMPORT_CACHE_SIZE_KIB}")
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA cache_size = {int(previous)}")
+
+
+def drop_secondary_indexes(connection) -> dict:
+    """
+    Drops the indexes of the invoice tables that only speed up reads, so a bulk load does not update them row by row.
+    The primary keys and the unique indexes stay, since they detect the duplicate invoices.
+
+    Returns:
+        dict: The statement creating each dropped index keyed by its name, see `create_indexes`.
+    """
+    if connection.vendor != 'sqlite':
+        return {}
+    tables = [Invoice._meta.db_table, InvoiceDetail._meta.db_table]
+    with connection.cursor() as cursor:
+        # the indexes without a statement are the ones SQLite creates itself for the primary keys and unique constraints
+        cursor.execute(
+            "SELECT index_list.name, sqlite_master.sql FROM sqlite_master "
+            "JOIN pragma_index_list(sqlite_master.tbl_name) index_list ON index_list.name = sqlite_master.name "
+            "WHERE sqlite_master.type = 'index' AND sqlite_master.tbl_name IN (%s, %s) "
+            "AND sqlite_master.sql IS NOT NULL AND NOT index_list.\"unique\"",
+            tables
+        )
+        indexes = dict(cursor.fetchall())
+        for name in indexes:
+            cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+    return indexes
+
+
+def create_indexes(connection, indexes: dict):
+    """
+    Creates the indexes dropped by `drop_secondary_indexes` again, each one with a single sort of its table.
+    The indexes that exist already are left alone.
+    """
+    if not indexes:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing = {name for name, in cursor.fetchall()}
+        for name, sql in indexes.items():
+            if name not in existing:
+                cursor.execute(sql)
+
+
+def insert_sql(connection, model, field_names) -> str:
+    """
+    Returns the INSERT statement of a single row of the given fields of a model.
+    """
+    quote_name = connection.ops.quote_name
+    columns = [quote_name(model._meta.get_field(field_name).column) for field_name in field_names]
+    return (
+        f"INSERT INTO {quote_name(model._meta.db_table)} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
@@ -0,0 +1,152 @@
+import json
+import os
+import platform
+import sqlite3
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (
+    ITERATIONS, MIN_DELTA_MS, SEED, THRESHOLD, WARMUP, BenchmarkError, copy_database, find_regressions,
+    load_data_generator, run_json_comparison, run_scenarios, run_serializer_comparison, use_database
+)
+
+DATASET_SIZES = [1000, 100000, 1000000]
+# measurements of parts of the request handling rather than whole requests, with the scenarios each one produces
+MICROBENCHMARKS = (
+    (('serialize_drf', 'serialize_values'), run_serializer_comparison),
+    (('render_stdlib', 'render_fast', 'parse_stdlib', 'parse_fast'), run_json_comparison),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency and throughput of every invoice endpoint against generated datasets of increasing size, "
+        "writes the results as JSON and fails when an endpoint got slower than the stored baseline allows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=DATASET_SIZES,
+            help="Number of invoices of each dataset."
+        )
+        parser.add_argument(
+            '--scenarios',
+            nargs='+',
+            help="Names of the scenarios to run, all of them by default."
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=ITERATIONS,
+            help="Number of measured requests per scenario."
+        )
+        parser.add_argument(
+            '--data-dir',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'data'),
+            help="Directory of the generated datasets, which are reused by later runs."
+        )
+        parser.add_argument(
+            '--output',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'results.json'),
+            help="Path of the JSON results."
+        )
+        parser.add_argument(
+            '--baseline',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'baseline.json'),
+            help="Path of the JSON results the run is compared with."
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=THRESHOLD,
+            help="Allowed slowdown of the median latency compared with the baseline, 0.25 for 25%%."
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help="Store the results as the new baseline instead of comparing them with it."
+        )
+
+    def handle(self, *args, **options):
+        # the requests go through the whole stack, whose host validation only lets the test client in during tests
+        if 'testserver' not in settings.ALLOWED_HOSTS and '*' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        results = {}
+        for size in options['sizes']:
+            path = self.get_dataset(options['data_dir'], size)
+            self.stdout.write(f"Benchmarking {size} invoices")
+            # the writes commit, so every run works on its own copy of the dataset
+            with copy_database(path) as copy_path, use_database(copy_path):
+                try:
+                    results[str(size)] = run_scenarios(iterations=options['iterations'], only=options['scenarios'])
+                    for names, run in MICROBENCHMARKS:
+                        if not options['scenarios'] or set(names) & set(options['scenarios']):
+                            results[str(size)].update(run(iterations=options['iterations']))
+                except BenchmarkError as error:
+                    raise CommandError(str(error))
+            for name, measurement in results[str(size)].items():
+                self.stdout.write(
+                    f"  {name:<20} p50 {measurement['p50_ms']:>9.2f} ms  p95 {measurement['p95_ms']:>9.2f} ms  "
+                    f"{measurement['throughput_rps']:>8.1f} req/s"
+                )
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "machine": platform.machine(),
+            },
+            "iterations": options['iterations'],
+            "warmup": WARMUP,
+            "seed": SEED,
+            "results": results,
+        }
+        output = options['baseline'] if options['save_baseline'] else options['output']
+        self.write_json(output, report)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+        if options['save_baseline']:
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(self.style.WARNING(f"No baseline at {options['baseline']}, run with --save-baseline to store one"))
+            return
+        with open(options['baseline'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = find_regressions(results, baseline['results'], options['threshold'], MIN_DELTA_MS)
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f"{len(regressions)} scenarios are more than {options['threshold']:.0%} slower than the baseline")
+        self.stdout.write(self.style.SUCCESS(f"No scenario is more than {options['threshold']:.0%} slower than the baseline"))
+
+    def get_dataset(self, data_dir, size):
+        """
+        Returns the path of the dataset with the given number of invoices, generating it on the first run.
+        """
+        path = os.path.join(data_dir, f"invoices-{size}-seed{SEED}.sqlite3")
+        if not os.path.exists(path):
+            os.makedirs(data_dir, exist_ok=True)
+            self.stdout.write(f"Generating {size} invoices in {path}")
+            started = time.perf_counter()
+            # generated next to the final path, so an interrupted run never leaves a partial dataset behind
+            temporary_path = f"{path}.tmp"
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            load_data_generator().generate_data(temporary_path, invoices=size, seed=SEED)
+            os.replace(temporary_path, path)
+            self.stdout.write(f"  generated in {time.perf_counter() - started:.1f}s")
+        return path
+
+    def write_json(self, path, data):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2)
+            file.write("\n")
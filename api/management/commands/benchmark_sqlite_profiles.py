@@ -0,0 +1,91 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (
+    SEED, BenchmarkError, copy_database, load_data_generator, run_contention, run_scenarios, use_database, use_sqlite_profile
+)
+from api.database import SQLITE_PROFILES
+
+PROFILE_SCENARIOS = ['list', 'search', 'get', 'put', 'detail_create']
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the SQLite connection profiles on a generated dataset: the latency of the endpoints one request at a time, "
+        "then the throughput and the locked database errors of readers and writers running at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=100000,
+            help="Number of invoices of the dataset."
+        )
+        parser.add_argument(
+            '--profiles',
+            nargs='+',
+            default=list(SQLITE_PROFILES),
+            choices=list(SQLITE_PROFILES),
+            help="Profiles to compare, all of them by default."
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help="Number of measured requests per scenario."
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=8,
+            help="Number of threads reading at the same time."
+        )
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=4,
+            help="Number of threads writing at the same time."
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10.0,
+            help="Number of seconds the readers and writers run for."
+        )
+        parser.add_argument(
+            '--data-dir',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'data'),
+            help="Directory of the generated datasets, shared with benchmark_endpoints."
+        )
+
+    def handle(self, *args, **options):
+        if 'testserver' not in settings.ALLOWED_HOSTS and '*' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        path = os.path.join(options['data_dir'], f"invoices-{options['size']}-seed{SEED}.sqlite3")
+        if not os.path.exists(path):
+            os.makedirs(options['data_dir'], exist_ok=True)
+            self.stdout.write(f"Generating {options['size']} invoices in {path}")
+            load_data_generator().generate_data(f"{path}.tmp", invoices=options['size'], seed=SEED, clear=True)
+            os.replace(f"{path}.tmp", path)
+
+        for profile in options['profiles']:
+            self.stdout.write(f"Profile {profile}")
+            # every profile starts from the same data, on a copy of the dataset since the writes commit
+            with copy_database(path) as copy_path, use_database(copy_path), use_sqlite_profile(profile):
+                try:
+                    results = run_scenarios(iterations=options['iterations'], only=PROFILE_SCENARIOS)
+                    contention = run_contention(options['readers'], options['writers'], options['duration'])
+                except BenchmarkError as error:
+                    raise CommandError(str(error))
+            for name, measurement in results.items():
+                self.stdout.write(f"  {name:<20} p50 {measurement['p50_ms']:>9.2f} ms  p95 {measurement['p95_ms']:>9.2f} ms")
+            for kind, measurement in contention.items():
+                p50 = "-" if measurement['p50_ms'] is None else f"{measurement['p50_ms']:.2f} ms"
+                self.stdout.write(
+                    f"  concurrent {kind + 's':<9} {measurement['per_second']:>8.1f} /s  p50 {p50:>11}  "
+                    f"{measurement['failures']} failed"
+                )
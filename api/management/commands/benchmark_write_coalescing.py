@@ -0,0 +1,75 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (
+    SEED, BenchmarkError, copy_database, load_data_generator, run_write_coalescing, use_database, use_sqlite_profile
+)
+from api.database import SQLITE_PROFILES
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the throughput of concurrent invoice detail edits on a generated dataset as the number of writing threads grows, "
+        "without and with the write coalescer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=100000,
+            help="Number of invoices of the dataset."
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8, 16, 32],
+            help="Numbers of threads writing at the same time."
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=5.0,
+            help="Number of seconds each number of threads runs for, in each mode."
+        )
+        parser.add_argument(
+            '--profile',
+            default=settings.SQLITE_PROFILE,
+            choices=list(SQLITE_PROFILES),
+            help="SQLite profile of the connections."
+        )
+        parser.add_argument(
+            '--data-dir',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'data'),
+            help="Directory of the generated datasets, shared with benchmark_endpoints."
+        )
+
+    def handle(self, *args, **options):
+        if 'testserver' not in settings.ALLOWED_HOSTS and '*' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        path = os.path.join(options['data_dir'], f"invoices-{options['size']}-seed{SEED}.sqlite3")
+        if not os.path.exists(path):
+            os.makedirs(options['data_dir'], exist_ok=True)
+            self.stdout.write(f"Generating {options['size']} invoices in {path}")
+            load_data_generator().generate_data(f"{path}.tmp", invoices=options['size'], seed=SEED, clear=True)
+            os.replace(f"{path}.tmp", path)
+
+        # the writes bump the updated_at of the invoices and the profile sets the journal mode, so they go to a copy of the dataset
+        with copy_database(path) as copy_path, use_database(copy_path), use_sqlite_profile(options['profile']):
+            try:
+                results = run_write_coalescing(options['concurrency'], options['duration'])
+            except BenchmarkError as error:
+                raise CommandError(str(error))
+
+        self.stdout.write(f"{'threads':>7}  {'off /s':>8}  {'off p95':>10}  {'on /s':>8}  {'on p95':>10}  {'batch':>6}  failed")
+        for writers, modes in results.items():
+            off, on = modes['off'], modes['on']
+            p95 = {mode: "-" if measurement['p95_ms'] is None else f"{measurement['p95_ms']:.2f} ms" for mode, measurement in modes.items()}
+            self.stdout.write(
+                f"{writers:>7}  {off['per_second']:>8.1f}  {p95['off']:>10}  {on['per_second']:>8.1f}  {p95['on']:>10}  "
+                f"{on['average_batch']:>6.1f}  {off['failures'] + on['failures']}"
+            )
@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Abs
+
+from api.cache import invoice_list_cache
+from api.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Verifies the stored totals and aggregates of every invoice against its details, optionally repairing them."
+    amount_fields = ['total_amount', 'max_price', 'max_unit_price']
+    exact_fields = ['line_count', 'total_quantity', 'first_description']
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help="Recompute the stored totals of the invoices that do not match their details."
+        )
+
+    def handle(self, *args, **options):
+        # prices are stored as floating point numbers by SQLite, so differences under half a cent are rounding noise
+        mismatched = Q()
+        for field in self.amount_fields:
+            mismatched |= Q(**{f"{field}_difference__gt": Decimal('0.005')})
+        for field in self.exact_fields:
+            mismatched |= ~Q(**{field: F(f"computed_{field}")})
+
+        mismatched_ids = list(
+            Invoice.objects.with_computed_totals()
+            .annotate(**{
+                f"{field}_difference": Abs(F(field) - F(f"computed_{field}"))
+                for field in self.amount_fields
+            })
+            .filter(mismatched)
+            .order_by()
+            .values_list('id', flat=True)
+        )
+
+        if not mismatched_ids:
+            self.stdout.write(self.style.SUCCESS("All invoice totals are correct"))
+            return
+
+        self.stdout.write(self.style.WARNING(f"{len(mismatched_ids)} invoices have wrong totals"))
+        for invoice_id in mismatched_ids[:20]:
+            self.stdout.write(f"  {invoice_id}")
+        if len(mismatched_ids) > 20:
+            self.stdout.write(f"  ... and {len(mismatched_ids) - 20} more")
+
+        if options['repair']:
+            with transaction.atomic():
+                for start in range(0, len(mismatched_ids), 500):
+                    Invoice.objects.filter(id__in=mismatched_ids[start:start + 500]).recompute_totals()
+            invoice_list_cache.invalidate()
+            self.stdout.write(self.style.SUCCESS(f"Repaired the totals of {len(mismatched_ids)} invoices"))
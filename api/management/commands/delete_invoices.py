@@ -0,0 +1,64 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import invoice_list_cache
+from api.purge import CHUNK_SIZE, invoices_to_purge, purge_invoices
+
+
+def parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"{value} is not a date in the YYYY-MM-DD format")
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the invoices of a customer or of a range of invoice dates, along with their invoice details, "
+        "in chunks of set-based statements, each chunk in its own transaction. Running it again after an interruption "
+        "deletes the invoices that are left."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', help="Exact customer name of the invoices.")
+        parser.add_argument('--date-from', type=parse_date, help="First invoice date, YYYY-MM-DD, included.")
+        parser.add_argument('--date-to', type=parse_date, help="Last invoice date, YYYY-MM-DD, included.")
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of invoices deleted per transaction."
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="Only count the invoices and invoice details that would be deleted."
+        )
+
+    def handle(self, *args, **options):
+        if options['customer'] is None and options['date_from'] is None and options['date_to'] is None:
+            raise CommandError("give at least one of --customer, --date-from and --date-to")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        invoices = invoices_to_purge(options['customer'], options['date_from'], options['date_to'])
+        started = time.perf_counter()
+
+        def report_progress(result):
+            self.stdout.write(
+                f"  {result['deleted_invoices']} of {result['matched_invoices']} invoices deleted "
+                f"({result['deleted_details']} invoice details)"
+            )
+
+        result = purge_invoices(invoices, chunk_size=options['chunk_size'], dry_run=options['dry_run'], on_chunk=report_progress)
+        if options['dry_run']:
+            self.stdout.write(
+                f"{result['matched_invoices']} invoices with {result['matched_details']} invoice details would be deleted"
+            )
+            return
+        invoice_list_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {result['deleted_invoices']} invoices with {result['deleted_details']} invoice details "
+            f"in {time.perf_counter() - started:.1f} s"
+        ))
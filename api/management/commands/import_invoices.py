@@ -0,0 +1,147 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from api.cache import invoice_list_cache
+from api.importer import (
+    BATCH_SIZE, IMPORT_FORMATS, ImportFileError, InvoiceImporter, create_indexes, drop_secondary_indexes, read_invoices
+)
+from api.models import Invoice
+from api.search import clear_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports invoices from a CSV or NDJSON file, in the format written by the invoice export. "
+        "The file is read incrementally and the progress is saved in a checkpoint after every batch, "
+        "so an interrupted import continues where it stopped when the command is run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path of the file to import.")
+        parser.add_argument(
+            '--format',
+            choices=IMPORT_FORMATS,
+            help="Format of the file, guessed from its extension by default."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help="Number of invoice details inserted per transaction."
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help="Path of the checkpoint file, defaults to the imported file with a .checkpoint.json suffix."
+        )
+        parser.add_argument(
+            '--errors',
+            help="Path of the error report, one JSON object per failed row, defaults to the imported file with a .errors.ndjson suffix."
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help="Ignore the checkpoint and import the file from the start."
+        )
+        parser.add_argument(
+            '--defer-indexes',
+            action='store_true',
+            help="Drop the secondary indexes of the invoice tables and the search documents before the load "
+                 "and rebuild them once at the end, for large loads into a database nobody else is using."
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f"cannot guess the format of {path}, use --format {' or --format '.join(IMPORT_FORMATS)}")
+        if not os.path.isfile(path):
+            raise CommandError(f"{path} does not exist")
+        checkpoint_path = options['checkpoint'] or f"{path}.checkpoint.json"
+        errors_path = options['errors'] or f"{path}.errors.ndjson"
+
+        source = {"path": os.path.abspath(path), "size": os.path.getsize(path)}
+        checkpoint = self.load_checkpoint(checkpoint_path, source) if not options['restart'] else None
+        if checkpoint and checkpoint['completed']:
+            self.stdout.write(self.style.SUCCESS(f"{path} has already been imported, use --restart to import it again"))
+            return
+
+        # an interrupted import with deferred indexes resumes with them deferred, since its first batches have no search documents
+        deferred_indexes = checkpoint.get('deferred_indexes') if checkpoint else None
+        if options['defer_indexes'] or deferred_indexes is not None:
+            connection = connections[router.db_for_write(Invoice)]
+            deferred_indexes = {**(deferred_indexes or {}), **drop_secondary_indexes(connection)}
+            clear_search_index()
+            invoice_list_cache.invalidate()
+        importer = InvoiceImporter(batch_size=options['batch_size'], search_documents=deferred_indexes is None)
+        if checkpoint:
+            importer.imported_invoices = checkpoint['imported_invoices']
+            importer.imported_lines = checkpoint['imported_lines']
+            importer.failed_rows = checkpoint['failed_rows']
+            self.stdout.write(f"Resuming after row {checkpoint['last_row']}")
+        started = time.perf_counter()
+        initial_lines = importer.imported_lines
+
+        with open(path, encoding='utf-8-sig', newline='') as file, \
+                open(errors_path, 'a' if checkpoint else 'w', encoding='utf-8') as errors_file:
+            def report_error(error):
+                errors_file.write(json.dumps(error, ensure_ascii=False) + "\n")
+
+            def save_checkpoint(importer, completed=False):
+                errors_file.flush()
+                self.save_checkpoint(checkpoint_path, {
+                    **source,
+                    "last_row": importer.last_row,
+                    "imported_invoices": importer.imported_invoices,
+                    "imported_lines": importer.imported_lines,
+                    "failed_rows": importer.failed_rows,
+                    "deferred_indexes": deferred_indexes,
+                    "completed": completed,
+                })
+                self.stdout.write(f"  row {importer.last_row}: {importer.imported_lines} invoice details imported")
+
+            importer.on_error = report_error
+            importer.on_batch = save_checkpoint
+            try:
+                importer.run(read_invoices(file, import_format), resume_after=checkpoint['last_row'] if checkpoint else 0)
+            except (ImportFileError, UnicodeDecodeError) as error:
+                raise CommandError(f"cannot read {path}: {error}")
+            finally:
+                if deferred_indexes is not None:
+                    self.stdout.write("  rebuilding the indexes and the search documents")
+                    create_indexes(connection, deferred_indexes)
+                    with transaction.atomic():
+                        rebuild_search_index()
+                    invoice_list_cache.invalidate()
+                    deferred_indexes = None
+            save_checkpoint(importer, completed=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {importer.imported_invoices} invoices with {importer.imported_lines} invoice details "
+            f"({(importer.imported_lines - initial_lines) / elapsed:.0f} invoice details per second)"
+        ))
+        if importer.failed_rows:
+            self.stdout.write(self.style.WARNING(f"{importer.failed_rows} rows failed, see {errors_path}"))
+
+    def load_checkpoint(self, checkpoint_path, source):
+        """
+        Returns the checkpoint of a previous import of the same file, or None if there is none.
+        """
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, encoding='utf-8') as file:
+            checkpoint = json.load(file)
+        if checkpoint.get('path') != source['path'] or checkpoint.get('size') != source['size']:
+            raise CommandError(f"{checkpoint_path} belongs to another file or the file has changed, use --restart to import it from the start")
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint_path, checkpoint):
+        # written to a temporary file first so an interruption never leaves a half written checkpoint
+        temporary_path = f"{checkpoint_path}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary_path, checkpoint_path)
@@ -0,0 +1,51 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import BenchmarkError, build_load_requests, run_load_test
+
+LOAD_SCENARIOS = ['list', 'search', 'get']
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends requests to a running server over many concurrent keep-alive connections and reports the latency and throughput, "
+        "to compare the synchronous and asynchronous views under the same load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help="Root url of the server, which must use the same database as this command."
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=500,
+            help="Number of connections sending requests at the same time."
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=20.0,
+            help="Number of seconds to send requests for."
+        )
+        parser.add_argument(
+            '--scenarios',
+            nargs='+',
+            default=LOAD_SCENARIOS,
+            help="Requests to mix: list, search, get and patch, which writes the invoices back unchanged."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            requests = build_load_requests(options['scenarios'])
+            results = asyncio.run(run_load_test(options['url'], requests, options['concurrency'], options['duration']))
+        except BenchmarkError as error:
+            raise CommandError(str(error))
+        self.stdout.write(
+            f"{results['requests']} requests over {results['concurrency']} connections: "
+            f"p50 {results['p50_ms']:.2f} ms  p95 {results['p95_ms']:.2f} ms  max {results['max_ms']:.2f} ms  "
+            f"{results['throughput_rps']:.1f} req/s  {results['failures']} failed"
+        )
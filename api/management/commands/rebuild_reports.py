@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.reports import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Creates the report rollup tables if needed and computes them again from every invoice detail."
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows"))
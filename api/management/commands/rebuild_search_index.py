@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import invoice_list_cache
+from api.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Creates the invoice full-text search table if needed and rebuilds the search document of every invoice."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of invoices indexed at once."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_search_index(batch_size=options['batch_size'])
+        invoice_list_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} invoices"))
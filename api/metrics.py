@@ -0,0 +1,213 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# separates the labels in the keys of the counters, which have to be strings to be written as JSON
+TAB = "\t"
+
+
+def label_response(response, resource: str, action: str):
+    """
+    Labels a response with the resource and action it is about, the labels of its metrics.
+    `CustomResponse` labels its responses, the other responses of the views have to be labelled with this function.
+    """
+    response.metrics_labels = (resource, action)
+    return response
+
+
+class MetricsRegistry:
+    """
+    Keeps the request counters and latency histograms of this process, keyed by the resource and action of each response.
+
+    Recording a request only updates a few counters in memory. When the METRICS_DIR setting is set, the counters are written
+    to a file of this process in that directory at most every METRICS_FLUSH_INTERVAL seconds, and the metrics endpoint adds up
+    the files of every process, so the metrics cover all the workers of the server whichever worker serves the scrape.
+    The files of stopped processes are kept so the counters never go back down, the directory should be emptied when the
+    server is deployed, as with the multiprocess mode of the Prometheus client.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # the pid alone could be reused by a later worker, which would overwrite the counters of a stopped one
+        self.process_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.owner_pid = os.getpid()
+        self.requests = {}
+        self.errors = {}
+        self.last_flush = 0.0
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.errors = {}
+
+    def record(self, resource: str, action: str, status_code: int, duration: float):
+        """
+        Records a request served in `duration` seconds.
+        """
+        # a worker forked from a process that already recorded requests starts over under a name of its own
+        if os.getpid() != self.owner_pid:
+            self.__init__()
+        bucket = bisect_left(BUCKETS, duration)
+        key = f"{resource}{TAB}{action}"
+        with self.lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+            histogram["buckets"][bucket] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+            if status_code >= 400:
+                error_key = f"{key}{TAB}{status_code}"
+                self.errors[error_key] = self.errors.get(error_key, 0) + 1
+        if settings.METRICS_DIR and time.monotonic() - self.last_flush >= settings.METRICS_FLUSH_INTERVAL:
+            # the other threads carry on without waiting while one of them writes the file
+            self.flush(blocking=False)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": {key: {**histogram, "buckets": list(histogram["buckets"])} for key, histogram in self.requests.items()},
+                "errors": dict(self.errors),
+            }
+
+    def flush(self, blocking: bool = True):
+        """
+        Writes the counters of this process to its file in the METRICS_DIR directory.
+
+        Args:
+            blocking (bool, optional): Whether to wait for a flush already running in another thread, or to skip this one. Defaults to True.
+        """
+        if not self.flush_lock.acquire(blocking=blocking):
+            return
+        try:
+            self.last_flush = time.monotonic()
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            path = os.path.join(settings.METRICS_DIR, f"metrics-{self.process_id}.json")
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temporary_path, path)
+        finally:
+            self.flush_lock.release()
+
+    def collect(self) -> dict:
+        """
+        Returns the counters of every process sharing the METRICS_DIR directory added up, or of this process only without it.
+        """
+        if not settings.METRICS_DIR:
+            return self.snapshot()
+        self.flush()
+        merged = {"requests": {}, "errors": {}}
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, "metrics-*.json")):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                # removed or being replaced by its process in the meantime
+                continue
+            for key, histogram in snapshot["requests"].items():
+                total = merged["requests"].setdefault(key, {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0})
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+                total["sum"] += histogram["sum"]
+                total["count"] += histogram["count"]
+            for key, count in snapshot["errors"].items():
+                merged["errors"][key] = merged["errors"].get(key, 0) + count
+        return merged
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        metrics = self.collect()
+        lines = [
+            "# HELP invoice_api_request_duration_seconds Time taken to serve the requests, by resource and action.",
+            "# TYPE invoice_api_request_duration_seconds histogram",
+        ]
+        for key in sorted(metrics["requests"]):
+            histogram = metrics["requests"][key]
+            labels = format_labels(*key.split(TAB))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram["buckets"]):
+                cumulative += count
+                lines.append(f'invoice_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"invoice_api_request_duration_seconds_sum{{{labels}}} {histogram['sum']!r}")
+            lines.append(f"invoice_api_request_duration_seconds_count{{{labels}}} {histogram['count']}")
+
+        lines += [
+            "# HELP invoice_api_requests_total Requests served, by resource and action.",
+            "# TYPE invoice_api_requests_total counter",
+        ]
+        for key in sorted(metrics["requests"]):
+            lines.append(f"invoice_api_requests_total{{{format_labels(*key.split(TAB))}}} {metrics['requests'][key]['count']}")
+
+        lines += [
+            "# HELP invoice_api_errors_total Requests answered with an error status, by resource, action and status.",
+            "# TYPE invoice_api_errors_total counter",
+        ]
+        for key in sorted(metrics["errors"]):
+            resource, action, status_code = key.split(TAB)
+            lines.append(f'invoice_api_errors_total{{{format_labels(resource, action)},status="{status_code}"}} {metrics["errors"][key]}')
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(resource: str, action: str) -> str:
+    """
+    Returns the resource and action labels of a metric, escaped for the Prometheus text format.
+    """
+    resource, action = (value.replace('\\', '\\\\').replace('"', '\\"') for value in (resource, action))
+    return f'resource="{resource}",action="{action}"'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Times every request and records it in the metrics registry under the labels of its response.
+    Responses that were not labelled by the views, such as the errors raised by the framework itself,
+    are recorded under the name of the matched URL.
+    Has to be the first middleware, so the time spent in the others is included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, duration: float):
+        labels = getattr(response, 'metrics_labels', None)
+        if labels is None:
+            match = getattr(request, 'resolver_match', None)
+            labels = ("unlabelled", match.url_name if match and match.url_name else "unmatched")
+        metrics_registry.record(labels[0], labels[1], response.status_code, duration)
@@ -0,0 +1,115 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# placeholder lists of any length, so `IN (%s, %s)` and `IN (%s, %s, %s)` count as the same statement
+PLACEHOLDER_LIST = re.compile(r"\(\s*%s(?:\s*,\s*%s)*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def query_shape(sql: str) -> str:
+    """
+    Returns the SQL of a statement with its placeholder lists collapsed and its whitespace normalized,
+    so the same query run with different parameters has the same shape.
+    """
+    return WHITESPACE.sub(" ", PLACEHOLDER_LIST.sub("(%s...)", sql)).strip()
+
+
+class QueryRecorder:
+    """
+    Records the number, duration and shape of the SQL statements run while it is installed as an execute wrapper.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_sql = None
+        self.slowest_duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            self.shapes[sql] += 1
+            if duration >= self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+    def repeated_shapes(self, threshold: int) -> list:
+        """
+        Returns the shapes of the statements run more than `threshold` times, along with their count, the most repeated first.
+        """
+        shapes = Counter()
+        for sql, count in self.shapes.items():
+            shapes[query_shape(sql)] += count
+        return [(shape, count) for shape, count in shapes.most_common() if count > threshold]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the SQL statements run by each request.
+
+    The totals are available to the views and the other middleware as `request.query_recorder`, and are returned in the
+    `X-DB-Queries`, `X-DB-Time-ms` and `X-DB-Slowest-ms` headers when the SQL_INSTRUMENTATION_HEADERS setting is on.
+    A warning is logged when a statement of the same shape runs more than SQL_REPEATED_QUERY_THRESHOLD times in one request,
+    which usually means a query is run once per row (N+1) instead of once for all of them.
+    The statements run while a streamed response is being sent come after the headers and are not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # under ASGI with async views the chain stays asynchronous, without a thread hop for this middleware
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        recorder = self.install_recorder(request)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder = self.install_recorder(request)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = await self.get_response(request)
+        return self.report(request, response, recorder)
+
+    def install_recorder(self, request) -> QueryRecorder:
+        recorder = QueryRecorder()
+        request.query_recorder = recorder
+        return recorder
+
+    def report(self, request, response, recorder: QueryRecorder):
+        """
+        Logs the repeated and slowest queries of a request and adds the instrumentation headers to its response.
+        """
+        for shape, count in recorder.repeated_shapes(settings.SQL_REPEATED_QUERY_THRESHOLD):
+            logger.warning("%s %s ran the same query %d times: %s", request.method, request.path, count, shape)
+        if recorder.slowest_sql is not None:
+            logger.debug("%s %s slowest query (%.3f ms): %s", request.method, request.path, recorder.slowest_duration * 1000, recorder.slowest_sql)
+        if settings.SQL_INSTRUMENTATION_HEADERS:
+            response['X-DB-Queries'] = str(recorder.count)
+            response['X-DB-Time-ms'] = f"{recorder.duration * 1000:.3f}"
+            response['X-DB-Slowest-ms'] = f"{recorder.slowest_duration * 1000:.3f}"
+        return response
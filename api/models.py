@@ -1,16 +1,133 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import Case, Count, F, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.utils import timezone
 import uuid 
 
+def line_aggregates(*fields) -> dict:
+    """
+    Returns the expressions computing the given stored columns of an invoice from its invoice details.
+    Each expression is a subquery over the details of a single invoice, so it can be used to update or annotate invoices.
+
+    Args:
+        *fields (str): The names of the stored columns, all of them if none are given.
+
+    Returns:
+        dict: The expression of each column keyed by the column name.
+    """
+    details = InvoiceDetail.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+    aggregates = {
+        'total_amount': (Sum('price'), Value(Decimal(0))),
+        'line_count': (Count('id'), Value(0)),
+        'total_quantity': (Sum('quantity'), Value(0)),
+        'max_price': (Max('price'), Value(Decimal(0))),
+        'max_unit_price': (Max('unit_price'), Value(Decimal(0))),
+        'first_description': (Min('description'), Value('')),
+    }
+    return {
+        field: Coalesce(Subquery(details.annotate(value=aggregate).values('value')), default)
+        for field, (aggregate, default) in aggregates.items()
+        if not fields or field in fields
+    }
+
+class InvoiceQuerySet(models.QuerySet):
+    def add_line(self, price, quantity: int, unit_price, description: str) -> int:
+        """
+        Adds a new invoice detail to the stored columns of the invoices in place, without reading any other invoice details.
+        The update date of the invoices is bumped as well, since their ETag is derived from it.
+
+        Args:
+            price (Decimal): The price of the new invoice detail.
+            quantity (int): The quantity of the new invoice detail.
+            unit_price (Decimal): The unit price of the new invoice detail.
+            description (str): The description of the new invoice detail.
+        """
+        return self.update(
+            updated_at=timezone.now(),
+            total_amount=F('total_amount') + price,
+            line_count=F('line_count') + 1,
+            total_quantity=F('total_quantity') + quantity,
+            max_price=Greatest('max_price', Value(price)),
+            max_unit_price=Greatest('max_unit_price', Value(unit_price)),
+            first_description=Case(
+                When(line_count=0, then=Value(description)),
+                default=Least('first_description', Value(description))
+            )
+        )
+
+    def change_lines(self, amount, line_count: int, quantity: int) -> int:
+        """
+        Adjusts the stored sums of the invoices in place after an invoice detail has been updated or deleted.
+        The stored highest and lowest values are recomputed from the details of each invoice,
+        as the previous highest value cannot be replaced without looking at the others.
+        The update date of the invoices is bumped as well, since their ETag is derived from it.
+
+        Args:
+            amount (Decimal): The amount to add to the total amount, negative to subtract.
+            line_count (int): The number of lines to add to the line count, negative to subtract.
+            quantity (int): The quantity to add to the total quantity, negative to subtract.
+        """
+        return self.update(
+            updated_at=timezone.now(),
+            total_amount=F('total_amount') + amount,
+            line_count=F('line_count') + line_count,
+            total_quantity=F('total_quantity') + quantity,
+            **line_aggregates('max_price', 'max_unit_price', 'first_description')
+        )
+
+    def with_computed_totals(self):
+        """
+        Annotates the invoices with every stored column computed from their details, prefixed with `computed_`.
+        """
+        return self.annotate(**{f"computed_{field}": expression for field, expression in line_aggregates().items()})
+
+    def recompute_totals(self, *fields) -> int:
+        """
+        Recomputes the stored columns of the invoices from their details in a single update.
+
+        Args:
+            *fields (str): The names of the stored columns to recompute, all of them if none are given.
+        """
+        return self.update(updated_at=timezone.now(), **line_aggregates(*fields))
+
 class Invoice(models.Model):
     id = models.CharField(primary_key=True, max_length=36, default=uuid.uuid4, editable=False)
     customer_name = models.CharField(max_length=100, blank=False, null=False)
     invoice_date = models.DateField(blank=False, null=False)
+    # denormalized from the invoice details, kept up to date by every write of the details
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    line_count = models.IntegerField(default=0)
+    # per invoice aggregates of the details, used to sort the invoices by the fields of their details
+    total_quantity = models.IntegerField(default=0)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    max_unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    first_description = models.CharField(max_length=100, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = InvoiceQuerySet.as_manager()
     
     class Meta:
         db_table = 'invoice'
         ordering = ['-invoice_date']
+        indexes = [
+            # keyset pagination walks these indexes in both directions
+            models.Index(fields=['invoice_date', 'id'], name='invoice_date_id_idx'),
+            models.Index(fields=['customer_name', 'id'], name='invoice_customer_name_id_idx'),
+            models.Index(fields=['total_amount', 'id'], name='invoice_total_amount_id_idx'),
+            models.Index(fields=['total_quantity', 'id'], name='invoice_total_quantity_id_idx'),
+            models.Index(fields=['max_price', 'id'], name='invoice_max_price_id_idx'),
+            models.Index(fields=['max_unit_price', 'id'], name='invoice_max_unit_price_id_idx'),
+            models.Index(fields=['first_description', 'id'], name='invoice_first_desc_id_idx'),
+            # the newest update of the listed invoices is their Last-Modified date
+            models.Index(fields=['updated_at'], name='invoice_updated_at_idx'),
+            # range scan of the created_since filter
+            models.Index(fields=['created_at'], name='invoice_created_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['customer_name', 'invoice_date'], name='invoice_customer_date_uniq'),
+        ]
 
     def __str__(self):
         return self.customer_name
@@ -30,4 +147,83 @@ class InvoiceDetail(models.Model):
         ordering = ['-created_at', 'invoice']
 
     def __str__(self):
-        return self.description
\ No newline at end of file
+        return self.description
+
+
+class CustomerMonthRollup(models.Model):
+    """
+    The revenue of a customer in a month, summed over the details of its invoices dated in that month.
+    Kept up to date by every write of the invoice details, see `api/reports.py`.
+    """
+    customer_name = models.CharField(max_length=100)
+    # the first day of the month
+    month = models.DateField()
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    quantity = models.IntegerField(default=0)
+    line_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'customer_month_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['customer_name', 'month'], name='customer_month_rollup_uniq'),
+        ]
+        indexes = [
+            # the reports read a range of months
+            models.Index(fields=['month', 'customer_name'], name='customer_rollup_month_idx'),
+        ]
+
+class ItemMonthRollup(models.Model):
+    """
+    The quantity sold and the revenue of an item, by invoice detail description, in a month.
+    Kept up to date by every write of the invoice details, see `api/reports.py`.
+    """
+    description = models.CharField(max_length=100)
+    # the first day of the month
+    month = models.DateField()
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    quantity = models.IntegerField(default=0)
+    line_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'item_month_rollup'
+        constraints = [
+            models.UniqueConstraint(fields=['description', 'month'], name='item_month_rollup_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'description'], name='item_rollup_month_idx'),
+        ]
+
+
+class SearchDocumentField(models.TextField):
+    """
+    The hidden column of an FTS5 table that has the same name as the table.
+    Matching against it searches every indexed column of the table at once.
+    """
+
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class InvoiceSearch(models.Model):
+    """
+    The `invoice_search` FTS5 table, holding one search document per invoice.
+    The table is not managed by Django, it is created by `db-scripts/create_tables.py`
+    and kept in sync by the functions in `api/search.py`.
+    """
+    rowid = models.BigIntegerField(primary_key=True)
+    invoice = models.OneToOneField(Invoice, related_name='search_document', on_delete=models.DO_NOTHING, db_constraint=False)
+    customer_name = models.TextField()
+    descriptions = models.TextField()
+    document = SearchDocumentField(db_column='invoice_search')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'invoice_search'
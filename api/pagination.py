@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+
+from django.core.paginator import InvalidPage, Page
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when the cursor sent by the client cannot be decoded.
+    """
+
+
+class InvoiceCursorPagination:
+    """
+    Keyset (cursor) pagination for the invoice list.
+
+    Instead of counting every row and skipping `OFFSET` rows, each page continues from the position of the
+    last row of the previous page, which is a pair of the sort field value and the invoice id.
+    With an index on (sort field, id) every page is an index range scan no matter how deep it is.
+    The position is handed to the client as an opaque `cursor` token in the next and previous links.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering_field: str, descending: bool = False):
+        """
+        Initializes an `InvoiceCursorPagination` instance.
+
+        Args:
+            ordering_field (str): The field the invoices are sorted by, the invoice id is used to break ties.
+            descending (bool, optional): Whether the invoices are sorted in descending order. Defaults to False.
+        """
+        self.ordering_field = ordering_field
+        self.descending = descending
+
+    def paginate_queryset(self, queryset, request) -> list:
+        """
+        Returns a single page of the queryset, starting from the position in the cursor of the request.
+
+        Raises:
+            InvalidCursor: If the cursor in the request cannot be decoded.
+        """
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request) -> list:
+        """
+        Asynchronous version of `paginate_queryset`.
+        """
+        return self.set_page([item async for item in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """
+        Returns the query of the page starting from the position in the cursor of the request,
+        with one more row than the page size to tell whether there is a next page.
+        """
+        self.request = request
+        position = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        self.has_cursor = position is not None
+        self.reverse = position['r'] if position else False
+
+        # walking backwards means flipping the sort order and reversing the page afterwards
+        descending = self.descending != self.reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f"{prefix}{self.ordering_field}", f"{prefix}id")
+        if position:
+            lookup = 'lt' if descending else 'gt'
+            # the extra inclusive bound lets SQLite seek into the index instead of scanning it from the start
+            queryset = queryset.filter(
+                Q(**{f"{self.ordering_field}__{lookup}e": position['v']}),
+                Q(**{f"{self.ordering_field}__{lookup}": position['v']}) |
+                Q(**{self.ordering_field: position['v'], f"id__{lookup}": position['id']})
+            )
+
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results: list) -> list:
+        self.has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.page or not (self.reverse or self.has_more):
+            return None
+        return self.build_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.page or not (self.has_more if self.reverse else self.has_cursor):
+            return None
+        return self.build_link(self.page[0], reverse=True)
+
+    def build_link(self, item, reverse: bool) -> str:
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(item, reverse))
+
+    def encode_cursor(self, item, reverse: bool) -> str:
+        """
+        Encodes the position of an invoice into an opaque cursor token.
+
+        Args:
+            item (Invoice | dict): The invoice the page should continue from.
+            reverse (bool): Whether the page should contain the invoices before the item instead of after it.
+
+        Returns:
+            str: The url-safe cursor token.
+        """
+        value = item[self.ordering_field] if isinstance(item, dict) else getattr(item, self.ordering_field)
+        invoice_id = item['id'] if isinstance(item, dict) else item.id
+        if isinstance(value, (date, Decimal)):
+            value = str(value)
+        position = json.dumps({'v': value, 'id': str(invoice_id), 'r': reverse}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str):
+        """
+        Decodes a cursor token back into the position of an invoice.
+
+        Returns:
+            dict: The sort field value `v`, invoice id `id` and direction `r` of the position, or None if there is no cursor.
+
+        Raises:
+            InvalidCursor: If the cursor cannot be decoded.
+        """
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+            raise InvalidCursor("invalid cursor") from error
+        if not isinstance(position, dict) or set(position) != {'v', 'id', 'r'} or position['v'] is None or not isinstance(position['r'], bool):
+            raise InvalidCursor("invalid cursor")
+        return position
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination of the async views, counting the rows and fetching the page with the async ORM.
+    Produces the same pages and links as `PageNumberPagination`.
+    """
+    page_size = 10
+
+    async def apaginate_queryset(self, queryset, request) -> list:
+        """
+        Returns a single page of the queryset, the one numbered by the page query parameter of the request.
+
+        Raises:
+            NotFound: If the page number is not valid.
+        """
+        page_size = self.get_page_size(request)
+        paginator = self.django_paginator_class(queryset, page_size)
+        # the count is cached by the paginator, counting it here keeps the query out of the synchronous code
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        bottom = (number - 1) * page_size
+        object_list = [item async for item in queryset[bottom:bottom + page_size]]
+        self.page = Page(object_list, number, paginator)
+        self.request = request
+        return object_list
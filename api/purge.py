@@ -0,0 +1,137 @@
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Invoice, InvoiceDetail
+from .reports import RollupChanges
+from .search import remove_search_documents
+
+# invoices deleted per transaction, the writers waiting for the lock get their turn between two chunks
+CHUNK_SIZE = 500
+
+
+def invoices_to_purge(customer_name: str = None, date_from=None, date_to=None):
+    """
+    Returns the invoices matching the filters of a bulk deletion, all of them when no filter is given.
+
+    Args:
+        customer_name (str, optional): The exact customer name of the invoices.
+        date_from (date, optional): The first invoice date, included.
+        date_to (date, optional): The last invoice date, included.
+    """
+    invoices = Invoice.objects.order_by()
+    if customer_name is not None:
+        invoices = invoices.filter(customer_name=customer_name)
+    if date_from is not None:
+        invoices = invoices.filter(invoice_date__gte=date_from)
+    if date_to is not None:
+        invoices = invoices.filter(invoice_date__lte=date_to)
+    return invoices
+
+
+def cascades_invoice_details(connection) -> bool:
+    """
+    Tells whether deleting an invoice row deletes its details in the database itself.
+    That is the case for the tables of `db-scripts/create_tables.py`, whose foreign key is declared with
+    ON DELETE CASCADE, as long as foreign keys are enforced, which Django turns on for every SQLite connection.
+    The tables Django creates itself, e.g. for the tests, have no such clause.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA foreign_keys")
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"PRAGMA foreign_key_list({connection.ops.quote_name(InvoiceDetail._meta.db_table)})")
+        # id, seq, table, from, to, on_update, on_delete, match
+        return any(
+            row[2] == Invoice._meta.db_table and row[3] == 'invoice_id' and row[6].upper() == 'CASCADE'
+            for row in cursor.fetchall()
+        )
+
+
+def delete_invoice_rows(connection, invoice_ids: list, cascade: bool) -> tuple:
+    """
+    Deletes a chunk of invoices with set-based statements, along with their details, search documents
+    and their share of the report rollups. Runs in the transaction of the caller.
+
+    Args:
+        connection: The connection of the invoice tables.
+        invoice_ids (list): The ids of the invoices.
+        cascade (bool): Whether the database deletes the details of a deleted invoice, see `cascades_invoice_details`.
+
+    Returns:
+        tuple: The number of invoices and of invoice details deleted.
+    """
+    rollups = RollupChanges()
+    detail_count = 0
+    groups = (
+        InvoiceDetail.objects.filter(invoice_id__in=invoice_ids).order_by()
+        .values('invoice__customer_name', 'invoice__invoice_date', 'description')
+        .annotate(revenue=Sum('price'), quantity=Sum('quantity'), lines=Count('id'))
+    )
+    for group in groups:
+        rollups.add_totals(
+            group['invoice__customer_name'], group['invoice__invoice_date'], group['description'],
+            -group['revenue'], -group['quantity'], -group['lines']
+        )
+        detail_count += group['lines']
+
+    quote_name = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(invoice_ids))
+    with connection.cursor() as cursor:
+        if not cascade:
+            cursor.execute(
+                f"DELETE FROM {quote_name(InvoiceDetail._meta.db_table)} WHERE invoice_id IN ({placeholders})", invoice_ids
+            )
+        cursor.execute(f"DELETE FROM {quote_name(Invoice._meta.db_table)} WHERE id IN ({placeholders})", invoice_ids)
+        invoice_count = cursor.rowcount
+    remove_search_documents(invoice_ids)
+    rollups.save()
+    return invoice_count, detail_count
+
+
+def purge_invoices(invoices, chunk_size: int = CHUNK_SIZE, dry_run: bool = False, on_chunk=None) -> dict:
+    """
+    Deletes many invoices in chunks, each chunk in its own transaction with a few set-based statements,
+    rather than one request, one lookup and one Django cascade per invoice.
+
+    The details of the invoices are deleted by the ON DELETE CASCADE of their foreign key when the database has it,
+    by one more statement per chunk otherwise. The chunks are taken from the filtered invoices until none are left,
+    so a deletion interrupted between two chunks can simply be run again.
+
+    Args:
+        invoices (QuerySet): The invoices to delete, see `invoices_to_purge`.
+        chunk_size (int, optional): The number of invoices deleted per transaction. Defaults to 500.
+        dry_run (bool, optional): Only count the invoices and their details, without deleting. Defaults to False.
+        on_chunk (callable, optional): Called with the result so far after every chunk, to report the progress.
+
+    Returns:
+        dict: The number of invoices and details that matched, and of those deleted.
+    """
+    # the stored line counts give the number of details without reading them
+    matched = invoices.aggregate(invoices=Count('id'), details=Coalesce(Sum('line_count'), 0))
+    result = {
+        "matched_invoices": matched['invoices'],
+        "matched_details": matched['details'],
+        "deleted_invoices": 0,
+        "deleted_details": 0,
+        "dry_run": dry_run,
+    }
+    if dry_run or not matched['invoices']:
+        return result
+
+    using = router.db_for_write(Invoice)
+    connection = connections[using]
+    cascade = cascades_invoice_details(connection)
+    while True:
+        with transaction.atomic(using=using):
+            invoice_ids = list(invoices.values_list('id', flat=True)[:chunk_size])
+            if not invoice_ids:
+                break
+            invoice_count, detail_count = delete_invoice_rows(connection, invoice_ids, cascade)
+        result["deleted_invoices"] += invoice_count
+        result["deleted_details"] += detail_count
+        if on_chunk is not None:
+            on_chunk(result)
+    return result
@@ -0,0 +1,71 @@
+import io
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    # the stdlib json module of the Django REST framework classes is used instead
+    orjson = None
+
+# the dates and times go through the encoder of Django REST framework, which formats them differently from orjson
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+# escaped by JSONRenderer so the JSON can be embedded in JavaScript
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+def dumps(data) -> bytes:
+    """
+    Encodes data to compact UTF-8 JSON, with orjson when it is installed.
+    The output is the same as the one of `JSONRenderer`: the types orjson does not know, such as `Decimal`,
+    dates, times and lazy strings, are converted by the encoder of Django REST framework, and the U+2028 and U+2029
+    line separators are escaped for JavaScript. Only NaN and infinite floats differ, orjson writes them as null
+    where `JSONRenderer` refuses them, and the models hold none.
+
+    Raises:
+        TypeError: If the data holds a value that cannot be encoded.
+    """
+    if orjson is None:
+        return JSONRenderer().render(data)
+    try:
+        content = orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+    except orjson.JSONEncodeError:
+        # integers beyond 64 bits for instance, the stdlib encoder raises its own error for the values it cannot encode either
+        return JSONRenderer().render(data)
+    if b'\xe2\x80' in content:
+        for separator, escaped in LINE_SEPARATORS:
+            content = content.replace(separator, escaped)
+    return content
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` encoding with orjson when it is installed, which is several times faster on large pages.
+    Produces the same bytes as `JSONRenderer`, indented responses are still rendered by it.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    """
+    `JSONParser` decoding with orjson when it is installed and the body is UTF-8.
+    Like the strict parser, NaN and Infinity are refused. Bodies orjson cannot read, such as integers beyond 64 bits,
+    are handed to `JSONParser`, which also reports the parse errors.
+    """
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        content = stream.read()
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(content), media_type, parser_context)
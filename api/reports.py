@@ -0,0 +1,226 @@
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import Sum
+
+from .models import CustomerMonthRollup, Invoice, InvoiceDetail, ItemMonthRollup
+from .utils import to_amount
+
+# the rollup tables, each with the column of its key besides the month
+ROLLUPS = ((CustomerMonthRollup, 'customer_name'), (ItemMonthRollup, 'description'))
+# rows written per statement, 5 parameters each
+BATCH_SIZE = 100
+
+
+def month_of(invoice_date) -> date:
+    """
+    Returns the first day of the month of an invoice date, given as a date or in the YYYY-MM-DD format.
+    """
+    if isinstance(invoice_date, str):
+        invoice_date = datetime.strptime(invoice_date, '%Y-%m-%d').date()
+    return invoice_date.replace(day=1)
+
+
+def detail_value(detail, field: str):
+    return detail[field] if isinstance(detail, dict) else getattr(detail, field)
+
+
+class RollupChanges:
+    """
+    Collects the changes that writes of invoice details make to the report rollups, and applies them together.
+
+    The rollups hold the sums of the details per (customer name, month) and per (description, month). A write adds
+    the details it creates, subtracts the ones it deletes, and subtracts then adds the ones it changes. The changes
+    cancel out per key before anything is written, so only the keys whose sums actually moved are updated,
+    with one upsert per table however many details the write touched.
+    """
+    def __init__(self):
+        self.changes = {table: defaultdict(lambda: [Decimal(0), 0, 0]) for table, _ in ROLLUPS}
+
+    def add(self, customer_name: str, invoice_date, details, sign: int = 1):
+        """
+        Adds the details of an invoice to the rollups, or subtracts them with a negative sign.
+
+        Args:
+            customer_name (str): The customer name of the invoice.
+            invoice_date (date | str): The invoice date.
+            details (iterable): The details, as `InvoiceDetail` instances or dictionaries of their description, quantity and price.
+            sign (int, optional): 1 to add the details, -1 to subtract them. Defaults to 1.
+        """
+        month = month_of(invoice_date)
+        customers = self.changes[CustomerMonthRollup]
+        items = self.changes[ItemMonthRollup]
+        for detail in details:
+            price = to_amount(detail_value(detail, 'price'))
+            quantity = detail_value(detail, 'quantity')
+            for totals in (customers[(customer_name, month)], items[(detail_value(detail, 'description'), month)]):
+                totals[0] += sign * price
+                totals[1] += sign * quantity
+                totals[2] += sign
+
+    def remove(self, customer_name: str, invoice_date, details):
+        self.add(customer_name, invoice_date, details, sign=-1)
+
+    def add_totals(self, customer_name: str, invoice_date, description: str, revenue: Decimal, quantity: int = 0,
+                   line_count: int = 0):
+        """
+        Adds sums of details already grouped by customer, invoice date and description to the rollups,
+        for the set-based writes that aggregate the details in SQL rather than loading them.
+
+        Args:
+            customer_name (str): The customer name of the invoices.
+            invoice_date (date | str): The invoice date.
+            description (str): The description of the details.
+            revenue (Decimal): The change of the revenue, negative to subtract.
+            quantity (int, optional): The change of the quantity. Defaults to 0.
+            line_count (int, optional): The change of the number of details. Defaults to 0.
+        """
+        month = month_of(invoice_date)
+        for totals in (self.changes[CustomerMonthRollup][(customer_name, month)], self.changes[ItemMonthRollup][(description, month)]):
+            totals[0] += revenue
+            totals[1] += quantity
+            totals[2] += line_count
+
+    def save(self):
+        """
+        Writes the collected changes to the rollups, in the transaction of the write they belong to.
+        The rows left without any detail are deleted, so the reports never list empty months.
+        """
+        for table, key_field in ROLLUPS:
+            rows = [
+                (key, month.isoformat(), str(revenue), quantity, line_count)
+                for (key, month), (revenue, quantity, line_count) in self.changes[table].items()
+                if revenue or quantity or line_count
+            ]
+            if rows:
+                apply_rollup_rows(table, key_field, rows)
+        for changes in self.changes.values():
+            changes.clear()
+
+
+def apply_rollup_rows(table, key_field: str, rows: list):
+    """
+    Adds rows of (key, month, revenue, quantity, line count) to the sums of a rollup table, inserting the missing keys.
+
+    Args:
+        table (Model): The rollup model.
+        key_field (str): The name of its key column besides the month.
+        rows (list): The changes to apply, at most one per key.
+    """
+    connection = connections[router.db_for_write(table)]
+    quote_name = connection.ops.quote_name
+    db_table = quote_name(table._meta.db_table)
+    key = quote_name(key_field)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f"INSERT INTO {db_table} ({key}, month, revenue, quantity, line_count) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))} "
+                f"ON CONFLICT ({key}, month) DO UPDATE SET revenue = revenue + excluded.revenue, "
+                f"quantity = quantity + excluded.quantity, line_count = line_count + excluded.line_count",
+                [value for row in batch for value in row]
+            )
+            emptied = [row[:2] for row in batch if row[4] < 0]
+            if emptied:
+                cursor.execute(
+                    f"DELETE FROM {db_table} WHERE line_count <= 0 AND ({key}, month) IN "
+                    f"(VALUES {', '.join(['(%s, %s)'] * len(emptied))})",
+                    [value for row in emptied for value in row]
+                )
+
+
+def invoice_details_of(invoice_ids) -> dict:
+    """
+    Returns the description, quantity and price of the details of the given invoices, keyed by invoice id.
+    Used by the writes that change or delete whole invoices, before they do.
+    """
+    details = defaultdict(list)
+    for detail in InvoiceDetail.objects.filter(invoice_id__in=invoice_ids).order_by().values('invoice_id', 'description', 'quantity', 'price'):
+        details[detail['invoice_id']].append(detail)
+    return details
+
+
+def create_rollup_tables(using: str = 'default'):
+    """
+    Creates the rollup tables of the reports in a database that does not have them yet.
+    """
+    connection = connections[using]
+    existing = set(connection.introspection.table_names())
+    missing = [table for table, _ in ROLLUPS if table._meta.db_table not in existing]
+    if not missing:
+        return
+    with connection.schema_editor() as schema_editor:
+        for table in missing:
+            schema_editor.create_model(table)
+
+
+def rebuild_rollups() -> int:
+    """
+    Creates the rollup tables if needed and computes them again from every invoice detail, with one statement per table.
+    Used to fill the rollups of an existing database or to repair them.
+
+    Returns:
+        int: The number of rollup rows.
+    """
+    using = router.db_for_write(CustomerMonthRollup)
+    create_rollup_tables(using)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    detail_table = quote_name(InvoiceDetail._meta.db_table)
+    invoice_table = quote_name(Invoice._meta.db_table)
+    count = 0
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for table, key_field in ROLLUPS:
+            db_table = quote_name(table._meta.db_table)
+            source = 'invoice.customer_name' if key_field == 'customer_name' else 'detail.description'
+            cursor.execute(f"DELETE FROM {db_table}")
+            cursor.execute(
+                f"INSERT INTO {db_table} ({quote_name(key_field)}, month, revenue, quantity, line_count) "
+                f"SELECT {source}, date(invoice.invoice_date, 'start of month'), SUM(detail.price), SUM(detail.quantity), COUNT(*) "
+                f"FROM {detail_table} detail JOIN {invoice_table} invoice ON invoice.id = detail.invoice_id "
+                f"GROUP BY 1, 2"
+            )
+            count += cursor.rowcount
+    return count
+
+
+def revenue_report(month_from: date = None, month_to: date = None, customer_name: str = None):
+    """
+    Returns the revenue per customer and month, the latest month first and the highest revenue first within a month.
+    Reads the rollup rows of the requested months only, whatever the number of invoice details behind them.
+    """
+    rows = CustomerMonthRollup.objects.all()
+    if month_from:
+        rows = rows.filter(month__gte=month_from)
+    if month_to:
+        rows = rows.filter(month__lte=month_to)
+    if customer_name:
+        rows = rows.filter(customer_name=customer_name)
+    return rows.order_by('-month', '-revenue', 'customer_name').values('customer_name', 'month', 'revenue', 'quantity', 'line_count')
+
+
+def top_items_report(month_from: date = None, month_to: date = None, limit: int = 10) -> list:
+    """
+    Returns the items sold in the largest quantities over a range of months, summed from the rollup rows of those months.
+    """
+    rows = ItemMonthRollup.objects.all()
+    if month_from:
+        rows = rows.filter(month__gte=month_from)
+    if month_to:
+        rows = rows.filter(month__lte=month_to)
+    return [
+        {**row, 'revenue': str(to_amount(row['revenue']))}
+        for row in rows.values('description')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'), line_count=Sum('line_count'))
+        .order_by('-quantity', 'description')[:limit]
+    ]
+
+
+def month_row(row: dict) -> dict:
+    """
+    Returns the representation of a rollup row, with the month in the YYYY-MM format and the revenue as `DecimalField` gives it.
+    """
+    return {**row, 'month': row['month'].strftime('%Y-%m'), 'revenue': str(to_amount(row['revenue']))}
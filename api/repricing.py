@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .models import Invoice, InvoiceDetail
+from .reports import RollupChanges
+from .utils import to_amount
+
+# the largest unit price and price the columns hold, 10 digits with 2 decimals
+MAX_PRICE = Decimal('99999999.99')
+
+
+class RepricingError(ValueError):
+    """
+    Raised when a repricing is refused, before anything is written.
+    """
+
+
+def details_to_reprice(description: str = None, customer_name: str = None, date_from=None, date_to=None):
+    """
+    Returns the invoice details matching the filters of a repricing, all of them when no filter is given.
+
+    Args:
+        description (str, optional): The exact description of the details.
+        customer_name (str, optional): The exact customer name of their invoices.
+        date_from (date, optional): The first invoice date, included.
+        date_to (date, optional): The last invoice date, included.
+    """
+    details = InvoiceDetail.objects.order_by()
+    if description is not None:
+        details = details.filter(description=description)
+    if customer_name is not None:
+        details = details.filter(invoice__customer_name=customer_name)
+    if date_from is not None:
+        details = details.filter(invoice__invoice_date__gte=date_from)
+    if date_to is not None:
+        details = details.filter(invoice__invoice_date__lte=date_to)
+    return details
+
+
+def new_unit_price(unit_price: Decimal = None, percent: Decimal = None):
+    """
+    Returns the expression of the new unit price of a detail, either a fixed unit price
+    or the current one changed by a percentage, rounded to the cent.
+    """
+    if unit_price is not None:
+        return Value(unit_price)
+    return Round(F('unit_price') * Value(1 + percent / 100), 2)
+
+
+def reprice_invoice_details(details, unit_price: Decimal = None, percent: Decimal = None, max_rows: int = None,
+                            dry_run: bool = False) -> dict:
+    """
+    Sets a new unit price on many invoice details at once, and recomputes their prices, the totals of their
+    invoices and the report rollups, with set-based statements rather than one write per detail.
+
+    The details are first summed per customer, invoice date and description with their current and new prices,
+    which counts them, gives the change of every rollup and the highest new price. Then a single UPDATE sets the
+    unit price and price of every detail, a single UPDATE recomputes the stored amounts of their invoices and the
+    rollups get their changes in batched upserts. The descriptions do not change, so the search index is left alone.
+
+    Args:
+        details (QuerySet): The invoice details to reprice, see `details_to_reprice`.
+        unit_price (Decimal, optional): The new unit price of every detail.
+        percent (Decimal, optional): The change of the current unit prices in percent, e.g. -10 for 10% off.
+        max_rows (int, optional): The largest number of details the repricing may change.
+        dry_run (bool, optional): Only count the details and the change of the amounts, without writing. Defaults to False.
+
+    Returns:
+        dict: The number of details matched and updated, and the change of the total amount of their invoices.
+
+    Raises:
+        RepricingError: If more than `max_rows` details match, or a new price does not fit in its column.
+    """
+    unit_price_expression = new_unit_price(unit_price, percent)
+    price_expression = Round(F('quantity') * unit_price_expression, 2)
+    with transaction.atomic():
+        groups = list(
+            details.values('invoice__customer_name', 'invoice__invoice_date', 'description').annotate(
+                lines=Count('id'),
+                old_price=Sum('price'),
+                new_price=Sum(price_expression),
+                highest=Greatest(Max(unit_price_expression), Max(price_expression))
+            )
+        )
+        for group in groups:
+            group['change'] = to_amount(group['new_price']) - to_amount(group['old_price'])
+        matched = sum(group['lines'] for group in groups)
+        amount = sum((group['change'] for group in groups), Decimal(0))
+        result = {"matched": matched, "updated": 0, "amount_change": str(amount), "dry_run": dry_run}
+        if max_rows is not None and matched > max_rows:
+            raise RepricingError(f"{matched} invoice details match, more than the limit of {max_rows}")
+        if any(to_amount(group['highest']) > MAX_PRICE for group in groups):
+            raise RepricingError(f"the new prices cannot exceed {MAX_PRICE}")
+        if dry_run or not matched:
+            return result
+
+        # the filters only read columns the update leaves alone, so they select the same details afterwards
+        result["updated"] = details.update(unit_price=unit_price_expression, price=price_expression, updated_at=timezone.now())
+        # the quantities, the number of lines and the descriptions are left as they are
+        Invoice.objects.filter(id__in=details.values('invoice_id')).recompute_totals('total_amount', 'max_price', 'max_unit_price')
+        rollups = RollupChanges()
+        for group in groups:
+            rollups.add_totals(group['invoice__customer_name'], group['invoice__invoice_date'], group['description'], group['change'])
+        rollups.save()
+    return result
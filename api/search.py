@@ -0,0 +1,206 @@
+import hashlib
+import re
+
+from django.db import connections, router
+
+from .models import Invoice, InvoiceDetail, InvoiceSearch
+
+CREATE_SEARCH_TABLE_SQL = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+        invoice_id UNINDEXED,
+        customer_name,
+        descriptions,
+        prefix='2 3'
+    )
+"""
+
+BATCH_SIZE = 500
+
+
+def create_search_table(using: str = 'default'):
+    """
+    Creates the `invoice_search` FTS5 table if it does not exist yet.
+    The table holds one document per invoice made of the customer name and the descriptions of all its details.
+
+    Args:
+        using (str, optional): The alias of the database to create the table in. Defaults to 'default'.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(CREATE_SEARCH_TABLE_SQL)
+
+
+def document_rowid(invoice_id) -> int:
+    """
+    Returns the rowid of the search document of an invoice.
+    FTS5 tables can only be looked up efficiently by rowid, so the rowid is derived from the invoice id
+    which allows a document to be replaced or removed without scanning the whole table.
+    """
+    digest = hashlib.blake2b(str(invoice_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def build_match_expression(query: str) -> str:
+    """
+    Turns the search text typed by a user into an FTS5 query.
+    Every word of the text has to match the start of a word of the customer name or of a detail description.
+
+    Args:
+        query (str): The search text.
+
+    Returns:
+        str: The FTS5 query, or an empty string if the text does not contain any words.
+    """
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", query))
+
+
+def search_invoices(queryset, query: str):
+    """
+    Filters a queryset of invoices down to the ones matching the search text, using the full-text index.
+
+    Args:
+        queryset (QuerySet): The invoices to search in.
+        query (str): The search text.
+
+    Returns:
+        QuerySet: The matching invoices, they can be ordered by relevance using `search_document__rank`.
+    """
+    expression = build_match_expression(query)
+    if not expression:
+        return queryset.none()
+    return queryset.filter(search_document__document__match=expression)
+
+
+def index_invoices(invoice_ids):
+    """
+    Replaces the search documents of the given invoices with their current customer name and detail descriptions.
+    Invoices that no longer exist simply lose their document.
+    Has to be called whenever an invoice or one of its details is created, updated or deleted.
+
+    Args:
+        invoice_ids (iterable): The ids of the invoices to index.
+    """
+    invoice_ids = [str(invoice_id) for invoice_id in invoice_ids]
+    for start in range(0, len(invoice_ids), BATCH_SIZE):
+        batch = invoice_ids[start:start + BATCH_SIZE]
+        descriptions = {invoice_id: [] for invoice_id in batch}
+        for invoice_id, description in InvoiceDetail.objects.filter(invoice_id__in=batch).order_by().values_list('invoice_id', 'description'):
+            descriptions[invoice_id].append(description)
+        documents = [
+            (invoice_id, customer_name, descriptions[invoice_id])
+            for invoice_id, customer_name in Invoice.objects.filter(id__in=batch).order_by().values_list('id', 'customer_name')
+        ]
+
+        remove_search_documents(batch)
+        add_search_documents(documents)
+
+
+def add_search_documents(documents):
+    """
+    Adds the search documents of invoices that do not have one yet, from data that is already at hand.
+
+    Args:
+        documents (iterable): Triples of the invoice id, the customer name and the list of detail descriptions.
+    """
+    documents = list(documents)
+    if not documents:
+        return
+    connection = connections[router.db_for_write(InvoiceSearch)]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO invoice_search (rowid, invoice_id, customer_name, descriptions) VALUES (%s, %s, %s, %s)",
+            [
+                (document_rowid(invoice_id), invoice_id, customer_name, " ".join(descriptions))
+                for invoice_id, customer_name, descriptions in documents
+            ]
+        )
+
+
+def search_documents(invoices, invoice_details) -> list:
+    """
+    Builds the search documents of invoices that have just been written along with all their details.
+
+    Args:
+        invoices (list): The invoices.
+        invoice_details (list): Every detail of those invoices.
+
+    Returns:
+        list: Triples of the invoice id, the customer name and the list of detail descriptions, as taken by `add_search_documents`.
+    """
+    descriptions = {str(invoice.id): [] for invoice in invoices}
+    for invoice_detail in invoice_details:
+        descriptions[str(invoice_detail.invoice_id)].append(invoice_detail.description)
+    return [(str(invoice.id), invoice.customer_name, descriptions[str(invoice.id)]) for invoice in invoices]
+
+
+def replace_search_documents(documents):
+    """
+    Replaces the search documents of invoices from data that is already at hand, without reading their details back.
+
+    Args:
+        documents (list): Triples of the invoice id, the customer name and the list of detail descriptions.
+    """
+    remove_search_documents([invoice_id for invoice_id, _, _ in documents])
+    add_search_documents(documents)
+
+
+def remove_search_documents(invoice_ids):
+    """
+    Removes the search documents of the given invoices, e.g. once they are deleted.
+
+    Args:
+        invoice_ids (list): The ids of the invoices.
+    """
+    if not invoice_ids:
+        return
+    connection = connections[router.db_for_write(InvoiceSearch)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM invoice_search WHERE rowid IN ({', '.join(['%s'] * len(invoice_ids))})",
+            [document_rowid(invoice_id) for invoice_id in invoice_ids]
+        )
+
+
+def clear_search_index():
+    """
+    Creates the search table if needed and removes every document, e.g. before a bulk load that indexes its invoices once at the end.
+    """
+    using = router.db_for_write(InvoiceSearch)
+    create_search_table(using)
+    with connections[using].cursor() as cursor:
+        cursor.execute("DELETE FROM invoice_search")
+
+
+def rebuild_search_index(batch_size: int = BATCH_SIZE) -> int:
+    """
+    Creates the search table if needed and rebuilds every document from scratch.
+    Used to fill the index of an existing database or to repair it, and at the end of a bulk load with deferred indexes.
+
+    The documents are read in a single pass over the invoices and their details, grouped by the database and sorted
+    by their rowid, since FTS5 inserts rows in rowid order several times faster than the random order of the invoice ids.
+
+    Args:
+        batch_size (int, optional): The number of invoices indexed at once. Defaults to 500.
+
+    Returns:
+        int: The number of invoices indexed.
+    """
+    clear_search_index()
+
+    connection = connections[router.db_for_write(InvoiceSearch)]
+    connection.ensure_connection()
+    connection.connection.create_function('document_rowid', 1, document_rowid, deterministic=True)
+    quote_name = connection.ops.quote_name
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT invoice.id, invoice.customer_name, group_concat(detail.description, ' ') "
+            f"FROM {quote_name(Invoice._meta.db_table)} invoice "
+            f"LEFT JOIN {quote_name(InvoiceDetail._meta.db_table)} detail ON detail.invoice_id = invoice.id "
+            f"GROUP BY invoice.id ORDER BY document_rowid(invoice.id)"
+        )
+        while rows := cursor.fetchmany(batch_size):
+            add_search_documents(
+                (invoice_id, customer_name, [descriptions] if descriptions else []) for invoice_id, customer_name, descriptions in rows
+            )
+            count += len(rows)
+    return count
@@ -1,8 +1,145 @@
 from rest_framework import serializers, validators
 from .models import Invoice, InvoiceDetail
-from datetime import datetime
+from .reports import RollupChanges, invoice_details_of, month_of
+from .search import add_search_documents, index_invoices, replace_search_documents, search_documents
+from .utils import PreconditionFailed, to_amount
+from datetime import date, datetime
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
 
+# fields of the invoice and invoice detail representations, in the order of their serializers
+INVOICE_FIELDS = ('id', 'customer_name', 'invoice_date', 'total_amount', 'line_count')
+DETAIL_FIELDS = ('id', 'description', 'quantity', 'unit_price', 'price')
+
+def duplicate_invoice_error(invoice_id) -> dict:
+    """
+    Returns the error reported when an invoice already exists for the customer on the same date.
+
+    Args:
+        invoice_id (str): The id of the existing invoice, None if it has not been created yet.
+    """
+    return {
+        "duplicate_value_error": ["invoice already exists for the customer on the same date"],
+        "additional_message": ["use the invoice-detail-create endpoint to add more details to the existing invoice"],
+        "invoice_id": [invoice_id]
+    }
+
+def find_duplicate_invoices(invoices_data, batch_size: int = 500) -> dict:
+    """
+    Finds the invoices that clash with an existing invoice or with an earlier invoice of the same batch.
+    The existing invoices are looked up in batches instead of one query per invoice.
+
+    Args:
+        invoices_data (dict): The validated invoice data keyed by its position in the batch.
+        batch_size (int, optional): The number of invoices looked up per query. Defaults to 500.
+
+    Returns:
+        dict: The id of the clashing invoice keyed by the position of the duplicate in the batch.
+              Duplicates within the batch itself have no id yet and are reported with `None`.
+    """
+    today = timezone.now().date()
+    keys = {
+        index: (invoice_data['customer_name'], invoice_data.get('invoice_date') or today)
+        for index, invoice_data in invoices_data.items()
+    }
+
+    existing = {}
+    unique_keys = set(keys.values())
+    customer_names = list({customer_name for customer_name, _ in unique_keys})
+    invoice_dates = [invoice_date for _, invoice_date in unique_keys]
+    for start in range(0, len(customer_names), batch_size):
+        # a list of dates as well would make SQLite probe the unique index with every (name, date) combination,
+        # a range of dates is scanned once per name instead
+        candidates = Invoice.objects.filter(
+            customer_name__in=customer_names[start:start + batch_size],
+            invoice_date__range=(min(invoice_dates), max(invoice_dates))
+            ).values_list('id', 'customer_name', 'invoice_date')
+        for invoice_id, customer_name, invoice_date in candidates:
+            if (customer_name, invoice_date) in unique_keys:
+                existing[(customer_name, invoice_date)] = invoice_id
+
+    duplicates = {}
+    seen = set()
+    for index, key in keys.items():
+        if key in existing:
+            duplicates[index] = existing[key]
+        elif key in seen:
+            duplicates[index] = None
+        seen.add(key)
+    return duplicates
+
+def get_totals(invoice_details_data) -> dict:
+    """
+    Returns the stored totals and aggregates of an invoice made of the given validated invoice details.
+    """
+    return {
+        'total_amount': sum((to_amount(detail_data['price']) for detail_data in invoice_details_data), Decimal(0)),
+        'line_count': len(invoice_details_data),
+        'total_quantity': sum(detail_data['quantity'] for detail_data in invoice_details_data),
+        'max_price': max((to_amount(detail_data['price']) for detail_data in invoice_details_data), default=Decimal(0)),
+        'max_unit_price': max((to_amount(detail_data['unit_price']) for detail_data in invoice_details_data), default=Decimal(0)),
+        'first_description': min((detail_data['description'] for detail_data in invoice_details_data), default='')
+    }
+
+def new_invoice_detail(invoice, invoice_detail_data) -> InvoiceDetail:
+    """
+    Builds an unsaved invoice detail of an invoice from its validated data.
+    An id sent along with the detail only matches an existing detail on update, new details always get a new id.
+    """
+    return InvoiceDetail(invoice=invoice, **{field: value for field, value in invoice_detail_data.items() if field != 'id'})
+
+def match_invoice_details(invoice_details, invoice_details_data) -> tuple:
+    """
+    Pairs the details sent to replace those of an invoice with its existing details.
+    A detail sent with an id is paired with the existing detail of that id, the others are paired
+    with an existing detail that has the same description and is not paired yet, in the order they were created.
+
+    Args:
+        invoice_details (list): The existing details of the invoice.
+        invoice_details_data (list): The validated details that replace them.
+
+    Returns:
+        tuple: The pairs of an existing detail and its new data, the data of the details to create,
+               and the existing details to delete.
+
+    Raises:
+        serializers.ValidationError: If an id is not the one of a detail of the invoice, or is sent twice.
+    """
+    by_id = {invoice_detail.id: invoice_detail for invoice_detail in invoice_details}
+    matched = {}
+    claimed = set()
+    errors = []
+    for index, invoice_detail_data in enumerate(invoice_details_data):
+        invoice_detail_id = invoice_detail_data.get('id')
+        if invoice_detail_id is None:
+            continue
+        if invoice_detail_id not in by_id:
+            errors.append(f"invoice detail {invoice_detail_id} does not belong to the invoice")
+        elif invoice_detail_id in claimed:
+            errors.append(f"invoice detail {invoice_detail_id} is sent more than once")
+        else:
+            matched[index] = invoice_detail_id
+            claimed.add(invoice_detail_id)
+    if errors:
+        raise serializers.ValidationError({"invoice_details": errors})
+
+    by_description = {}
+    for invoice_detail in sorted(invoice_details, key=lambda invoice_detail: (invoice_detail.created_at, invoice_detail.id)):
+        if invoice_detail.id not in claimed:
+            by_description.setdefault(invoice_detail.description, []).append(invoice_detail.id)
+    for index, invoice_detail_data in enumerate(invoice_details_data):
+        candidates = by_description.get(invoice_detail_data['description'])
+        if index not in matched and candidates:
+            matched[index] = candidates.pop(0)
+            claimed.add(matched[index])
+
+    pairs = [(by_id[matched[index]], invoice_details_data[index]) for index in sorted(matched)]
+    created = [invoice_detail_data for index, invoice_detail_data in enumerate(invoice_details_data) if index not in matched]
+    deleted = [invoice_detail for invoice_detail in invoice_details if invoice_detail.id not in claimed]
+    return pairs, created, deleted
+
 class InvoiceDetailSerializer(serializers.ModelSerializer):
     id = serializers.CharField(read_only=True)
     price = serializers.FloatField(required=False)
@@ -37,17 +174,83 @@ class InvoiceDetailSerializer(serializers.ModelSerializer):
             return data
         return data
         
+    def create(self, validated_data):
+        invoice_detail = super().create(validated_data)
+        Invoice.objects.filter(id=invoice_detail.invoice_id).add_line(
+            to_amount(invoice_detail.price),
+            invoice_detail.quantity,
+            to_amount(invoice_detail.unit_price),
+            invoice_detail.description
+        )
+        rollups = RollupChanges()
+        rollups.add(invoice_detail.invoice.customer_name, invoice_detail.invoice.invoice_date, [invoice_detail])
+        rollups.save()
+        return invoice_detail
+
     def update(self, instance, validated_data):
+        previous_price = to_amount(instance.price)
+        previous_quantity = instance.quantity
+        previous = {'description': instance.description, 'quantity': instance.quantity, 'price': instance.price}
         instance.description = validated_data.get('description', instance.description)
         instance.quantity = validated_data.get('quantity', instance.quantity)
         instance.unit_price = validated_data.get('unit_price', instance.unit_price)
         instance.price = instance.unit_price * instance.quantity
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+            Invoice.objects.filter(id=instance.invoice_id).change_lines(
+                to_amount(instance.price) - previous_price,
+                0,
+                instance.quantity - previous_quantity
+            )
+            if (instance.description, instance.quantity, to_amount(instance.price)) != (
+                previous['description'], previous_quantity, previous_price
+            ):
+                customer_name, invoice_date = Invoice.objects.filter(id=instance.invoice_id).values_list(
+                    'customer_name', 'invoice_date'
+                ).get()
+                rollups = RollupChanges()
+                rollups.remove(customer_name, invoice_date, [previous])
+                rollups.add(customer_name, invoice_date, [instance])
+                rollups.save()
         return instance
     
+class InvoiceLineSerializer(InvoiceDetailSerializer):
+    """
+    An invoice detail nested in an invoice.
+    The id is optional, when the invoice is replaced it tells which existing detail the line updates.
+    """
+    id = serializers.CharField(required=False, max_length=36)
+
+class InvoiceListSerializer(serializers.ListSerializer):
+    """
+    Creates many invoices at once.
+    All the invoices and their details are inserted using bulk inserts inside a single transaction,
+    instead of one query (and one commit) per invoice and per invoice detail.
+    """
+    def create(self, validated_data):
+        invoices = []
+        invoice_details = []
+        rollups = RollupChanges()
+        for invoice_data in validated_data:
+            invoice_details_data = invoice_data.pop('invoice_details')
+            if not invoice_data.get('invoice_date'):
+                invoice_data['invoice_date'] = timezone.now().strftime('%Y-%m-%d')
+            invoice = Invoice(**invoice_data, **get_totals(invoice_details_data))
+            invoices.append(invoice)
+            for invoice_detail_data in invoice_details_data:
+                invoice_details.append(new_invoice_detail(invoice, invoice_detail_data))
+            rollups.add(invoice.customer_name, invoice.invoice_date, invoice_details_data)
+
+        with transaction.atomic():
+            Invoice.objects.bulk_create(invoices)
+            InvoiceDetail.objects.bulk_create(invoice_details)
+            add_search_documents(search_documents(invoices, invoice_details))
+            rollups.save()
+        return invoices
+
 class InvoiceSerializer(serializers.ModelSerializer):
     id = serializers.CharField(read_only=True)
-    invoice_details = InvoiceDetailSerializer(many=True)
+    invoice_details = InvoiceLineSerializer(many=True)
     invoice_date = serializers.DateField(required=False)
     
     class Meta:
@@ -56,32 +259,118 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'id',
             'customer_name', 
             'invoice_date', 
+            'total_amount',
+            'line_count',
             'invoice_details'
             ]
+        read_only_fields = ['total_amount', 'line_count']
+        list_serializer_class = InvoiceListSerializer
+        # duplicates are caught by the unique (customer name, invoice date) index instead of extra queries
+        validators = []
         
     def create(self, validated_data):
         invoice_details_data = validated_data.pop('invoice_details')
         if not validated_data.get('invoice_date'):
             validated_data['invoice_date'] = timezone.now().strftime('%Y-%m-%d')
-        invoice = Invoice.objects.create(**validated_data)
-        for invoice_detail_data in invoice_details_data:
-            InvoiceDetail.objects.create(invoice=invoice, **invoice_detail_data)
-        return invoice
+        def save():
+            invoice = Invoice.objects.create(**validated_data, **get_totals(invoice_details_data))
+            invoice_details = InvoiceDetail.objects.bulk_create(
+                new_invoice_detail(invoice, invoice_detail_data) for invoice_detail_data in invoice_details_data
+            )
+            add_search_documents(search_documents([invoice], invoice_details))
+            rollups = RollupChanges()
+            rollups.add(invoice.customer_name, invoice.invoice_date, invoice_details)
+            rollups.save()
+            return invoice
+
+        return self.save_or_report_duplicate(save, validated_data['customer_name'], validated_data['invoice_date'])
     
     def update(self, instance, validated_data):
+        # the details are moved in the report rollups when the customer or the month of the invoice changes
+        previous = (instance.customer_name, instance.invoice_date)
         instance.customer_name = validated_data.get('customer_name', instance.customer_name)
         invoice_date = validated_data.get('invoice_date', instance.invoice_date)
         instance.invoice_date = invoice_date.strftime('%Y-%m-%d')
-        instance.save()
-        
         invoice_details_data = validated_data.get('invoice_details', [])
+        # the totals are only written when the details are replaced, so concurrent detail writes are not overwritten
+        update_fields = ['customer_name', 'invoice_date', 'updated_at']
         if invoice_details_data:
-            InvoiceDetail.objects.filter(invoice=instance).delete()
-            for detail_data in invoice_details_data:
-                InvoiceDetail.objects.create(invoice=instance, **detail_data)
+            for field, value in get_totals(invoice_details_data).items():
+                setattr(instance, field, value)
+                update_fields.append(field)
 
-        return instance
+        # set by the view when the client sent If-Match, the invoice must still be the version the client has seen
+        expected_updated_at = self.context.get('expected_updated_at')
+
+        def save():
+            # the conditional update takes the write lock first, so nothing can change the invoice between the check and the write
+            if expected_updated_at is not None and not Invoice.objects.filter(
+                id=instance.id, updated_at=expected_updated_at
+            ).update(updated_at=F('updated_at')):
+                raise PreconditionFailed()
+            instance.save(update_fields=update_fields)
+            
+            rollups = RollupChanges()
+            if invoice_details_data:
+                invoice_details = self.replace_invoice_details(instance, invoice_details_data, rollups, previous)
+                replace_search_documents(search_documents([instance], invoice_details))
+            else:
+                if (instance.customer_name, month_of(instance.invoice_date)) != (previous[0], month_of(previous[1])):
+                    invoice_details = invoice_details_of([instance.id])[instance.id]
+                    rollups.remove(*previous, invoice_details)
+                    rollups.add(instance.customer_name, instance.invoice_date, invoice_details)
+                index_invoices([instance.id])
+            rollups.save()
+            return instance
+
+        return self.save_or_report_duplicate(save, instance.customer_name, instance.invoice_date)
     
+    def replace_invoice_details(self, instance, invoice_details_data, rollups: RollupChanges, previous: tuple) -> list:
+        """
+        Replaces the details of an invoice by writing only the differences: the existing details matched by
+        `match_invoice_details` are updated when one of their values changed, the other details sent are created
+        and the existing details left out are deleted. The matched details keep their id and creation date.
+        Runs at most one update, one insert and one delete, whatever the number of details.
+
+        Args:
+            instance (Invoice): The invoice.
+            invoice_details_data (list): The validated details that replace those of the invoice.
+            rollups (RollupChanges): Collects the changes of the report rollups, the previous details are subtracted
+                                     and the new ones added, the unchanged ones cancel out.
+            previous (tuple): The customer name and invoice date of the invoice before the update.
+
+        Returns:
+            list: The details of the invoice after the update.
+        """
+        invoice_details = list(InvoiceDetail.objects.filter(invoice=instance))
+        rollups.remove(*previous, invoice_details)
+        pairs, created_data, deleted = match_invoice_details(invoice_details, invoice_details_data)
+        now = timezone.now()
+        changed = []
+        for invoice_detail, invoice_detail_data in pairs:
+            values = {
+                'description': invoice_detail_data['description'],
+                'quantity': invoice_detail_data['quantity'],
+                'unit_price': to_amount(invoice_detail_data['unit_price']),
+                'price': to_amount(invoice_detail_data['price'])
+            }
+            if any(getattr(invoice_detail, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(invoice_detail, field, value)
+                invoice_detail.updated_at = now
+                changed.append(invoice_detail)
+
+        if deleted:
+            InvoiceDetail.objects.filter(id__in=[invoice_detail.id for invoice_detail in deleted]).delete()
+        if changed:
+            InvoiceDetail.objects.bulk_update(changed, [*DETAIL_FIELDS[1:], 'updated_at'])
+        created = InvoiceDetail.objects.bulk_create(
+            new_invoice_detail(instance, invoice_detail_data) for invoice_detail_data in created_data
+        ) if created_data else []
+        invoice_details = [invoice_detail for invoice_detail, _ in pairs] + created
+        rollups.add(instance.customer_name, instance.invoice_date, invoice_details)
+        return invoice_details
+
     def validate(self, data):
         request = self.context.get('request')
         if not request.method == 'PATCH':
@@ -92,14 +381,149 @@ class InvoiceSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("request body cannot be empty")
             if 'invoice_details' in data:
                 raise serializers.ValidationError("invoice details cannot be updated using this endpoint")
-            
-        customer_name = data.get('customer_name')
-        invoice_date = data.get('invoice_date', timezone.now().strftime('%Y-%m-%d'))
-        if Invoice.objects.filter(customer_name=customer_name, invoice_date=invoice_date).exists():
-            raise serializers.ValidationError({
-                "duplicate_value_error": "invoice already exists for the customer on the same date",
-                "additional_message": "use the invoice-detail-create endpoint to add more details to the existing invoice",
-                "invoice_id": Invoice.objects.get(customer_name=customer_name, invoice_date=invoice_date).id
-            })
-        
-        return data
\ No newline at end of file
+        return data
+
+    def save_or_report_duplicate(self, save, customer_name, invoice_date):
+        """
+        Runs a write of the invoice, turning a violation of the unique (customer name, invoice date) index
+        into the same validation error that is returned for every duplicate invoice.
+        The clashing invoice is only looked up when the write actually fails.
+
+        Args:
+            save (callable): The write to run.
+            customer_name (str): The customer name of the invoice being written.
+            invoice_date (date | str): The invoice date of the invoice being written.
+
+        Raises:
+            serializers.ValidationError: If another invoice exists for the customer on the same date.
+        """
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            existing = Invoice.objects.filter(customer_name=customer_name, invoice_date=invoice_date)
+            if self.instance is not None:
+                existing = existing.exclude(id=self.instance.id)
+            invoice_id = existing.values_list('id', flat=True).first()
+            if invoice_id is None:
+                raise
+            raise serializers.ValidationError(duplicate_invoice_error(invoice_id))
+
+class InvoiceDetailRepriceSerializer(serializers.Serializer):
+    """
+    The body of a bulk repricing of invoice details: the filters selecting the details,
+    and either their new unit price or a percentage change of their current one.
+    """
+    description = serializers.CharField(required=False, max_length=100)
+    customer_name = serializers.CharField(required=False, max_length=100)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    unit_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2, min_value=0)
+    percent = serializers.DecimalField(required=False, max_digits=5, decimal_places=2, min_value=-100)
+    max_rows = serializers.IntegerField(required=False, min_value=1)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if not any(field in data for field in ('description', 'customer_name', 'date_from', 'date_to')):
+            raise serializers.ValidationError("at least one of description, customer_name, date_from and date_to is required")
+        if ('unit_price' in data) == ('percent' in data):
+            raise serializers.ValidationError("either unit_price or percent is required")
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from cannot be after date_to")
+        return data
+
+class InvoiceBulkDeleteSerializer(serializers.Serializer):
+    """
+    The body of a bulk deletion of invoices: the filters selecting the invoices, at least one of them.
+    """
+    customer_name = serializers.CharField(required=False, max_length=100)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if not any(field in data for field in ('customer_name', 'date_from', 'date_to')):
+            raise serializers.ValidationError("at least one of customer_name, date_from and date_to is required")
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from cannot be after date_to")
+        return data
+
+def invoice_representation(invoice: dict, details: list) -> dict:
+    """
+    Returns the representation of an invoice fetched with `values(*INVOICE_FIELDS)` along with its details
+    fetched with `values(*DETAIL_FIELDS)`, as plain dictionaries.
+    It is the same as the data of `InvoiceSerializer` and renders to the same JSON, without building model instances
+    or going through the serializer fields: the amounts are already rounded to two decimal places by the database
+    converters, so `str` formats them as `DecimalField` does, and `price` is a `FloatField` of the detail serializer.
+    """
+    return {
+        'id': invoice['id'],
+        'customer_name': invoice['customer_name'],
+        'invoice_date': invoice['invoice_date'].isoformat(),
+        'total_amount': str(invoice['total_amount']),
+        'line_count': invoice['line_count'],
+        'invoice_details': [detail_representation(detail) for detail in details]
+    }
+
+def detail_representation(detail: dict) -> dict:
+    """
+    Returns the representation of an invoice detail fetched with `values(*DETAIL_FIELDS)`, as `InvoiceDetailSerializer` does.
+    """
+    return {
+        'id': detail['id'],
+        'description': detail['description'],
+        'quantity': detail['quantity'],
+        'unit_price': str(detail['unit_price']),
+        'price': float(detail['price'])
+    }
+
+def invoice_detail_rows(invoice_ids):
+    """
+    Returns the query of the details of the given invoices as `values()` dictionaries,
+    in the order of the `invoice_details` relation so the representations list them as the serializer does.
+    """
+    return InvoiceDetail.objects.filter(invoice_id__in=invoice_ids).values('invoice_id', *DETAIL_FIELDS)
+
+# how the sparse representations format each invoice field of the `values()` rows, as the serializer fields do
+INVOICE_FIELD_FORMATS = {
+    'id': None,
+    'customer_name': None,
+    'invoice_date': date.isoformat,
+    'total_amount': str,
+    'line_count': None,
+}
+
+def sparse_invoice_representation(invoice: dict, fields: tuple, details: list = None) -> dict:
+    """
+    Returns the representation of an invoice restricted to some of its fields, with its details only if they are given.
+    The fields keep the order of the full representation.
+    """
+    representation = {}
+    for field in fields:
+        format_value = INVOICE_FIELD_FORMATS[field]
+        representation[field] = invoice[field] if format_value is None else format_value(invoice[field])
+    if details is not None:
+        representation['invoice_details'] = [detail_representation(detail) for detail in details]
+    return representation
+
+def represent_invoices(invoices: list, details, fields: tuple = INVOICE_FIELDS, include_details: bool = True) -> list:
+    """
+    Read-only fast path of `InvoiceSerializer(invoices, many=True).data`, used by the invoice list and single invoice endpoints.
+
+    Args:
+        invoices (list): The invoices as dictionaries of at least the requested fields.
+        details (iterable): The rows of `invoice_detail_rows` for these invoices, unused without `include_details`.
+        fields (tuple, optional): The invoice fields to represent. Defaults to all of them.
+        include_details (bool, optional): Whether to represent the details of the invoices. Defaults to True.
+
+    Returns:
+        list: The representations of the invoices, in the same order.
+    """
+    if not include_details:
+        return [sparse_invoice_representation(invoice, fields) for invoice in invoices]
+    invoice_details = {invoice['id']: [] for invoice in invoices}
+    for detail in details:
+        invoice_details[detail['invoice_id']].append(detail)
+    if fields != INVOICE_FIELDS:
+        return [sparse_invoice_representation(invoice, fields, invoice_details[invoice['id']]) for invoice in invoices]
+    return [invoice_representation(invoice, invoice_details[invoice['id']]) for invoice in invoices]
@@ -1,8 +1,47 @@
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
-from django.urls import reverse
+from rest_framework.response import Response
+from rest_framework.request import Request
+from rest_framework.renderers import JSONRenderer
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ParseError
+from django.urls import include, path, resolve, reverse
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from .models import Invoice, InvoiceDetail
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+import csv
+import json
+from io import BytesIO, StringIO
+from unittest import mock
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+
+from .models import CustomerMonthRollup, Invoice, InvoiceDetail, ItemMonthRollup
+from .cache import InvoiceListCache, invoice_list_cache
+from .search import document_rowid, index_invoices
+from .reports import rebuild_rollups
+from .purge import cascades_invoice_details, invoices_to_purge, purge_invoices
+from .importer import InvoiceImporter
+from .serializer import INVOICE_FIELDS, InvoiceSerializer, invoice_detail_rows, represent_invoices
+from .utils import PreconditionFailed
+from .benchmark import copy_database, find_regressions, load_data_generator, run_json_comparison, run_scenarios, run_serializer_comparison
+from .middleware import QueryInstrumentationMiddleware, QueryRecorder
+from .metrics import MetricsRegistry, metrics_registry
+from .database import WriteCoalescer, retries_when_locked, sqlite_pragmas, write_coalescer
+from .renderers import FastJSONParser, FastJSONRenderer
+from . import renderers
+from .async_views import AsyncInvoiceAPIView
+from .urls import invoice_urlpatterns
 
 class InvoiceAPITest(APITestCase):
     """
@@ -305,6 +344,87 @@ class InvoiceUpdateTests(InvoiceAPITest):
             
             self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+class InvoiceDetailsReplaceTests(InvoiceAPITest):
+    """
+    Test cases for replacing the details of an invoice with a PUT, which only writes the details that changed.
+    """
+    def create_invoice(self) -> tuple:
+        response = self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        invoice = Invoice.objects.get(id=response.data['data']['id'])
+        details = {detail.description: detail for detail in invoice.invoice_details.all()}
+        return invoice, details
+
+    def put_details(self, invoice, invoice_details):
+        return self.client.put(
+            reverse('invoice-update', args=[invoice.id]),
+            {'customer_name': invoice.customer_name, 'invoice_date': invoice.invoice_date, 'invoice_details': invoice_details}
+        )
+
+    def test_replace_details_by_id_and_description(self):
+        """
+        Test that the details are matched by id or description, and that only the changed ones are updated.
+        """
+        invoice, details = self.create_invoice()
+        response = self.put_details(invoice, [
+            {'description': 'Product 1', 'quantity': 10, 'unit_price': 100},
+            {'id': details['Product 3'].id, 'description': 'Product 3b', 'quantity': 3, 'unit_price': 200},
+            {'description': 'Product 4', 'quantity': 1, 'unit_price': 5},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        after = {detail.description: detail for detail in invoice.invoice_details.all()}
+        self.assertEqual(set(after), {'Product 1', 'Product 3b', 'Product 4'})
+        self.assertEqual(after['Product 1'].id, details['Product 1'].id)
+        self.assertEqual(after['Product 1'].updated_at, details['Product 1'].updated_at)
+        self.assertEqual(after['Product 3b'].id, details['Product 3'].id)
+        self.assertEqual(after['Product 3b'].created_at, details['Product 3'].created_at)
+        self.assertEqual(after['Product 3b'].price, Decimal('600.00'))
+        self.assertNotIn(after['Product 4'].id, [detail.id for detail in details.values()])
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.total_amount, invoice.line_count), (Decimal('1605.00'), 3))
+        self.assertEqual(len(response.data['data']['invoice_details']), 3)
+
+    def test_replace_details_removes_missing(self):
+        """
+        Test that the details left out of the request are deleted.
+        """
+        invoice, details = self.create_invoice()
+        response = self.put_details(invoice, [{'description': 'Product 3', 'quantity': 2, 'unit_price': 200}])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(invoice.invoice_details.values_list('id', flat=True)), [details['Product 3'].id])
+        index_invoices([invoice.id])
+        self.assertEqual(self.client.get(reverse('invoice-list') + "?search=Product 1").data['results']['data'], [])
+
+    def test_replace_details_unchanged_writes_nothing(self):
+        """
+        Test that resending the same details does not write any of them.
+        """
+        invoice, _ = self.create_invoice()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put_details(invoice, self.invoice_valid_data_list[0]['invoice_details'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        detail_writes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT INTO "invoice_detail"', 'UPDATE "invoice_detail"', 'DELETE FROM "invoice_detail"'))
+        ]
+        self.assertEqual(detail_writes, [])
+
+    def test_replace_details_failure__foreign_id(self):
+        """
+        Test failed invoice updation because of the id of a detail of another invoice, which leaves the invoice untouched.
+        """
+        invoice, details = self.create_invoice()
+        response = self.put_details(invoice, [
+            {'id': str(self.invoice_detail.id), 'description': 'Product 1', 'quantity': 1, 'unit_price': 1},
+        ])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(str(self.invoice_detail.id), response.data['data']['invoice_details'][0])
+        self.assertEqual(set(invoice.invoice_details.values_list('id', flat=True)), {detail.id for detail in details.values()})
+        self.assertEqual(InvoiceDetail.objects.get(id=self.invoice_detail.id).invoice_id, str(self.invoice.id))
+
 class InvoicePartialUpdateTests(InvoiceAPITest):
     """
     Test cases for partial update of invoices using Django REST framework.
@@ -620,6 +740,8 @@ class InvoicePaginationTests(APITestCase):
         Invoice.objects.bulk_create(
             [Invoice(customer_name=f"Customer {i}", invoice_date=f"2023-02-{23-i}") for i in range(1, 16)]
         )
+        # bulk inserts do not send the signals that clear the list cache
+        invoice_list_cache.invalidate()
 
     def test_pagination(self):
         response = self.client.get(reverse('invoice-list'))
@@ -644,6 +766,7 @@ class InvoicePaginationSearchTests(APITestCase):
         InvoiceDetail.objects.create(
             invoice=Invoice.objects.get(customer_name="Alice"), description="Laptop", quantity=1, unit_price=1000, price=1000
         )
+        index_invoices(Invoice.objects.values_list('id', flat=True))
 
     def test_search_by_customer_name(self):
         response = self.client.get(reverse('invoice-list') + "?search=Alice")
@@ -664,6 +787,68 @@ class InvoicePaginationSearchTests(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data["results"].get("data")), 0)
 
+    def test_search_by_word_prefix(self):
+        response = self.client.get(reverse('invoice-list') + "?search=lap")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d["customer_name"] for d in response.data["results"]["data"]], ["Alice"])
+
+    def test_search_sort_by_relevance(self):
+        invoice = Invoice.objects.get(customer_name="Bob")
+        InvoiceDetail.objects.create(invoice=invoice, description="Laptop laptop bag", quantity=1, unit_price=10, price=10)
+        InvoiceDetail.objects.create(invoice=invoice, description="Laptop stand", quantity=1, unit_price=10, price=10)
+        index_invoices([invoice.id])
+
+        response = self.client.get(reverse('invoice-list') + "?search=laptop&sort=relevance")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d["customer_name"] for d in response.data["results"]["data"]], ["Bob", "Alice"])
+
+class InvoiceSearchIndexTests(InvoiceAPITest):
+    """
+    Test cases for keeping the full-text search index in sync with the invoices.
+    """
+
+    def search(self, query):
+        response = self.client.get(reverse('invoice-list') + f"?search={query}")
+        return [d["id"] for d in response.data["results"]["data"]]
+
+    def test_search_index_create_and_update_invoice(self):
+        response = self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        invoice_id = response.data["data"]["id"]
+        self.assertEqual(self.search("product"), [invoice_id])
+
+        self.client.put(
+            reverse('invoice-update', kwargs={'invoice_id': invoice_id}),
+            self.invoice_valid_data_list[1]
+        )
+        self.assertEqual(self.search("john"), [])
+        self.assertEqual(self.search("jane product"), [invoice_id])
+
+    def test_search_index_invoice_details(self):
+        invoice_id = str(self.invoice.id)
+        self.client.post(
+            reverse('invoice-detail-create', kwargs={'invoice_id': invoice_id}),
+            {'description': 'Gadget', 'quantity': 1, 'unit_price': 5}
+        )
+        self.assertEqual(self.search("gadget"), [invoice_id])
+
+        self.client.patch(
+            reverse('invoice-detail-partial-update', kwargs={'invoice_detail_id': self.invoice_detail.id}),
+            {'description': 'Widget'}
+        )
+        self.assertEqual(self.search("widget"), [invoice_id])
+
+        self.client.delete(reverse('invoice-detail-delete', kwargs={'invoice_detail_id': self.invoice_detail.id}))
+        self.assertEqual(self.search("widget"), [])
+
+        self.client.delete(reverse('invoice-delete', kwargs={'invoice_id': invoice_id}))
+        self.assertEqual(self.search("gadget"), [])
+
+    def test_rebuild_search_index(self):
+        self.assertEqual(self.search("customer"), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search("customer"), [str(self.invoice.id)])
+
 class InvoicePaginationSortTests(APITestCase):
 
     def setUp(self):
@@ -675,6 +860,7 @@ class InvoicePaginationSortTests(APITestCase):
         ]
         for index, invoice in enumerate(invoices, start=1):
             InvoiceDetail.objects.create(invoice=invoice, quantity=index, unit_price=index*10, price=index*10*index) 
+        Invoice.objects.recompute_totals()
 
     def test_sort_by_customer_name_asc(self):
         response = self.client.get(reverse('invoice-list') + "?sort=customer")
@@ -732,10 +918,1769 @@ class InvoicePaginationSortTests(APITestCase):
             [10, 40, 90, 160],
         )
     
+    def test_sort_by_invoice_detail_fields__one_row_per_invoice(self):
+        invoice = Invoice.objects.get(customer_name="Customer 1")
+        for index in range(3):
+            InvoiceDetail.objects.create(invoice=invoice, description=f"Extra {index}", quantity=2, unit_price=5, price=10)
+        Invoice.objects.recompute_totals()
+
+        for sort in ("price", "-quantity", "unit_price", "description"):
+            response = self.client.get(reverse('invoice-list') + f"?sort={sort}")
+            self.assertEqual(response.data["count"], 4)
+            self.assertEqual(len({d["id"] for d in response.data["results"]["data"]}), 4)
+
+        response = self.client.get(reverse('invoice-list') + "?sort=-quantity")
+        self.assertEqual(response.data["results"]["data"][0]["customer_name"], "Customer 1")
+
     def test_sort_by_invoice_detail_price_desc(self):
         response = self.client.get(reverse('invoice-list') + "?sort=-price")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(
             [d["invoice_details"][0]["price"] for d in response.data["results"]["data"]],
             [160, 90, 40, 10],
-        )
\ No newline at end of file
+        )
+class InvoiceBulkCreateTests(InvoiceAPITest):
+    """
+    Test cases for creating many invoices in a single request.
+    """
+
+    def test_bulk_create_invoices_success(self):
+        """
+        Test successful creation of many invoices and their details.
+        """
+        response = self.client.post(
+            reverse('invoice-bulk-create'), 
+            self.invoice_valid_data_list, 
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['created'], 2)
+        self.assertEqual(Invoice.objects.count(), 3)
+        self.assertEqual(InvoiceDetail.objects.count(), 4)
+        for result in response.data['data']['results']:
+            self.assertFalse(result['error'])
+            self.assertTrue(Invoice.objects.filter(id=result['id']).exists())
+
+    def test_bulk_create_invoices_partial_success(self):
+        """
+        Test that invalid invoices are reported per item without stopping the valid ones.
+        """
+        response = self.client.post(
+            reverse('invoice-bulk-create'), 
+            [self.invoice_valid_data_list[0], self.invoice_invalid_data_list[0], self.invoice_valid_data_list[0]], 
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['created'], 1)
+        self.assertEqual(response.data['data']['failed'], 2)
+        self.assertEqual(
+            [result['error'] for result in response.data['data']['results']],
+            [False, True, True]
+        )
+        self.assertIn('duplicate_value_error', response.data['data']['results'][2]['errors'])
+        self.assertEqual(Invoice.objects.count(), 2)
+
+    def test_bulk_create_invoices_failure__existing_invoice(self):
+        """
+        Test failed bulk creation because the invoice already exists for the customer on the same date.
+        """
+        response = self.client.post(
+            reverse('invoice-bulk-create'), 
+            [{
+                'customer_name': self.invoice.customer_name,
+                'invoice_date': self.invoice.invoice_date,
+                'invoice_details': self.invoice_valid_data_list[0]['invoice_details']
+            }], 
+            )
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data['data']['results'][0]['errors']['invoice_id'][0],
+            str(self.invoice.id)
+        )
+
+    def test_bulk_create_invoices_failure__empty(self):
+        """
+        Test failed bulk creation because of an empty or invalid request body.
+        """
+        for invalid_body in ([], {}):
+            response = self.client.post(
+                reverse('invoice-bulk-create'), 
+                invalid_body, 
+                )
+            
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class InvoiceCursorPaginationTests(APITestCase):
+    """
+    Test cases for cursor based pagination of invoices.
+    """
+
+    def setUp(self):
+        # pairs of invoices share a date so that the invoice id has to break the ties
+        Invoice.objects.bulk_create(
+            [Invoice(customer_name=f"Customer {i:02}", invoice_date=f"2023-02-{1 + i // 2:02}") for i in range(25)]
+        )
+        # bulk inserts do not send the signals that clear the list cache
+        invoice_list_cache.invalidate()
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            pages.append(response.data)
+            url = response.data["next"]
+        return pages
+
+    def test_cursor_pagination(self):
+        pages = self.walk(reverse('invoice-list') + "?pagination=cursor")
+        invoices = [invoice for page in pages for invoice in page["results"]["data"]]
+
+        self.assertEqual([len(page["results"]["data"]) for page in pages], [10, 10, 5])
+        self.assertEqual(pages[0]["previous"], None)
+        self.assertEqual(len({invoice["id"] for invoice in invoices}), 25)
+        self.assertEqual(
+            [invoice["invoice_date"] for invoice in invoices],
+            sorted((invoice["invoice_date"] for invoice in invoices), reverse=True)
+        )
+
+    def test_cursor_pagination_previous(self):
+        pages = self.walk(reverse('invoice-list') + "?pagination=cursor")
+
+        response = self.client.get(pages[2]["previous"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"]["data"], pages[1]["results"]["data"])
+
+        response = self.client.get(response.data["previous"])
+        self.assertEqual(response.data["results"]["data"], pages[0]["results"]["data"])
+        self.assertEqual(response.data["previous"], None)
+
+    def test_cursor_pagination_sort_by_customer_name(self):
+        pages = self.walk(reverse('invoice-list') + "?pagination=cursor&sort=-customer")
+        self.assertEqual(
+            [invoice["customer_name"] for page in pages for invoice in page["results"]["data"]],
+            [f"Customer {i:02}" for i in reversed(range(25))]
+        )
+
+    def test_cursor_pagination_failure__invalid_cursor(self):
+        response = self.client.get(reverse('invoice-list') + "?cursor=invalid")
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination_failure__relevance_sort(self):
+        response = self.client.get(reverse('invoice-list') + "?pagination=cursor&search=customer&sort=relevance")
+        self.assertEqual(response.status_code, 400)
+
+class InvoiceTotalsTests(InvoiceAPITest):
+    """
+    Test cases for the total amount and line count stored on each invoice.
+    """
+
+    def setUp(self):
+        super().setUp()
+        Invoice.objects.all().delete()
+        response = self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.invoice = Invoice.objects.get(id=response.data['data']['id'])
+
+    def assertTotals(self, total_amount, line_count):
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total_amount, Decimal(total_amount))
+        self.assertEqual(self.invoice.line_count, line_count)
+
+    def test_totals_create_and_update_invoice(self):
+        self.assertTotals('1400', 2)
+
+        response = self.client.put(
+            reverse('invoice-update', kwargs={'invoice_id': self.invoice.id}),
+            self.invoice_valid_data_list[1]
+        )
+        self.assertEqual(response.data['data']['total_amount'], '250.00')
+        self.assertEqual(response.data['data']['line_count'], 1)
+        self.assertTotals('250', 1)
+
+    def test_totals_invoice_details(self):
+        response = self.client.post(
+            reverse('invoice-detail-create', kwargs={'invoice_id': self.invoice.id}),
+            {'description': 'Product 4', 'quantity': 3, 'unit_price': 0.1}
+        )
+        self.assertTotals('1400.30', 3)
+
+        self.client.patch(
+            reverse('invoice-detail-partial-update', kwargs={'invoice_detail_id': response.data['data']['id']}),
+            {'quantity': 10}
+        )
+        self.assertTotals('1401', 3)
+
+        self.client.delete(reverse('invoice-detail-delete', kwargs={'invoice_detail_id': response.data['data']['id']}))
+        self.assertTotals('1400', 2)
+
+    def test_aggregates_invoice_details(self):
+        response = self.client.post(
+            reverse('invoice-detail-create', kwargs={'invoice_id': self.invoice.id}),
+            {'description': 'A Product', 'quantity': 1, 'unit_price': 2000}
+        )
+        self.invoice.refresh_from_db()
+        self.assertEqual(
+            (self.invoice.total_quantity, self.invoice.max_price, self.invoice.max_unit_price, self.invoice.first_description),
+            (13, Decimal('2000'), Decimal('2000'), 'A Product')
+        )
+
+        self.client.delete(reverse('invoice-detail-delete', kwargs={'invoice_detail_id': response.data['data']['id']}))
+        self.invoice.refresh_from_db()
+        self.assertEqual(
+            (self.invoice.total_quantity, self.invoice.max_price, self.invoice.max_unit_price, self.invoice.first_description),
+            (12, Decimal('1000'), Decimal('200'), 'Product 1')
+        )
+
+    def test_totals_bulk_create(self):
+        response = self.client.post(reverse('invoice-bulk-create'), [self.invoice_valid_data_list[1]])
+        invoice = Invoice.objects.get(id=response.data['data']['results'][0]['id'])
+        self.assertEqual(invoice.total_amount, Decimal('250'))
+        self.assertEqual(invoice.line_count, 1)
+
+    def test_sort_and_filter_by_total(self):
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[1])
+
+        response = self.client.get(reverse('invoice-list') + "?sort=total")
+        self.assertEqual([d['total_amount'] for d in response.data['results']['data']], ['250.00', '1400.00'])
+
+        response = self.client.get(reverse('invoice-list') + "?min_total=300")
+        self.assertEqual([d['total_amount'] for d in response.data['results']['data']], ['1400.00'])
+
+        response = self.client.get(reverse('invoice-list') + "?max_total=300&pagination=cursor&sort=-total")
+        self.assertEqual([d['total_amount'] for d in response.data['results']['data']], ['250.00'])
+
+        response = self.client.get(reverse('invoice-list') + "?min_total=abc")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_check_invoice_totals(self):
+        Invoice.objects.filter(id=self.invoice.id).update(total_amount=0, line_count=0, max_price=0, first_description='')
+
+        output = StringIO()
+        call_command('check_invoice_totals', stdout=output)
+        self.assertIn('1 invoices have wrong totals', output.getvalue())
+        self.assertTotals('0', 0)
+
+        call_command('check_invoice_totals', '--repair', stdout=output)
+        self.assertTotals('1400', 2)
+
+        output = StringIO()
+        call_command('check_invoice_totals', stdout=output)
+        self.assertIn('All invoice totals are correct', output.getvalue())
+
+class InvoiceDuplicateTests(InvoiceAPITest):
+    """
+    Test cases for the unique invoice per customer and date.
+    """
+
+    def assertDuplicate(self, response, invoice_id):
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data['data']['duplicate_value_error'],
+            ["invoice already exists for the customer on the same date"]
+        )
+        self.assertEqual(response.data['data']['invoice_id'], [str(invoice_id)])
+
+    def test_create_invoice_failure__duplicate(self):
+        """
+        Test failed invoice creation because an invoice already exists for the customer on the same date.
+        """
+        response = self.client.post(reverse('invoice-create'), {
+            'customer_name': self.invoice.customer_name,
+            'invoice_date': self.invoice.invoice_date,
+            'invoice_details': self.invoice_valid_data_list[0]['invoice_details']
+        })
+
+        self.assertDuplicate(response, self.invoice.id)
+        self.assertEqual(Invoice.objects.count(), 1)
+        self.assertEqual(InvoiceDetail.objects.count(), 1)
+
+    def test_create_invoice_success__no_duplicate_lookup(self):
+        """
+        Test that a successful invoice creation does not look for duplicates before inserting.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([query for query in queries if '"invoice"."customer_name" =' in query['sql']])
+
+    def test_update_invoice_success__same_customer_and_date(self):
+        """
+        Test successful invoice updation keeping its own customer name and invoice date.
+        """
+        response = self.client.put(
+            reverse('invoice-update', kwargs={'invoice_id': self.invoice.id}),
+            {
+                'customer_name': self.invoice.customer_name,
+                'invoice_date': self.invoice.invoice_date,
+                'invoice_details': self.invoice_valid_data_list[1]['invoice_details']
+            }
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_invoice_failure__duplicate(self):
+        """
+        Test failed invoice updation and partial updation because another invoice exists for the customer on the same date.
+        """
+        other = Invoice.objects.create(customer_name='Other Customer', invoice_date='2000-03-11')
+
+        response = self.client.patch(
+            reverse('invoice-partial-update', kwargs={'invoice_id': other.id}),
+            {'customer_name': self.invoice.customer_name}
+        )
+        self.assertDuplicate(response, self.invoice.id)
+
+        response = self.client.put(
+            reverse('invoice-update', kwargs={'invoice_id': other.id}),
+            {
+                'customer_name': self.invoice.customer_name,
+                'invoice_details': self.invoice_valid_data_list[1]['invoice_details']
+            }
+        )
+        self.assertDuplicate(response, self.invoice.id)
+        other.refresh_from_db()
+        self.assertEqual(other.customer_name, 'Other Customer')
+
+class InvoiceConditionalRequestTests(InvoiceAPITest):
+    """
+    Test cases for the ETag and Last-Modified validators of the invoice endpoints.
+    """
+
+    def test_get_invoice_not_modified(self):
+        """
+        Test that retrieving an unchanged invoice with its ETag returns an empty 304 without fetching its details.
+        """
+        url = reverse('single-invoice', kwargs={'invoice_id': self.invoice.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(len(queries), 1)
+
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_get_invoice_modified__detail_write(self):
+        """
+        Test that writing an invoice detail changes the ETag of its invoice.
+        """
+        url = reverse('single-invoice', kwargs={'invoice_id': self.invoice.id})
+        etag = self.client.get(url)['ETag']
+
+        self.client.patch(
+            reverse('invoice-detail-partial-update', kwargs={'invoice_detail_id': self.invoice_detail.id}),
+            {'quantity': 3}
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_invoices_not_modified(self):
+        """
+        Test that an unchanged page of invoices returns 304, and that creating or deleting an invoice changes its ETag.
+        """
+        url = reverse('invoice-list')
+        etag = self.client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([query for query in queries if 'invoice_detail' in query['sql']])
+
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        self.client.delete(reverse('invoice-delete', kwargs={'invoice_id': self.invoice.id}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_partial_update_invoice_if_match(self):
+        """
+        Test that a partial updation with a stale ETag is refused and one with the current ETag succeeds.
+        """
+        url = reverse('invoice-partial-update', kwargs={'invoice_id': self.invoice.id})
+        etag = self.client.get(reverse('single-invoice', kwargs={'invoice_id': self.invoice.id}))['ETag']
+
+        response = self.client.patch(url, {'customer_name': 'First Writer'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.patch(url, {'customer_name': 'Second Writer'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.customer_name, 'First Writer')
+
+    def test_update_invoice_if_match__concurrent_write(self):
+        """
+        Test that the version checked by If-Match is checked again when the invoice is written.
+        """
+        stale = Invoice.objects.get(id=self.invoice.id)
+        Invoice.objects.filter(id=self.invoice.id).add_line(Decimal('1.00'), 1, Decimal('1.00'), 'Concurrent')
+
+        serializer = InvoiceSerializer(
+            stale,
+            data={'customer_name': 'Late Writer'},
+            partial=True,
+            context={'request': APIRequestFactory().patch('/'), 'expected_updated_at': stale.updated_at}
+        )
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(PreconditionFailed):
+            serializer.save()
+        self.assertNotEqual(Invoice.objects.get(id=self.invoice.id).customer_name, 'Late Writer')
+
+class SparseFieldsetTests(InvoiceAPITest):
+    """
+    Test cases for the fields and include query parameters of the invoice list and single invoice endpoints.
+    """
+    def setUp(self):
+        super().setUp()
+        invoice_list_cache.invalidate()
+
+    def test_list_fields(self):
+        """
+        Test that the list returns only the requested fields, selects only them and skips the query of the details.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('invoice-list') + "?fields=customer_name,invoice_date")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results']['data'], [{'customer_name': 'New Customer', 'invoice_date': '2000-03-11'}])
+        self.assertFalse([query['sql'] for query in queries if 'FROM "invoice_detail"' in query['sql']])
+        self.assertFalse([query['sql'] for query in queries if '"invoice"."total_amount"' in query['sql']])
+
+    def test_list_include_details(self):
+        """
+        Test that include=details adds the details to the requested fields, with cursor pages as well.
+        """
+        for params in ("?fields=id&include=details", "?fields=id,invoice_details&pagination=cursor"):
+            response = self.client.get(reverse('invoice-list') + params)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            invoice = response.data['results']['data'][0]
+            self.assertEqual(list(invoice), ['id', 'invoice_details'])
+            self.assertEqual(invoice['invoice_details'][0]['description'], 'New Product')
+
+        response = self.client.get(reverse('invoice-list') + "?include=")
+        self.assertEqual(list(response.data['results']['data'][0]), list(INVOICE_FIELDS))
+
+    def test_single_invoice_fields(self):
+        """
+        Test that a sparse single invoice has an ETag of its own, which is honoured by If-None-Match.
+        """
+        url = reverse('single-invoice', args=[self.invoice.id])
+        full = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url + "?fields=total_amount")
+
+        self.assertEqual(response.data['data'], {'total_amount': '0.00'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotEqual(response['ETag'], full['ETag'])
+        self.assertEqual(self.client.get(url + "?fields=total_amount", HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.client.get(url + "?include=details")['ETag'], full['ETag'])
+
+    def test_unknown_fields(self):
+        """
+        Test that unknown fields and included parts are refused.
+        """
+        for url in (reverse('invoice-list'), reverse('single-invoice', args=[self.invoice.id])):
+            self.assertEqual(self.client.get(url + "?fields=customer_name,secret").status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(self.client.get(url + "?include=payments").status_code, status.HTTP_400_BAD_REQUEST)
+
+class InvoiceListCacheTests(InvoiceAPITest):
+    """
+    Test cases for the invoice list response cache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        invoice_list_cache.invalidate()
+
+    def test_list_invoices_cache_hit(self):
+        """
+        Test that a repeated list request, with its parameters in any order, is served from the cache without queries.
+        """
+        response = self.client.get(reverse('invoice-list') + "?sort=total&page=1")
+        self.assertEqual(response['X-Cache'], 'MISS')
+        hits = invoice_list_cache.stats()['hits']
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(reverse('invoice-list') + "?page=1&sort=total")
+
+        self.assertEqual(cached['X-Cache'], 'HIT')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached.data, response.data)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(invoice_list_cache.stats()['hits'], hits + 1)
+
+        not_modified = self.client.get(reverse('invoice-list') + "?sort=total", HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_invoices_cache_invalidated_by_writes(self):
+        """
+        Test that successful writes of invoices and invoice details clear the cache, and failed ones do not.
+        """
+        url = reverse('invoice-list')
+        self.client.get(url)
+
+        self.client.post(reverse('invoice-create'), self.invoice_invalid_data_list[0])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['count'], 2)
+
+        self.client.delete(reverse('invoice-detail-delete', kwargs={'invoice_detail_id': self.invoice_detail.id}))
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    @override_settings(CACHES={
+        **settings.CACHES,
+        # room for two pages
+        'invoice_list': {
+            **settings.CACHES['invoice_list'],
+            'LOCATION': 'invoice-list-eviction',
+            'OPTIONS': {'MAX_ENTRIES': 2, 'CULL_FREQUENCY': 2}
+        }
+    })
+    def test_list_invoices_cache_eviction(self):
+        """
+        Test that the least recently used response is evicted once the cache is full.
+        """
+        url = reverse('invoice-list')
+        for sort in ("total", "date", "total", "customer"):
+            self.client.get(url + f"?sort={sort}")
+
+        self.assertEqual(self.client.get(url + "?sort=total")['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url + "?sort=date")['X-Cache'], 'MISS')
+
+    @override_settings(CACHES={
+        **settings.CACHES,
+        'worker_1': {**settings.CACHES['invoice_list'], 'LOCATION': 'invoice-list-worker-1'},
+        'worker_2': {**settings.CACHES['invoice_list'], 'LOCATION': 'invoice-list-worker-2'},
+    })
+    def test_list_cache_invalidation_across_workers(self):
+        """
+        Test that an invalidation made by one worker makes the entries of another worker with its own local store unreachable.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [InvoiceListCache('worker_1', directory), InvoiceListCache('worker_2', directory)]
+            request = APIRequestFactory().get(reverse('invoice-list') + "?sort=total")
+            for worker in workers:
+                worker.set(worker.key(Request(request)), {"content": worker.alias})
+            self.assertEqual([worker.get(worker.key(Request(request))) for worker in workers], [
+                {"content": "worker_1"}, {"content": "worker_2"}
+            ])
+
+            workers[0].invalidate()
+
+            self.assertEqual([worker.get(worker.key(Request(request))) for worker in workers], [None, None])
+
+    def test_list_cache_stats(self):
+        """
+        Test retrieval of the hit and miss counts of the list cache.
+        """
+        self.client.get(reverse('invoice-list'))
+        self.client.get(reverse('invoice-list'))
+
+        response = self.client.get(reverse('invoice-list-cache-stats'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.data['data']['hits'], 1)
+        self.assertGreaterEqual(response.data['data']['misses'], 1)
+        self.assertEqual(response.data['data']['max_entries'], settings.INVOICE_LIST_CACHE_MAX_ENTRIES)
+
+class InvoiceExportTests(InvoiceAPITest):
+    """
+    Test cases for the streamed export of invoices.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.empty_invoice = Invoice.objects.create(customer_name='Nobody', invoice_date='1999-12-31')
+
+    def export(self, query):
+        response = self.client.get(reverse('invoice-export') + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        """
+        Test that the NDJSON export contains every invoice in the same format as the invoice endpoints.
+        """
+        lines = self.export("?format=ndjson").splitlines()
+
+        self.assertEqual(len(lines), 3)
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([invoice['invoice_date'] for invoice in exported], ['1999-12-31', '2000-03-11', '2024-01-01'])
+        for invoice in exported:
+            response = self.client.get(reverse('single-invoice', kwargs={'invoice_id': invoice['id']}))
+            self.assertEqual(invoice, json.loads(json.dumps(response.data['data'])))
+
+    def test_export_csv(self):
+        """
+        Test that the CSV export contains one row per invoice detail and one row for invoices without details.
+        """
+        rows = list(csv.DictReader(StringIO(self.export("?format=csv"))))
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['invoice_id'], str(self.empty_invoice.id))
+        self.assertEqual(rows[0]['detail_id'], '')
+        self.assertEqual({row['description'] for row in rows if row['customer_name'] == 'John Doe'}, {'Product 1', 'Product 3'})
+
+    def test_export_filters(self):
+        """
+        Test that the export supports the search and date range filters of the invoice list.
+        """
+        lines = self.export("?search=john").splitlines()
+        self.assertEqual([json.loads(line)['customer_name'] for line in lines], ['John Doe'])
+        self.assertEqual(len(self.export("?date_from=2000-01-01&date_to=2020-01-01").splitlines()), 1)
+
+    def test_list_invoices_date_range(self):
+        """
+        Test that the invoice list supports the same date range filter as the export.
+        """
+        response = self.client.get(reverse('invoice-list') + "?date_from=2000-01-01&date_to=2020-01-01")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([invoice['id'] for invoice in response.data['results']['data']], [str(self.invoice.id)])
+
+    def test_list_invoices_created_since(self):
+        """
+        Test that the invoice list and the export keep the invoices created since a date and time, given with or without a time zone.
+        """
+        Invoice.objects.exclude(customer_name='John Doe').update(created_at=datetime(2024, 5, 1, 12, tzinfo=dt_timezone.utc))
+
+        response = self.client.get(reverse('invoice-list') + "?created_since=2024-05-01T12:00:00Z")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(reverse('invoice-list') + "?created_since=2024-05-01T13:00:00%2B02:00")
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(reverse('invoice-list') + "?created_since=2024-05-01T12:00:01")
+        self.assertEqual([invoice['customer_name'] for invoice in response.data['results']['data']], ['John Doe'])
+        self.assertEqual(len(self.export("?created_since=2024-05-02").splitlines()), 1)
+
+    def test_list_invoices_failure__invalid_created_since(self):
+        """
+        Test failed invoice list because of a creation time that is not in the ISO 8601 format.
+        """
+        for value in ("yesterday", "2024-13-01", "2024-05-01T25:00"):
+            response = self.client.get(reverse('invoice-list') + f"?created_since={value}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+
+    def test_export_failure__invalid_parameters(self):
+        """
+        Test failed export because of an unknown format or an invalid date.
+        """
+        response = self.client.get(reverse('invoice-export') + "?format=xml")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('invoice-export') + "?date_from=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class InvoiceImportTests(InvoiceAPITest):
+    """
+    Test cases for the import of invoices from CSV and NDJSON files.
+    """
+    csv_content = (
+        "customer_name,invoice_date,description,quantity,unit_price\n"
+        "Alice,2024-02-01,Laptop,1,900.50\n"
+        "Alice,2024-02-01,Mouse,2,10\n"
+        "Bob,2024-02-02,Desk,-1,100\n"
+        "Carol,2024-02-03,Chair,4,25\n"
+        "New Customer,2000-03-11,Pen,1,1\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'invoices.csv')
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(self.csv_content)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def import_file(self, *args):
+        call_command('import_invoices', self.path, *args, stdout=StringIO())
+        with open(f"{self.path}.errors.ndjson", encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_import_invoices_command(self):
+        """
+        Test that the command imports the valid invoices with their totals, and reports the invalid and duplicate rows.
+        """
+        errors = self.import_file('--batch-size', '2')
+
+        alice = Invoice.objects.get(customer_name='Alice')
+        self.assertEqual(alice.total_amount, Decimal('920.50'))
+        self.assertEqual(alice.line_count, 2)
+        self.assertEqual(sorted(alice.invoice_details.values_list('price', flat=True)), [Decimal('20.00'), Decimal('900.50')])
+        self.assertTrue(Invoice.objects.filter(customer_name='Carol').exists())
+        self.assertFalse(Invoice.objects.filter(customer_name='Bob').exists())
+        self.assertEqual([error['row'] for error in errors], [3, 5])
+        self.assertEqual(errors[0]['errors']['invoice_details']['quantity'], ["Quantity cannot be less than 0"])
+        self.assertEqual(errors[1]['errors']['invoice_id'], [str(self.invoice.id)])
+
+        response = self.client.get(reverse('invoice-list') + "?search=laptop")
+        self.assertEqual([invoice['id'] for invoice in response.data['results']['data']], [str(alice.id)])
+
+    def test_import_invoices_command_resume(self):
+        """
+        Test that the command continues after the last row of its checkpoint, and does nothing once the file is imported.
+        """
+        with open(f"{self.path}.checkpoint.json", 'w', encoding='utf-8') as file:
+            json.dump({
+                "path": os.path.abspath(self.path), "size": os.path.getsize(self.path), "last_row": 3,
+                "imported_invoices": 1, "imported_lines": 2, "failed_rows": 1, "completed": False
+            }, file)
+
+        self.import_file()
+
+        self.assertFalse(Invoice.objects.filter(customer_name='Alice').exists())
+        self.assertTrue(Invoice.objects.filter(customer_name='Carol').exists())
+        with open(f"{self.path}.checkpoint.json", encoding='utf-8') as file:
+            checkpoint = json.load(file)
+        self.assertEqual((checkpoint['last_row'], checkpoint['imported_invoices'], checkpoint['completed']), (5, 2, True))
+
+        self.import_file()
+        self.assertEqual(Invoice.objects.filter(customer_name='Carol').count(), 1)
+
+    def test_import_invoices_command_defer_indexes(self):
+        """
+        Test that a load with deferred indexes drops the secondary indexes and search documents, then rebuilds them once.
+        """
+        def index_names():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ('invoice', 'invoice_detail')")
+                return sorted(name for name, in cursor.fetchall())
+        indexes_before = index_names()
+        dropped = []
+        insert = InvoiceImporter.insert
+
+        def checked_insert(importer, validated_invoices):
+            dropped.append(len(index_names()) < len(indexes_before))
+            insert(importer, validated_invoices)
+        with mock.patch.object(InvoiceImporter, 'insert', checked_insert):
+            errors = self.import_file('--batch-size', '2', '--defer-indexes')
+
+        self.assertTrue(dropped and all(dropped))
+        self.assertEqual(index_names(), indexes_before)
+        self.assertEqual([error['row'] for error in errors], [3, 5])
+        for word, customer_name in (('laptop', 'Alice'), ('chair', 'Carol'), ('product', self.invoice.customer_name)):
+            response = self.client.get(reverse('invoice-list') + f"?search={word}")
+            self.assertEqual([invoice['customer_name'] for invoice in response.data['results']['data']], [customer_name])
+        with open(f"{self.path}.checkpoint.json", encoding='utf-8') as file:
+            checkpoint = json.load(file)
+        self.assertEqual((checkpoint['deferred_indexes'], checkpoint['completed']), (None, True))
+
+    def test_import_invoices_endpoint(self):
+        """
+        Test that an exported NDJSON file can be uploaded to the import endpoint.
+        """
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[1])
+        exported = b''.join(self.client.get(reverse('invoice-export') + "?format=ndjson").streaming_content)
+        Invoice.objects.filter(customer_name='Jane Doe').delete()
+
+        response = self.client.post(
+            reverse('invoice-import'),
+            {'file': SimpleUploadedFile('invoices.ndjson', exported + b'not json\n')},
+            format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['imported_invoices'], 1)
+        self.assertEqual([error['row'] for error in response.data['data']['errors']], [1, 3])
+        self.assertEqual(Invoice.objects.get(customer_name='Jane Doe').total_amount, Decimal('250.00'))
+
+    def test_import_invoices_endpoint_failure__format(self):
+        """
+        Test failed import because the format of the file is unknown.
+        """
+        response = self.client.post(
+            reverse('invoice-import'), {'file': SimpleUploadedFile('invoices.xml', b'<invoices/>')}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class RollupTest(InvoiceAPITest):
+    """
+    Base of the test cases checking the report rollups, which start from rollups of the sample invoice.
+    """
+    def setUp(self):
+        super().setUp()
+        # the invoice of the base class is created without going through the API
+        rebuild_rollups()
+
+    def rollups(self) -> dict:
+        return {
+            table.__name__: sorted(table.objects.values_list(key, 'month', 'revenue', 'quantity', 'line_count'))
+            for table, key in ((CustomerMonthRollup, 'customer_name'), (ItemMonthRollup, 'description'))
+        }
+
+    def assertRollupsRebuilt(self):
+        """
+        Asserts that the rollups kept up to date by the writes are the ones computed from scratch.
+        """
+        maintained = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(maintained, self.rollups())
+
+class ReportTests(RollupTest):
+    """
+    Test cases for the revenue reports and the rollups they are read from.
+    """
+    def test_rollups_follow_every_write(self):
+        """
+        Test that every write path of the invoices and their details updates the rollups.
+        """
+        response = self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        invoice_id = response.data['data']['id']
+        self.client.post(reverse('invoice-bulk-create'), self.invoice_valid_data_list[1:])
+        response = self.client.post(reverse('invoice-import'), {'file': SimpleUploadedFile('invoices.csv', (
+            "customer_name,invoice_date,description,quantity,unit_price\n"
+            "Alice,2024-01-20,Product 1,3,100\n"
+        ).encode())}, format='multipart')
+        self.assertEqual(response.data['data']['imported_invoices'], 1)
+        self.assertRollupsRebuilt()
+
+        detail_id = self.client.post(
+            reverse('invoice-detail-create', args=[invoice_id]), {'description': 'Product 4', 'quantity': 1, 'unit_price': 5}
+        ).data['data']['id']
+        response = self.client.patch(
+            reverse('invoice-detail-partial-update', args=[detail_id]), {'description': 'Product 5', 'quantity': 2}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRollupsRebuilt()
+        self.client.delete(reverse('invoice-detail-delete', args=[detail_id]))
+        self.assertRollupsRebuilt()
+
+        response = self.client.put(reverse('invoice-update', args=[invoice_id]), dict(self.invoice_valid_data_list[0], invoice_details=[
+            {'description': 'Product 1', 'quantity': 4, 'unit_price': 100},
+            {'description': 'Product 6', 'quantity': 1, 'unit_price': 7},
+        ]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRollupsRebuilt()
+        response = self.client.patch(
+            reverse('invoice-partial-update', args=[invoice_id]), {'customer_name': 'Jim Doe', 'invoice_date': '2024-03-05'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRollupsRebuilt()
+        self.client.delete(reverse('invoice-delete', args=[invoice_id]))
+        self.assertRollupsRebuilt()
+        self.assertFalse(CustomerMonthRollup.objects.filter(customer_name__in=['John Doe', 'Jim Doe']).exists())
+
+    def test_revenue_report(self):
+        """
+        Test that the revenue report lists the revenue per customer and month, filtered by month and customer.
+        """
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], invoice_date='2024-01-15'))
+
+        response = self.client.get(reverse('report-revenue') + "?month_from=2024-01&month_to=2024-01")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results']['data'], [
+            {'customer_name': 'John Doe', 'month': '2024-01', 'revenue': '2800.00', 'quantity': 24, 'line_count': 4}
+        ])
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get(reverse('report-revenue') + "?customer=New Customer")
+        self.assertEqual([row['month'] for row in response.data['results']['data']], ['2000-03'])
+
+    def test_top_items_report(self):
+        """
+        Test that the top items report sums the quantities over the months and keeps the largest ones.
+        """
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], invoice_date='2024-02-15'))
+
+        response = self.client.get(reverse('report-top-items') + "?month_from=2024-01&limit=1")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], [{'description': 'Product 1', 'quantity': 20, 'revenue': '2000.00', 'line_count': 2}])
+
+    def test_report_failure__invalid_parameters(self):
+        """
+        Test failed reports because of invalid months or limits.
+        """
+        self.assertEqual(self.client.get(reverse('report-revenue') + "?month_from=2024-13").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('report-top-items') + "?month_to=january").status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('report-top-items') + "?limit=0").status_code, status.HTTP_400_BAD_REQUEST)
+
+class RepriceTests(RollupTest):
+    """
+    Test cases for the bulk repricing of invoice details.
+    """
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], invoice_date='2024-02-01'))
+
+    def reprice(self, **data):
+        return self.client.post(reverse('invoice-detail-reprice'), data)
+
+    def test_reprice_percent(self):
+        """
+        Test that a percentage change reprices the matching details, the totals of their invoices and the rollups.
+        """
+        response = self.reprice(description='Product 1', date_from='2024-02-01', percent='-10')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], {'matched': 1, 'updated': 1, 'amount_change': '-100.00', 'dry_run': False})
+        detail = InvoiceDetail.objects.get(description='Product 1', invoice__invoice_date='2024-02-01')
+        self.assertEqual((detail.unit_price, detail.price), (Decimal('90.00'), Decimal('900.00')))
+        totals = dict(Invoice.objects.filter(customer_name='John Doe').values_list('invoice_date', 'total_amount'))
+        self.assertEqual(totals, {date(2024, 1, 1): Decimal('1400.00'), date(2024, 2, 1): Decimal('1300.00')})
+        self.assertRollupsRebuilt()
+
+    def test_reprice_unit_price(self):
+        """
+        Test that a new unit price is set on every detail of a customer and shows in the invoice responses.
+        """
+        response = self.reprice(customer_name='John Doe', unit_price='12.50')
+
+        self.assertEqual(response.data['data']['updated'], 4)
+        self.assertEqual(set(InvoiceDetail.objects.filter(invoice__customer_name='John Doe').values_list('unit_price', flat=True)), {Decimal('12.50')})
+        self.assertEqual(InvoiceDetail.objects.get(id=self.invoice_detail.id).unit_price, Decimal('100.00'))
+        response = self.client.get(reverse('invoice-list') + "?search=John")
+        self.assertEqual([invoice['total_amount'] for invoice in response.data['results']['data']], ['150.00', '150.00'])
+        self.assertRollupsRebuilt()
+
+    def test_reprice_dry_run(self):
+        """
+        Test that a dry run counts the matching details and the change of the totals without writing anything.
+        """
+        response = self.reprice(description='Product 3', percent='50', dry_run=True)
+
+        self.assertEqual(response.data['data'], {'matched': 2, 'updated': 0, 'amount_change': '400.00', 'dry_run': True})
+        self.assertEqual(set(InvoiceDetail.objects.filter(description='Product 3').values_list('unit_price', flat=True)), {Decimal('200.00')})
+
+    def test_reprice_runs_a_fixed_number_of_queries(self):
+        """
+        Test that the number of queries of a repricing does not grow with the number of details it changes.
+        """
+        with CaptureQueriesContext(connection) as one_detail:
+            self.reprice(description='Product 1', date_to='2024-01-31', percent='5')
+        with CaptureQueriesContext(connection) as many_details:
+            self.reprice(date_from='2000-01-01', percent='5')
+
+        self.assertEqual(InvoiceDetail.objects.filter(unit_price=Decimal('110.25')).count(), 1)
+        self.assertEqual(len(one_detail), len(many_details))
+        self.assertRollupsRebuilt()
+
+    def test_reprice_failure__too_many_rows(self):
+        """
+        Test that a repricing matching more details than max_rows or the REPRICE_MAX_ROWS setting is refused.
+        """
+        response = self.reprice(customer_name='John Doe', percent='10', max_rows=3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['message'], "4 invoice details match, more than the limit of 3")
+
+        with override_settings(REPRICE_MAX_ROWS=2):
+            response = self.reprice(customer_name='John Doe', percent='10', max_rows=10)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(InvoiceDetail.objects.exclude(unit_price__in=[100, 200]).exists())
+
+    def test_reprice_failure__invalid_body(self):
+        """
+        Test failed repricings without a filter, without or with both prices, or with prices out of range.
+        """
+        for data in (
+            {'percent': '10'},
+            {'description': 'Product 1'},
+            {'description': 'Product 1', 'percent': '10', 'unit_price': '1'},
+            {'description': 'Product 1', 'percent': '-101'},
+            {'description': 'Product 1', 'unit_price': '-1'},
+            {'date_from': '2024-02-01', 'date_to': '2024-01-01', 'percent': '10'},
+        ):
+            self.assertEqual(self.reprice(**data).status_code, status.HTTP_400_BAD_REQUEST, data)
+
+        response = self.reprice(description='Product 1', unit_price='99999999.99')
+        self.assertEqual(response.data['message'], "the new prices cannot exceed 99999999.99")
+
+class BulkDeleteTests(RollupTest):
+    """
+    Test cases for the bulk deletion of invoices.
+    """
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], invoice_date='2024-02-01'))
+
+    def bulk_delete(self, **data):
+        return self.client.post(reverse('invoice-bulk-delete'), data)
+
+    def test_bulk_delete_date_range(self):
+        """
+        Test that the invoices of a date range are deleted with their details, search documents and rollups.
+        """
+        response = self.bulk_delete(date_from='2024-01-15', date_to='2024-12-31')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], {
+            'matched_invoices': 1, 'matched_details': 2, 'deleted_invoices': 1, 'deleted_details': 2, 'dry_run': False
+        })
+        self.assertEqual(list(Invoice.objects.filter(customer_name='John Doe').values_list('invoice_date', flat=True)), [date(2024, 1, 1)])
+        self.assertEqual(InvoiceDetail.objects.count(), 3)
+        response = self.client.get(reverse('invoice-list') + "?search=John")
+        self.assertEqual([invoice['invoice_date'] for invoice in response.data['results']['data']], ['2024-01-01'])
+        self.assertRollupsRebuilt()
+
+    def test_bulk_delete_in_chunks(self):
+        """
+        Test that the invoices are deleted one chunk per transaction, with the progress reported after each chunk.
+        """
+        progress = []
+        result = purge_invoices(
+            invoices_to_purge(customer_name='John Doe'), chunk_size=1,
+            on_chunk=lambda result: progress.append((result['deleted_invoices'], result['deleted_details']))
+        )
+
+        self.assertEqual(progress, [(1, 2), (2, 4)])
+        self.assertEqual((result['matched_invoices'], result['deleted_invoices']), (2, 2))
+        self.assertFalse(Invoice.objects.filter(customer_name='John Doe').exists())
+        self.assertEqual(list(InvoiceDetail.objects.values_list('id', flat=True)), [str(self.invoice_detail.id)])
+        self.assertRollupsRebuilt()
+
+    def test_bulk_delete_dry_run(self):
+        """
+        Test that a dry run counts the matching invoices and details from the stored line counts without deleting them.
+        """
+        response = self.bulk_delete(customer_name='John Doe', dry_run=True)
+
+        self.assertEqual(response.data['data'], {
+            'matched_invoices': 2, 'matched_details': 4, 'deleted_invoices': 0, 'deleted_details': 0, 'dry_run': True
+        })
+        self.assertEqual(Invoice.objects.filter(customer_name='John Doe').count(), 2)
+
+    def test_details_deleted_without_database_cascade(self):
+        """
+        Test that the details are deleted by a statement of their own on tables without ON DELETE CASCADE,
+        such as the ones Django creates for the tests.
+        """
+        self.assertFalse(cascades_invoice_details(connection))
+        with CaptureQueriesContext(connection) as queries:
+            purge_invoices(invoices_to_purge(customer_name='John Doe'))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('DELETE FROM "invoice_detail"')]), 1)
+
+    def test_delete_invoices_command(self):
+        """
+        Test that the command deletes the invoices chunk by chunk and reports its progress, or only counts them.
+        """
+        output = StringIO()
+        call_command('delete_invoices', '--customer', 'John Doe', '--dry-run', stdout=output)
+        self.assertIn("2 invoices with 4 invoice details would be deleted", output.getvalue())
+        self.assertEqual(Invoice.objects.filter(customer_name='John Doe').count(), 2)
+
+        output = StringIO()
+        call_command('delete_invoices', '--date-to', '2024-01-31', '--chunk-size', '1', stdout=output)
+        self.assertIn("1 of 2 invoices deleted (1 invoice details)", output.getvalue())
+        self.assertIn("Deleted 2 invoices with 3 invoice details", output.getvalue())
+        self.assertEqual(list(Invoice.objects.values_list('invoice_date', flat=True)), [date(2024, 2, 1)])
+
+    def test_bulk_delete_failure__invalid_body(self):
+        """
+        Test failed bulk deletions without a filter or with an inverted date range.
+        """
+        self.assertEqual(self.bulk_delete(dry_run=True).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.bulk_delete(date_from='2024-02-01', date_to='2024-01-01').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Invoice.objects.count(), 3)
+
+class DbScriptsTests(TestCase):
+    """
+    Test cases for the scripts of the db-scripts directory, which write the derived data of the API themselves.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dummy.sqlite3')
+        load_data_generator('create_tables').create_tables(self.path)
+        load_data_generator('insert_dummy_data').insert_dummy_data(self.path)
+        self.connection = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.connection.close()
+        self.directory.cleanup()
+
+    def test_document_rowid(self):
+        """
+        Test that the scripts give the search documents the rowid the API replaces and removes them by.
+        """
+        derived_data = load_data_generator('derived_data')
+        for invoice_id in [uuid.uuid4() for _ in range(20)] + ['', 'invoice']:
+            self.assertEqual(derived_data.document_rowid(invoice_id), document_rowid(invoice_id))
+
+        documents = self.connection.execute("SELECT rowid, invoice_id FROM invoice_search").fetchall()
+        self.assertEqual(len(documents), self.connection.execute("SELECT COUNT(*) FROM invoice").fetchone()[0])
+        self.assertEqual([rowid for rowid, _ in documents], [document_rowid(invoice_id) for _, invoice_id in documents])
+
+    def test_rollups(self):
+        """
+        Test that the report rollups computed by the scripts are the ones `rebuild_rollups` computes from the same invoices.
+        """
+        tables = (
+            (CustomerMonthRollup._meta.db_table, 'customer_name'),
+            (ItemMonthRollup._meta.db_table, 'description'),
+        )
+
+        def rollup_rows(cursor):
+            rows = {}
+            for table, key in tables:
+                cursor.execute(f"SELECT {key}, month, revenue, quantity, line_count FROM {table}")
+                rows[table] = sorted(
+                    (name, str(month), Decimal(str(revenue)).quantize(Decimal('0.01')), quantity, line_count)
+                    for name, month, revenue, quantity, line_count in cursor.fetchall()
+                )
+            return rows
+
+        script_rows = rollup_rows(self.connection.cursor())
+        for model in (Invoice, InvoiceDetail):
+            model.objects.all().delete()
+            columns = [field.column for field in model._meta.concrete_fields]
+            rows = self.connection.execute(f"SELECT {', '.join(columns)} FROM {model._meta.db_table}").fetchall()
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {model._meta.db_table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})", rows
+                )
+        rebuild_rollups()
+
+        self.assertTrue(all(script_rows.values()))
+        with connection.cursor() as cursor:
+            self.assertEqual(script_rows, rollup_rows(cursor))
+
+class EndpointBenchmarkTests(InvoiceAPITest):
+    """
+    Test cases for the endpoint benchmark suite.
+    """
+    def setUp(self):
+        super().setUp()
+        for index in range(3):
+            self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], customer_name=f"Customer {index}"))
+
+    def test_run_scenarios(self):
+        """
+        Test that every endpoint is measured and that the writes of the benchmark are committed like real requests.
+        """
+        details_before = InvoiceDetail.objects.count()
+
+        results = run_scenarios(iterations=1, warmup=0)
+
+        self.assertTrue({
+            'list', 'search', 'search_relevance', 'sort_customer', 'sort_date', 'sort_total', 'sort_description',
+            'sort_price', 'sort_quantity', 'sort_unit_price', 'get', 'put', 'patch', 'detail_create', 'detail_edit', 'detail_delete'
+        } <= set(results))
+        self.assertEqual(results['get']['requests'], 1)
+        self.assertGreater(results['get']['throughput_rps'], 0)
+        # each put replaces the details of an invoice by 3, then a detail is created and another one deleted
+        self.assertNotEqual(InvoiceDetail.objects.count(), details_before)
+        self.assertTrue(InvoiceDetail.objects.filter(description="Benchmark item").exists())
+
+    def test_copy_database(self):
+        """
+        Test that the copy of a dataset holds its rows, takes the writes and is removed afterwards.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dataset.sqlite3')
+            with sqlite3.connect(path) as connection:
+                connection.execute("CREATE TABLE item (name TEXT)")
+                connection.execute("INSERT INTO item VALUES ('kept')")
+            connection.close()
+
+            with copy_database(path) as copy_path:
+                with sqlite3.connect(copy_path) as connection:
+                    self.assertEqual(connection.execute("SELECT name FROM item").fetchall(), [('kept',)])
+                    connection.execute("INSERT INTO item VALUES ('written')")
+                connection.close()
+
+            self.assertFalse(os.path.exists(copy_path))
+            self.assertEqual(os.listdir(directory), ['dataset.sqlite3'])
+            connection = sqlite3.connect(path)
+            self.assertEqual(connection.execute("SELECT name FROM item").fetchall(), [('kept',)])
+            connection.close()
+
+    def test_find_regressions(self):
+        """
+        Test that only the scenarios slower than the threshold and the noise floor are reported.
+        """
+        baseline = {"1000": {"list": {"p50_ms": 10.0}, "get": {"p50_ms": 1.0}, "put": {"p50_ms": 10.0}}}
+        results = {"1000": {"list": {"p50_ms": 13.0}, "get": {"p50_ms": 1.4}, "put": {"p50_ms": 12.0}, "patch": {"p50_ms": 5.0}}}
+
+        regressions = find_regressions(results, baseline, threshold=0.25, min_delta_ms=0.5)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("list on 1000 invoices"))
+
+class InvoiceRepresentationTests(InvoiceAPITest):
+    """
+    Test cases for the read-only representation of the invoices built from values() rows.
+    """
+    def setUp(self):
+        super().setUp()
+        self.client.post(reverse('invoice-create'), self.invoice_valid_data_list[0])
+        self.client.post(reverse('invoice-create'), {
+            'customer_name': 'Zoë Ünicode "quoted"',
+            'invoice_date': '2023-12-31',
+            'invoice_details': [
+                {'description': 'Ruler ½', 'quantity': 3, 'unit_price': '12.50'},
+                {'description': 'Pen', 'quantity': 7, 'unit_price': '0.05'},
+                {'description': 'Paper', 'quantity': 1, 'unit_price': '99999.99'},
+            ]
+        })
+        Invoice.objects.create(customer_name='No Details', invoice_date='2022-01-01')
+
+    def test_same_json_as_serializer(self):
+        """
+        Test that the representations render to the same bytes as the serializer, details order included.
+        """
+        invoices = Invoice.objects.order_by('-invoice_date', 'id')
+        expected = JSONRenderer().render(InvoiceSerializer(invoices.prefetch_related('invoice_details'), many=True).data)
+
+        rows = list(invoices.values(*INVOICE_FIELDS))
+        with self.assertNumQueries(1):
+            data = represent_invoices(rows, invoice_detail_rows([invoice['id'] for invoice in rows]))
+
+        self.assertEqual(JSONRenderer().render(data), expected)
+
+    def test_endpoints_use_representation(self):
+        """
+        Test that the list and single invoice endpoints return the serializer output.
+        """
+        invoice = Invoice.objects.get(customer_name='Zoë Ünicode "quoted"')
+        response = self.client.get(reverse('single-invoice', args=[invoice.id]))
+        self.assertEqual(
+            JSONRenderer().render(response.data['data']),
+            JSONRenderer().render(InvoiceSerializer(invoice).data)
+        )
+
+        response = self.client.get(reverse('invoice-list'))
+        invoices = Invoice.objects.order_by('-invoice_date')
+        self.assertEqual(
+            JSONRenderer().render(response.data['results']['data']),
+            JSONRenderer().render(InvoiceSerializer(invoices, many=True).data)
+        )
+
+    def test_serializer_comparison(self):
+        """
+        Test that the benchmark measures both serialization paths.
+        """
+        results = run_serializer_comparison(iterations=2, warmup=0, page_size=2)
+        self.assertEqual(set(results), {'serialize_drf', 'serialize_values'})
+        self.assertEqual(results['serialize_values']['requests'], 2)
+
+class FastJSONTests(InvoiceAPITest):
+    """
+    Test cases for the orjson based renderer and parser.
+    """
+    def payload(self):
+        return {
+            "message": "successfully retrieved invoice",
+            "data": {
+                "id": self.invoice.id,
+                "unit_price": Decimal("12.50"),
+                "price": 1000.0,
+                "invoice_date": date(2024, 1, 1),
+                "updated_at": datetime(2024, 1, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+                "description": "Ruler \u00bd \u2028 \u2029 \"quoted\"",
+                "total": 2 ** 70,
+                1: None,
+            },
+        }
+
+    def test_same_output_as_json_renderer(self):
+        """
+        Test that the renderer gives the same bytes as JSONRenderer, with and without orjson.
+        """
+        expected = JSONRenderer().render(self.payload())
+        self.assertEqual(FastJSONRenderer().render(self.payload()), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.payload()), expected)
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+        self.assertEqual(
+            FastJSONRenderer().render(self.payload(), 'application/json; indent=4'),
+            JSONRenderer().render(self.payload(), 'application/json; indent=4')
+        )
+
+    def test_responses_rendered_identically(self):
+        """
+        Test that the responses of the endpoints, CustomResponse envelope included, are the ones of JSONRenderer.
+        """
+        response = self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        response = self.client.get(reverse('invoice-list'))
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parser(self):
+        """
+        Test that the parser reads the same data as JSONParser and refuses what the strict parser refuses.
+        """
+        for content in (b'{"quantity": 3, "unit_price": "12.50", "big": 1180591620717411303424}', '{"d": "\u00e9"}'.encode()):
+            self.assertEqual(FastJSONParser().parse(BytesIO(content)), JSONParser().parse(BytesIO(content)))
+        for content in (b'{"quantity": NaN}', b'{"quantity": '):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(content))
+
+        response = self.client.post(
+            reverse('invoice-create'), b'{"customer_name": ', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_json_comparison(self):
+        """
+        Test that the microbenchmark measures both renderers and parsers.
+        """
+        results = run_json_comparison(iterations=2, warmup=0, page_size=5)
+        self.assertEqual(set(results), {'render_stdlib', 'render_fast', 'parse_stdlib', 'parse_fast'})
+
+@override_settings(SQL_INSTRUMENTATION_HEADERS=True)
+class QueryBudgetTests(InvoiceAPITest):
+    """
+    Test cases for the SQL instrumentation middleware and the number of queries run by each endpoint.
+    The budgets include the savepoint statements of the write transactions.
+    """
+    def assertQueryBudget(self, response, budget):
+        """
+        Asserts that the request of a response succeeded and ran at most `budget` SQL queries.
+        """
+        self.assertLess(response.status_code, 400)
+        self.assertLessEqual(int(response['X-DB-Queries']), budget)
+
+    def test_instrumentation_headers(self):
+        """
+        Test that the number and duration of the queries are returned in the response headers.
+        """
+        response = self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertGreater(float(response['X-DB-Time-ms']), 0)
+        self.assertLessEqual(float(response['X-DB-Slowest-ms']), float(response['X-DB-Time-ms']))
+
+    @override_settings(SQL_INSTRUMENTATION_HEADERS=False)
+    def test_instrumentation_headers_disabled(self):
+        response = self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+
+        self.assertFalse(response.has_header('X-DB-Queries'))
+
+    @override_settings(SQL_REPEATED_QUERY_THRESHOLD=2)
+    def test_repeated_query_warning(self):
+        """
+        Test that a warning is logged when the same query runs more times than the threshold in a request.
+        """
+        def one_query_per_invoice(request):
+            for invoice_id in ['a', 'b', 'c']:
+                Invoice.objects.filter(id=invoice_id).first()
+            return Response()
+
+        middleware = QueryInstrumentationMiddleware(one_query_per_invoice)
+        with self.assertLogs('api.middleware', level='WARNING') as logs:
+            response = middleware(APIRequestFactory().get('/api/invoice/'))
+
+        self.assertEqual(response['X-DB-Queries'], '3')
+        self.assertIn("ran the same query 3 times", logs.output[0])
+        with self.assertNoLogs('api.middleware', level='WARNING'):
+            self.client.get(reverse('invoice-list'))
+
+    def test_read_query_budgets(self):
+        """
+        Test that the reads run a fixed number of queries, whatever the number of invoices and details.
+        """
+        for index in range(12):
+            self.client.post(reverse('invoice-create'), dict(self.invoice_valid_data_list[0], customer_name=f"Customer {index}"))
+        invoice_list_cache.invalidate()
+
+        self.assertQueryBudget(self.client.get(reverse('invoice-list')), 4)
+        self.assertQueryBudget(self.client.get(reverse('invoice-list') + "?search=customer&sort=relevance"), 4)
+        self.assertQueryBudget(self.client.get(reverse('invoice-list') + "?pagination=cursor&sort=total"), 3)
+        self.assertQueryBudget(self.client.get(reverse('single-invoice', args=[self.invoice.id])), 2)
+
+    def test_write_query_budgets(self):
+        """
+        Test that the writes run a fixed number of queries, whatever the number of invoice details written.
+        The report rollups take one upsert per table, and one delete per table when rows may have been emptied.
+        """
+        many_details = dict(self.invoice_valid_data_list[0], invoice_details=self.invoice_valid_data_list[0]['invoice_details'] * 10)
+        response = self.client.post(reverse('invoice-create'), many_details)
+        self.assertQueryBudget(response, 8)
+        invoice_id = response.data['data']['id']
+
+        self.assertQueryBudget(self.client.put(reverse('invoice-update', args=[invoice_id]), many_details), 10)
+        self.assertQueryBudget(self.client.patch(reverse('invoice-partial-update', args=[invoice_id]), {'customer_name': 'Jim Doe'}), 12)
+        self.assertQueryBudget(self.client.post(reverse('invoice-bulk-create'), [
+            dict(self.invoice_valid_data_list[0], customer_name=f"Bulk {index}") for index in range(20)
+        ]), 8)
+        self.assertQueryBudget(self.client.post(
+            reverse('invoice-detail-create', args=[invoice_id]), {'description': 'Product 4', 'quantity': 1, 'unit_price': 5}
+        ), 11)
+        self.assertQueryBudget(self.client.patch(reverse('invoice-detail-partial-update', args=[self.invoice_detail.id]), {'quantity': 3}), 14)
+        self.assertQueryBudget(self.client.delete(reverse('invoice-detail-delete', args=[self.invoice_detail.id])), 14)
+        self.assertQueryBudget(self.client.delete(reverse('invoice-delete', args=[invoice_id])), 12)
+
+class MetricsTests(InvoiceAPITest):
+    """
+    Test cases for the request metrics and the Prometheus endpoint.
+    """
+    def setUp(self):
+        super().setUp()
+        metrics_registry.reset()
+
+    def test_metrics_endpoint(self):
+        """
+        Test that requests are counted under the resource and action of their responses, errors included.
+        """
+        self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+        self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+        self.client.get(reverse('single-invoice', args=['missing']))
+        self.client.post(reverse('invoice-detail-create', args=[self.invoice.id]), {'description': 'Pen', 'quantity': -1, 'unit_price': 1})
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        metrics = response.content.decode()
+        self.assertIn('invoice_api_requests_total{resource="invoice",action="retrieval"} 3', metrics)
+        self.assertIn('invoice_api_request_duration_seconds_bucket{resource="invoice",action="retrieval",le="+Inf"} 3', metrics)
+        self.assertIn('invoice_api_errors_total{resource="invoice",action="retrieval",status="404"} 1', metrics)
+        self.assertIn('invoice_api_errors_total{resource="invoice detail",action="creation",status="400"} 1', metrics)
+
+    def test_metrics_shared_between_processes(self):
+        """
+        Test that the counters written by every process to the shared directory are added up.
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            other_worker = MetricsRegistry()
+            other_worker.process_id = 'other-worker'
+            other_worker.record('invoice', 'retrieval', 200, 0.02)
+            other_worker.record('invoice', 'retrieval', 500, 0.3)
+            other_worker.flush()
+            self.client.get(reverse('single-invoice', args=[self.invoice.id]))
+
+            metrics = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('invoice_api_requests_total{resource="invoice",action="retrieval"} 3', metrics)
+        self.assertIn('invoice_api_request_duration_seconds_bucket{resource="invoice",action="retrieval",le="0.25"} 2', metrics)
+        self.assertIn('invoice_api_errors_total{resource="invoice",action="retrieval",status="500"} 1', metrics)
+
+
+class SQLiteProfileTests(InvoiceAPITest):
+    """
+    Test cases for the PRAGMAs set on every SQLite connection.
+    """
+
+    def test_profile_applied_to_connections(self):
+        """
+        Test that the connections of the application use the PRAGMAs of the configured profile.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], sqlite_pragmas()['busy_timeout'])
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], sqlite_pragmas()['cache_size'])
+
+    def test_profile_overrides(self):
+        """
+        Test that single PRAGMAs override the ones of the profile and that invalid ones are refused.
+        """
+        with override_settings(SQLITE_PROFILE='wal-mmap', SQLITE_PRAGMAS={'cache_size': -1000}):
+            pragmas = sqlite_pragmas()
+        self.assertEqual(pragmas['cache_size'], -1000)
+        self.assertEqual(pragmas['mmap_size'], 268435456)
+
+        with override_settings(SQLITE_PRAGMAS={'journal_mode': 'wal; DROP TABLE invoice'}):
+            with self.assertRaises(ImproperlyConfigured):
+                sqlite_pragmas()
+        with override_settings(SQLITE_PRAGMAS={'foreign_keys': 'off'}):
+            with self.assertRaises(ImproperlyConfigured):
+                sqlite_pragmas()
+        with self.assertRaises(ImproperlyConfigured):
+            sqlite_pragmas('unknown')
+
+
+@override_settings(SQLITE_WRITE_RETRIES=2, SQLITE_RETRY_BACKOFF=0)
+class WriteRetryTests(SimpleTestCase):
+    """
+    Test cases for the retries of the write views when the database is locked.
+    """
+
+    def view(self, *errors):
+        """
+        Returns a view whose write method raises the given errors one after the other, then succeeds.
+        """
+        class View:
+            calls = 0
+
+            @retries_when_locked
+            def post(self, request):
+                View.calls += 1
+                if View.calls <= len(errors):
+                    raise errors[View.calls - 1]
+                return Response(status=status.HTTP_201_CREATED)
+        return View
+
+    def test_retried_when_locked(self):
+        """
+        Test that a write failing because the database is locked is run again until it succeeds.
+        """
+        view = self.view(OperationalError("database is locked"), OperationalError("database is locked"))
+        with self.assertLogs('api.database', level='WARNING'):
+            response = view().post(APIRequestFactory().post('/'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(view.calls, 3)
+
+    def test_gives_up_after_retries(self):
+        """
+        Test that the error is raised once every retry failed, and that other errors are never retried.
+        """
+        view = self.view(*[OperationalError("database is locked")] * 3)
+        with self.assertLogs('api.database', level='WARNING'), self.assertRaises(OperationalError):
+            view().post(APIRequestFactory().post('/'))
+        self.assertEqual(view.calls, 3)
+
+        view = self.view(OperationalError("no such table: invoice"))
+        with self.assertRaises(OperationalError):
+            view().post(APIRequestFactory().post('/'))
+        self.assertEqual(view.calls, 1)
+
+
+@override_settings(WRITE_COALESCING=True, WRITE_COALESCING_WINDOW=5, WRITE_COALESCING_MAX_BATCH=4)
+class WriteCoalescerTests(TestCase):
+    """
+    Test cases for the group commit of concurrent writes.
+    """
+    def run_concurrently(self, coalescer, writes) -> list:
+        """
+        Submits each write from its own thread at the same time and returns the result or error of each one.
+        """
+        outcomes = [None] * len(writes)
+        recorders = [QueryRecorder() for _ in writes]
+
+        def submit(index):
+            try:
+                with connection.execute_wrapper(recorders[index]):
+                    outcomes[index] = coalescer.run(writes[index])
+            except Exception as error:
+                outcomes[index] = error
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(writes))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.recorders = recorders
+        return outcomes
+
+    def test_concurrent_writes_commit_together(self):
+        """
+        Test that concurrent writes are run in a single batch, each getting its own result and its own query count.
+        """
+        def write(value):
+            def run():
+                with transaction.get_connection().cursor() as cursor:
+                    cursor.execute(f"SELECT {value}")
+                    return cursor.fetchone()[0]
+            return run
+
+        coalescer = WriteCoalescer()
+        outcomes = self.run_concurrently(coalescer, [write(value) for value in range(4)])
+
+        self.assertEqual(outcomes, [0, 1, 2, 3])
+        self.assertEqual(coalescer.stats(), {"batches": 1, "writes": 4, "average_batch": 4})
+        for value, recorder in enumerate(self.recorders):
+            self.assertEqual([sql for sql in recorder.shapes if sql.startswith("SELECT")], [f"SELECT {value}"])
+
+    def test_failing_write_does_not_fail_the_batch(self):
+        """
+        Test that the error of a write is raised in its own thread only.
+        """
+        def fail():
+            raise ValueError("invalid line")
+
+        coalescer = WriteCoalescer()
+        outcomes = self.run_concurrently(coalescer, [lambda: 1, fail, lambda: 3, lambda: 4])
+
+        self.assertEqual([outcomes[0], outcomes[2], outcomes[3]], [1, 3, 4])
+        self.assertIsInstance(outcomes[1], ValueError)
+        self.assertEqual(coalescer.stats()["batches"], 1)
+
+    def test_writes_in_a_transaction_are_not_coalesced(self):
+        """
+        Test that a write inside the transaction of its caller runs at once, as does every write when coalescing is off.
+        """
+        self.assertEqual(write_coalescer.run(lambda: 1), 1)
+        with override_settings(WRITE_COALESCING=False):
+            self.assertEqual(self.run_concurrently(WriteCoalescer(), [lambda: 2]), [2])
+
+class AsyncViewsURLConf:
+    """
+    URL configuration serving the invoice endpoints with the asynchronous views, so the same tests run against them.
+    """
+    urlpatterns = [path('api/', include(invoice_urlpatterns(async_views=True)))]
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncViewsTests(InvoiceAPITest):
+    """
+    Test cases for the asynchronous views, run through the ASGI handler.
+    """
+
+    def test_async_views_are_served(self):
+        """
+        Test that the asynchronous views replace the synchronous ones when they are selected.
+        """
+        self.assertIs(resolve(reverse('invoice-list')).func.view_class, AsyncInvoiceAPIView)
+
+    async def test_async_list_and_get(self):
+        """
+        Test that the list and a single invoice are served without leaving the event loop for the view.
+        """
+        response = await self.async_client.get(reverse('invoice-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        response = await self.async_client.get(reverse('single-invoice', args=[self.invoice.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['data']['invoice_details'][0]['description'], 'New Product')
+
+        response = await self.async_client.get(reverse('invoice-list') + "?page=5")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_create_and_delete(self):
+        """
+        Test that invoices are created and deleted through the asynchronous views.
+        """
+        response = await self.async_client.post(
+            reverse('invoice-create'), self.invoice_valid_data_list[0], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        invoice_id = response.json()['data']['id']
+        self.assertEqual(await Invoice.objects.filter(id=invoice_id).acount(), 1)
+
+        response = await self.async_client.delete(reverse('invoice-delete', args=[invoice_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(await Invoice.objects.filter(id=invoice_id).aexists())
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncCreateInvoiceTests(CreateInvoiceTests):
+    """
+    Runs the invoice creation tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceListAPITests(InvoiceListAPITests):
+    """
+    Runs the invoice list tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceUpdateTests(InvoiceUpdateTests):
+    """
+    Runs the invoice update tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceDetailsReplaceTests(InvoiceDetailsReplaceTests):
+    """
+    Runs the invoice details replacement tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoicePartialUpdateTests(InvoicePartialUpdateTests):
+    """
+    Runs the invoice partial update tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceDeleteTests(InvoiceDeleteTests):
+    """
+    Runs the invoice deletion tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncSingleInvoiceAPITests(SingleInvoiceAPITests):
+    """
+    Runs the single invoice tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceDetailPartialUpdateTests(InvoiceDetailPartialUpdateTests):
+    """
+    Runs the invoice detail partial update tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceDetailDeleteTests(InvoiceDetailDeleteTests):
+    """
+    Runs the invoice detail deletion tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceDetailCreateTests(InvoiceDetailCreateTests):
+    """
+    Runs the invoice detail creation tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoicePaginationSortTests(InvoicePaginationSortTests):
+    """
+    Runs the invoice list sorting tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceCursorPaginationTests(InvoiceCursorPaginationTests):
+    """
+    Runs the cursor pagination tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceConditionalRequestTests(InvoiceConditionalRequestTests):
+    """
+    Runs the conditional request tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncSparseFieldsetTests(SparseFieldsetTests):
+    """
+    Runs the sparse fieldset tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncInvoiceListCacheTests(InvoiceListCacheTests):
+    """
+    Runs the invoice list cache tests against the asynchronous views.
+    """
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsURLConf)
+class AsyncQueryBudgetTests(QueryBudgetTests):
+    """
+    Runs the query budget tests against the asynchronous views, which must not run more queries than the synchronous ones.
+    """
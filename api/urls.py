@@ -1,56 +1,117 @@
+from django.conf import settings
 from django.urls import path
-from .views import InvoiceAPIView, SingleInvoiceAPIView, InvoiceDetailEditAPIView, InvoiceDetailCreateAPIView
-
-urlpatterns = [
-    path(
-        'invoice/create/', 
-        InvoiceAPIView.as_view(), 
-        name='invoice-create'
-        ), #post
-    path(
-        'invoice/', 
-        InvoiceAPIView.as_view(), 
-        name='invoice-list'
-        ), #get list
-
-
-    path(
-        'invoice/get/<str:invoice_id>/',
-        SingleInvoiceAPIView.as_view(),
-        name='single-invoice'
-        ), #get single invoice
-    path(
-        'invoice/update/<str:invoice_id>/', 
-        SingleInvoiceAPIView.as_view(), 
-        name='invoice-update'
-        ), #put
-    path(
-        'invoice/partial-update/<str:invoice_id>/', 
-        SingleInvoiceAPIView.as_view(), 
-        name='invoice-partial-update'
-        ), #patch
-    path(
-        'invoice/delete/<str:invoice_id>/', 
-        SingleInvoiceAPIView.as_view(),
-        name='invoice-delete'
-        ), #delete
-
-
-    path(
-        'invoice-detail/partial-update/<str:invoice_detail_id>/', 
-        InvoiceDetailEditAPIView.as_view(), 
-        name='invoice-detail-partial-update'
-        ), #patch
-    path(
-        'invoice-detail/delete/<str:invoice_detail_id>/', 
-        InvoiceDetailEditAPIView.as_view(), 
-        name='invoice-detail-delete'
-        ), #delete
-
-
-    path(
-        'invoice-detail/create/<str:invoice_id>/', 
-        InvoiceDetailCreateAPIView.as_view(), 
-        name='invoice-detail-create'
-        ), #post
-]
\ No newline at end of file
+from .async_views import AsyncInvoiceAPIView, AsyncSingleInvoiceAPIView, AsyncInvoiceDetailEditAPIView, AsyncInvoiceDetailCreateAPIView
+from .views import InvoiceAPIView, SingleInvoiceAPIView, InvoiceDetailEditAPIView, InvoiceDetailCreateAPIView, InvoiceDetailRepriceAPIView, InvoiceBulkCreateAPIView, InvoiceBulkDeleteAPIView, InvoiceListCacheStatsAPIView, InvoiceExportAPIView, InvoiceImportAPIView, MetricsAPIView, RevenueReportAPIView, TopItemsReportAPIView
+
+
+def invoice_urlpatterns(async_views: bool = False) -> list:
+    """
+    Returns the url patterns of the API, with the asynchronous versions of the invoice and invoice detail views
+    when `async_views` is true. The other endpoints only have synchronous views.
+    """
+    if async_views:
+        invoice_view, single_invoice_view = AsyncInvoiceAPIView, AsyncSingleInvoiceAPIView
+        invoice_detail_edit_view, invoice_detail_create_view = AsyncInvoiceDetailEditAPIView, AsyncInvoiceDetailCreateAPIView
+    else:
+        invoice_view, single_invoice_view = InvoiceAPIView, SingleInvoiceAPIView
+        invoice_detail_edit_view, invoice_detail_create_view = InvoiceDetailEditAPIView, InvoiceDetailCreateAPIView
+    return [
+        path(
+            'invoice/create/', 
+            invoice_view.as_view(), 
+            name='invoice-create'
+            ), #post
+        path(
+            'invoice/', 
+            invoice_view.as_view(), 
+            name='invoice-list'
+            ), #get list
+        path(
+            'invoice/bulk-create/', 
+            InvoiceBulkCreateAPIView.as_view(), 
+            name='invoice-bulk-create'
+            ), #post many
+        path(
+            'invoice/bulk-delete/', 
+            InvoiceBulkDeleteAPIView.as_view(), 
+            name='invoice-bulk-delete'
+            ), #post filters of the invoices to delete
+        path(
+            'invoice/cache-stats/', 
+            InvoiceListCacheStatsAPIView.as_view(), 
+            name='invoice-list-cache-stats'
+            ), #get list cache stats
+        path(
+            'invoice/export/', 
+            InvoiceExportAPIView.as_view(), 
+            name='invoice-export'
+            ), #get all invoices streamed
+        path(
+            'invoice/import/', 
+            InvoiceImportAPIView.as_view(), 
+            name='invoice-import'
+            ), #post a file of invoices
+        path(
+            'metrics', 
+            MetricsAPIView.as_view(), 
+            name='metrics'
+            ), #get prometheus metrics
+        path(
+            'reports/revenue/', 
+            RevenueReportAPIView.as_view(), 
+            name='report-revenue'
+            ), #get revenue per customer per month
+        path(
+            'reports/top-items/', 
+            TopItemsReportAPIView.as_view(), 
+            name='report-top-items'
+            ), #get items sold in the largest quantities
+
+
+        path(
+            'invoice/get/<str:invoice_id>/',
+            single_invoice_view.as_view(),
+            name='single-invoice'
+            ), #get single invoice
+        path(
+            'invoice/update/<str:invoice_id>/', 
+            single_invoice_view.as_view(), 
+            name='invoice-update'
+            ), #put
+        path(
+            'invoice/partial-update/<str:invoice_id>/', 
+            single_invoice_view.as_view(), 
+            name='invoice-partial-update'
+            ), #patch
+        path(
+            'invoice/delete/<str:invoice_id>/', 
+            single_invoice_view.as_view(),
+            name='invoice-delete'
+            ), #delete
+
+
+        path(
+            'invoice-detail/partial-update/<str:invoice_detail_id>/', 
+            invoice_detail_edit_view.as_view(), 
+            name='invoice-detail-partial-update'
+            ), #patch
+        path(
+            'invoice-detail/delete/<str:invoice_detail_id>/', 
+            invoice_detail_edit_view.as_view(), 
+            name='invoice-detail-delete'
+            ), #delete
+
+
+        path(
+            'invoice-detail/create/<str:invoice_id>/', 
+            invoice_detail_create_view.as_view(), 
+            name='invoice-detail-create'
+            ), #post
+        path(
+            'invoice-detail/reprice/', 
+            InvoiceDetailRepriceAPIView.as_view(), 
+            name='invoice-detail-reprice'
+            ), #post new unit prices for many details
+    ]
+
+urlpatterns = invoice_urlpatterns(async_views=settings.ASYNC_VIEWS)
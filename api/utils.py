@@ -1,6 +1,96 @@
+import hashlib
+from decimal import Decimal
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.response import Response
 from rest_framework import status
 
+from .metrics import label_response
+
+
+CENT = Decimal('0.01')
+
+
+def to_amount(value) -> Decimal:
+    """
+    Converts a price into a `Decimal` rounded to cents, the way it is stored in the database.
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return value.quantize(CENT)
+
+
+class PreconditionFailed(Exception):
+    """
+    Raised when a conditional write finds that the resource changed since the client last retrieved it.
+    """
+
+
+def compute_etag(*parts) -> str:
+    """
+    Returns a strong ETag made of the given parts, which must change whenever the response changes.
+    """
+    digest = hashlib.md5(":".join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+    return f'"{digest}"'
+
+
+def invoice_etag(invoice, fieldset: tuple = None) -> str:
+    """
+    Returns the ETag of a single invoice, given as an `Invoice` or a dictionary of its values.
+    Every write of the invoice or its details bumps `updated_at`.
+    A sparse representation, given by its fieldset, has an ETag of its own, the full one has the ETag updates are checked against.
+    """
+    parts = () if fieldset is None else (fieldset,)
+    if isinstance(invoice, dict):
+        return compute_etag(invoice['id'], invoice['updated_at'].isoformat(), *parts)
+    return compute_etag(invoice.id, invoice.updated_at.isoformat(), *parts)
+
+
+def set_validators(response: Response, etag: str, last_modified=None) -> Response:
+    """
+    Adds the `ETag` and `Last-Modified` headers to a response.
+
+    Args:
+        response (Response): The response to add the headers to.
+        etag (str): The ETag of the response.
+        last_modified (datetime, optional): When the returned data last changed.
+
+    Returns:
+        Response: The same response.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def conditional_response(request, resource: str, action: str, etag: str, last_modified=None):
+    """
+    Evaluates the conditional headers of a request (`If-None-Match`, `If-Modified-Since`, `If-Match`
+    and `If-Unmodified-Since`) against the current ETag and modification date of the resource.
+
+    Args:
+        request (Request): The request to evaluate.
+        resource (str): The type of resource involved, used in the message of a failed precondition.
+        action (str): The action performed on the resource, used in the message of a failed precondition.
+        etag (str): The current ETag of the resource.
+        last_modified (datetime, optional): When the resource last changed.
+
+    Returns:
+        Response: A `304 Not Modified` or `412 Precondition Failed` response, or None if the request should be processed.
+    """
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified is not None else None
+    )
+    if response is None:
+        return None
+    if response.status_code == status.HTTP_304_NOT_MODIFIED:
+        return label_response(set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified), resource, action)
+    return CustomResponse(resource, action).precondition_failed_response()
+
 
 class CustomResponse:
     """
@@ -40,14 +130,14 @@ class CustomResponse:
             "additional_message": self.additional_message
         } if self.additional_message else general_message
 
-        return Response({
+        return label_response(Response({
             "error": self.error,
             "resource": self.resource,
             "action": self.action,
             "message": self.message,
             "data": self.data,
             "status_code": self.status_code
-        }, status=self.status_code)
+        }, status=self.status_code), self.resource, self.action)
 
     def success_response(self, message: str = None):
         """
@@ -97,4 +187,15 @@ class CustomResponse:
             error=True, 
             general_message=f"{self.resource} object not found" if not message else message, 
             status_code=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+
+    def precondition_failed_response(self, message: str = None):
+        """
+        Returns a precondition failed response indicating the resource changed since the client last retrieved it.
+        The message can be overridden with a custom message.
+        """
+        return self.generate_response(
+            error=True,
+            general_message=f"{self.resource} object has been modified since it was last retrieved" if not message else message,
+            status_code=status.HTTP_412_PRECONDITION_FAILED
+            )
@@ -1,14 +1,226 @@
+import codecs
+import os
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Max
 
-from .serializer import InvoiceSerializer, InvoiceDetailSerializer
+from .serializer import (
+    INVOICE_FIELDS, InvoiceSerializer, InvoiceDetailSerializer, InvoiceDetailRepriceSerializer, InvoiceBulkDeleteSerializer,
+    duplicate_invoice_error, find_duplicate_invoices, invoice_detail_rows, represent_invoices
+)
 from .models import Invoice, InvoiceDetail
-from .utils import CustomResponse
+from .utils import CustomResponse, PreconditionFailed, compute_etag, conditional_response, invoice_etag, set_validators
+from .pagination import InvoiceCursorPagination, InvalidCursor
+from .search import index_invoices, remove_search_documents
+from .purge import invoices_to_purge, purge_invoices
+from .repricing import RepricingError, details_to_reprice, reprice_invoice_details
+from .reports import RollupChanges, invoice_details_of, month_row, revenue_report, top_items_report
+from .filters import FULL_FIELDSET, filter_invoices, InvalidFilter, parse_fieldset, parse_limit, parse_month
+from .export import export_csv, export_ndjson
+from .importer import IMPORT_FORMATS, ImportFileError, InvoiceImporter, read_invoices
+from .cache import invoice_list_cache, invalidates_invoice_list
+from .database import retries_when_locked, write_coalescer
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, label_response, metrics_registry
+
+def save_invoice(serializer: InvoiceSerializer) -> Response:
+    """
+    Saves a new invoice from a validated serializer and returns the response of its creation.
+    The write helpers are shared by the synchronous and asynchronous views, which run them in a worker thread.
+    """
+    try:
+        serializer.save()
+    except ValidationError as error:
+        return CustomResponse("invoice", "creation", data=error.detail).failure_response()
+    return CustomResponse("invoice", "creation", data=serializer.data).created_response()
+
+def save_invoice_update(serializer: InvoiceSerializer) -> Response:
+    """
+    Saves an updated invoice from a validated serializer and returns the response of its update.
+    """
+    try:
+        serializer.save()
+    except PreconditionFailed:
+        return CustomResponse("invoice", "update").precondition_failed_response()
+    except ValidationError as error:
+        return CustomResponse("invoice", "update", data=error.detail).failure_response()
+    return set_validators(
+        CustomResponse("invoice", "update", data=serializer.data).success_response(),
+        invoice_etag(serializer.instance),
+        serializer.instance.updated_at
+    )
+
+def delete_invoice(invoice: Invoice) -> Response:
+    """
+    Deletes an invoice along with its details and search document.
+    """
+    with transaction.atomic():
+        invoice_id = invoice.id
+        rollups = RollupChanges()
+        rollups.remove(invoice.customer_name, invoice.invoice_date, invoice_details_of([invoice_id])[invoice_id])
+        invoice.delete()
+        remove_search_documents([invoice_id])
+        rollups.save()
+    return CustomResponse("invoice", "deletion").success_response()
+
+def save_invoice_detail(serializer: InvoiceDetailSerializer, invoice: Invoice) -> Response:
+    """
+    Adds a new detail to an invoice from a validated serializer.
+    The small writes of the invoice details go through the write coalescer, which commits concurrent ones together.
+    """
+    def write():
+        serializer.save(invoice=invoice)
+        index_invoices([invoice.id])
+    write_coalescer.run(write)
+    return CustomResponse("invoice detail", "creation", data=serializer.data).created_response()
+
+def save_invoice_detail_update(serializer: InvoiceDetailSerializer) -> Response:
+    """
+    Saves an updated invoice detail from a validated serializer.
+    """
+    def write():
+        serializer.save()
+        index_invoices([serializer.instance.invoice_id])
+    write_coalescer.run(write)
+    return CustomResponse("invoice detail", "update", data=serializer.data).success_response()
+
+def delete_invoice_detail(invoice_detail: InvoiceDetail) -> Response:
+    """
+    Deletes an invoice detail and takes it out of the totals of its invoice.
+    """
+    with transaction.atomic():
+        invoice_detail.delete()
+        Invoice.objects.filter(id=invoice_detail.invoice_id).change_lines(-invoice_detail.price, -1, -invoice_detail.quantity)
+        index_invoices([invoice_detail.invoice_id])
+        rollups = RollupChanges()
+        rollups.remove(invoice_detail.invoice.customer_name, invoice_detail.invoice.invoice_date, [invoice_detail])
+        rollups.save()
+    return CustomResponse("invoice detail", "deletion").success_response()
 
-class InvoiceAPIView(APIView):
+class InvoiceListMixin:
+    """
+    Builds the invoice list, shared by the synchronous and asynchronous invoice views.
+    Everything here runs without touching the database, the views run the queries themselves
+    with the synchronous or the asynchronous ORM.
+    """
+    sort_by_fields = {
+        "customer": "customer_name",
+        "date": "invoice_date",
+        "total": "total_amount",
+        "description": "first_description",
+        "price": "max_price",
+        "quantity": "total_quantity",
+        "unit_price": "max_unit_price",
+        "relevance": "search_document__rank"
+    }
+
+    page_number_pagination_class = PageNumberPagination
+
+    def cached_list_response(self, request, cache_key: str):
+        """
+        Returns the cached response of a list request, or None if it is not cached.
+        """
+        cached = invoice_list_cache.get(cache_key)
+        if cached is None:
+            return None
+        response = conditional_response(request, "invoice", "retrieval", cached["etag"], cached["last_modified"])
+        if response is None:
+            response = label_response(
+                set_validators(Response(cached["data"]), cached["etag"], cached["last_modified"]), "invoice", "retrieval"
+            )
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def get_list_queryset(self, request, fields: tuple = INVOICE_FIELDS) -> tuple:
+        """
+        Returns the filtered and sorted invoices of a list request, as a query of dictionaries of their values,
+        along with the paginator of its pages.
+        Only the requested fields are selected, along with the id and update date the ETag is made of.
+
+        Raises:
+            InvalidFilter: If a filter is not valid, or relevance sorting is combined with cursor pagination.
+        """
+        search_query = request.query_params.get('search', None)
+        invoices = filter_invoices(Invoice.objects.all(), request.query_params)
+        ordering_field, descending = self.get_ordering(request.query_params.get('sort'), searching=bool(search_query))
+
+        if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+            if ordering_field == self.sort_by_fields["relevance"]:
+                raise InvalidFilter("sorting by relevance is not supported with cursor pagination")
+            # the cursors are made of the sort field of the invoices
+            columns = dict.fromkeys((*fields, 'id', 'updated_at', ordering_field))
+            return invoices.values(*columns), InvoiceCursorPagination(ordering_field, descending)
+
+        invoices = invoices.values(*dict.fromkeys((*fields, 'id', 'updated_at')))
+        if request.query_params.get('sort'):
+            invoices = invoices.order_by(f"-{ordering_field}" if descending else ordering_field)
+        paginator = self.page_number_pagination_class()
+        paginator.page_size = 10
+        return invoices, paginator
+
+    def list_response(self, paginator, page: list, details: list, etag: str, last_modified, cache_key: str,
+                      fieldset: tuple = FULL_FIELDSET) -> Response:
+        """
+        Returns the response of a page of invoices along with the rows of their details, and caches it.
+        """
+        response = label_response(set_validators(paginator.get_paginated_response({
+            "message": "successfully retrieved invoices",
+            "data": represent_invoices(page, details, *fieldset)
+            }), etag, last_modified), "invoice", "retrieval")
+        invoice_list_cache.set(cache_key, {"data": response.data, "etag": etag, "last_modified": last_modified})
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_list_etag(self, request, paginator, page) -> str:
+        """
+        Returns the ETag of a page of invoices.
+        It covers everything the response is made of: the request, the links to the other pages,
+        the total count of invoices and the version of every invoice on the page.
+
+        Args:
+            request (Request): The request for the page.
+            paginator (PageNumberPagination | InvoiceCursorPagination): The paginator that produced the page.
+            page (list): The invoices on the page.
+
+        Returns:
+            str: The strong ETag of the page.
+        """
+        count = paginator.page.paginator.count if isinstance(paginator, PageNumberPagination) else None
+        return compute_etag(
+            request.get_full_path(),
+            paginator.get_next_link(),
+            paginator.get_previous_link(),
+            count,
+            *(f"{invoice['id']}@{invoice['updated_at'].isoformat()}" for invoice in page)
+        )
+
+    def get_ordering(self, sort_by, searching=False):
+        """
+        Maps the sort query parameter to the field the invoices are sorted by.
+        Unknown sort values, and sorting by relevance without a search, fall back to the newest invoices first.
+
+        Args:
+            sort_by (str): The sort query parameter, prefixed with "-" for descending order.
+            searching (bool, optional): Whether the invoices are filtered by a search. Defaults to False.
+
+        Returns:
+            tuple: The field to sort by and whether the order is descending.
+        """
+        if not sort_by:
+            return 'invoice_date', True
+        descending = sort_by.startswith("-")
+        ordering_field = self.sort_by_fields.get(sort_by[1:] if descending else sort_by)
+        if not ordering_field or (ordering_field == self.sort_by_fields["relevance"] and not searching):
+            return 'invoice_date', True
+        return ordering_field, descending
+
+class InvoiceAPIView(InvoiceListMixin, APIView):
     """
     API endpoint that allows invoices to be created and retrieved.
     The following methods have been implemented:
@@ -19,54 +231,61 @@ class InvoiceAPIView(APIView):
             : the invoice date will be automatically set to the current date if not entered in the request body
 
     - get   : retrieve all invoices
-            : returns a list of all invoices which contains the customer name, invoice date and entire invoice details
+            : returns a list of all invoices which contains the customer name, invoice date, total amount, number of lines and entire invoice details
             : the list can be filtered using the search and sort query parameters
+            : the list can also be filtered by the total amount of the invoices using the min_total and max_total query parameters
+            : and by the invoice date using the date_from and date_to query parameters (YYYY-MM-DD, both included)
+            : and by the creation time using the created_since query parameter (ISO 8601 date and time or YYYY-MM-DD, included)
+            : the date filters are range scans of the invoice_date and created_at indexes
             : search can be done using the customer name or invoice detail description 
-            : sort can be done using the customer name, invoice date, description, price, quantity or unit price
+            : search uses a full-text index and matches the words of the customer name and descriptions starting with each searched word
+            : sort can be done using the customer name, invoice date, total amount, description, price, quantity or unit price
+            : sorting by the invoice detail fields uses one value per invoice: the first description in alphabetical order,
+              the highest price, the total quantity or the highest unit price of its details
+            : sort=relevance orders the results of a search with the best matches first
             : the list is paginated and returns 10 items per page
+            : send pagination=cursor to get cursor based pages instead of numbered pages
+            : cursor based pages follow the opaque next and previous links and skip counting all the invoices
+            : cursor based pages can be sorted by every field except relevance
+            : every page carries an ETag and a Last-Modified header (the newest update of the filtered invoices)
+            : send them back as If-None-Match or If-Modified-Since to get an empty 304 response when nothing changed
+            : responses are cached for a short time and the cache is cleared by every write, the X-Cache header tells whether it was used
+            : fields=customer_name,invoice_date returns only the listed invoice fields, without the invoice details
+            : include=details adds the invoice details back, their query is skipped when they are not returned
 
     """
+    @invalidates_invoice_list
+    @retries_when_locked
     def post(self, request):
         serializer = InvoiceSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            serializer.save()
-            return CustomResponse("invoice", "creation", data=serializer.data).created_response()
+            return save_invoice(serializer)
         return CustomResponse("invoice", "creation", data=serializer.errors).failure_response()
     
     def get(self, request):
-        invoices = Invoice.objects.all().prefetch_related('invoice_details')
-        search_query = request.query_params.get('search', None)
-        if search_query:
-            invoices = invoices.filter(
-                Q(customer_name__icontains=search_query) | 
-                Q (invoice_details__description__icontains=search_query)
-                   ).distinct().prefetch_related('invoice_details')
-            
-        sort_by_fields = {
-            "customer": "customer_name",
-            "date": "invoice_date",
-            "description": "invoice_details__description",
-            "price": "invoice_details__price",
-            "quantity": "invoice_details__quantity",
-            "unit_price": "invoice_details__unit_price"
-        }
-        sort_by = request.query_params.get('sort')
-        if sort_by:
-            if sort_by.startswith("-"):
-                sort_by = f"-{sort_by_fields.get(sort_by[1:], 'invoice_date')}"
-            else:
-                sort_by = sort_by_fields.get(sort_by, '-invoice_date')
-            invoices = invoices.order_by(sort_by)
+        # the key is taken before the invoices are read, so a response built from data older than a write is never stored under a newer generation
+        cache_key = invoice_list_cache.key(request)
+        response = self.cached_list_response(request, cache_key)
+        if response is not None:
+            return response
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 10
-        paginated_queryset = paginator.paginate_queryset(invoices, request)
+        try:
+            fieldset = parse_fieldset(request.query_params)
+            invoices, paginator = self.get_list_queryset(request, fieldset[0])
+            paginated_queryset = paginator.paginate_queryset(invoices, request)
+        except (InvalidFilter, InvalidCursor) as error:
+            return CustomResponse("invoice", "retrieval").failure_response(message=str(error))
 
-        serializer = InvoiceSerializer(paginated_queryset, many=True)
-        return paginator.get_paginated_response({
-            "message": "successfully retrieved invoices",
-            "data": serializer.data
-            })
+        # the page is validated before its details are fetched and serialized, so a 304 skips both
+        last_modified = invoices.aggregate(newest=Max('updated_at'))['newest']
+        etag = self.get_list_etag(request, paginator, paginated_queryset)
+        response = conditional_response(request, "invoice", "retrieval", etag, last_modified)
+        if response is not None:
+            return response
+
+        # without the details, their query is skipped altogether
+        details = list(invoice_detail_rows([invoice['id'] for invoice in paginated_queryset])) if fieldset[1] else []
+        return self.list_response(paginator, paginated_queryset, details, etag, last_modified, cache_key, fieldset)
 
 class SingleInvoiceAPIView(APIView):
     """
@@ -75,10 +294,15 @@ class SingleInvoiceAPIView(APIView):
 
     - get : returns a single invoice containing the customer name, invoice date and entire invoice details by using the invoice id
           : is useful for retrieving a single invoice for viewing or updating
+          : the response carries an ETag and a Last-Modified header, send them back as If-None-Match or If-Modified-Since
+            to get an empty 304 response when the invoice has not changed
+          : accepts the fields and include query parameters of the invoice list
     
     - put    : update an existing invoice
              : enter the the customer name, invoice date and entire invoice details in the request body
              : note that the entire previous invoice details will be replaced with the new details
+             : a detail sent with the id of an existing detail, or else with its description, updates that detail in place
+             : and keeps its id, only the details that changed are written and the ones left out are deleted
              : remember that invoice date has to be manually updated if required and doesn't happen automatically
              : this means that the invoice date will not be updated if it is not entered in the request body
 
@@ -88,42 +312,71 @@ class SingleInvoiceAPIView(APIView):
              : remember that invoice date has to be manually updated if needed and doesn't happen automatically
              : this means that the invoice date will not be updated if it is not entered in the request body
 
+    - put and patch accept an If-Match header with the ETag of the invoice, the update is refused with a 412
+      if the invoice has been modified since that ETag was retrieved
+
     - delete : delete an existing invoice
 
     """
     def get(self, request, invoice_id):
-        if not Invoice.objects.filter(id=invoice_id).exists():
+        try:
+            fieldset = parse_fieldset(request.query_params)
+        except InvalidFilter as error:
+            return CustomResponse("invoice", "retrieval").failure_response(message=str(error))
+        invoice = Invoice.objects.filter(id=invoice_id).values(*dict.fromkeys((*fieldset[0], 'id', 'updated_at'))).first()
+        if invoice is None:
             return CustomResponse("invoice", "retrieval").not_found_response()
-        invoice = Invoice.objects.get(id=invoice_id)
-        serializer = InvoiceSerializer(invoice)
-        return CustomResponse("invoice", "retrieval", data=serializer.data).success_response()
+        etag = invoice_etag(invoice, None if fieldset == FULL_FIELDSET else fieldset)
+        response = conditional_response(request, "invoice", "retrieval", etag, invoice['updated_at'])
+        if response is not None:
+            return response
+        details = invoice_detail_rows([invoice['id']]) if fieldset[1] else []
+        data = represent_invoices([invoice], details, *fieldset)[0]
+        return set_validators(
+            CustomResponse("invoice", "retrieval", data=data).success_response(), etag, invoice['updated_at']
+        )
     
+    @invalidates_invoice_list
+    @retries_when_locked
     def put(self, request, invoice_id):
-        if not Invoice.objects.filter(id=invoice_id).exists():
-            return CustomResponse("invoice", "update").not_found_response()
-        invoice = Invoice.objects.get(id=invoice_id)
-        serializer = InvoiceSerializer(invoice, data=request.data, context={"request": request})
-        if serializer.is_valid():
-            serializer.save()
-            return CustomResponse("invoice", "update", data=serializer.data).success_response()
-        return CustomResponse("invoice", "update", data=serializer.errors).failure_response()
+        return self.update(request, invoice_id, partial=False)
     
+    @invalidates_invoice_list
+    @retries_when_locked
     def patch(self, request, invoice_id):
-        if not Invoice.objects.filter(id=invoice_id).exists():
+        return self.update(request, invoice_id, partial=True)
+
+    def update(self, request, invoice_id, partial):
+        """
+        Updates an invoice, honouring the If-Match and If-Unmodified-Since headers for optimistic concurrency.
+        The precondition is checked again inside the write transaction, so a concurrent update cannot slip in between.
+
+        Args:
+            request (Request): The put or patch request.
+            invoice_id (str): The id of the invoice to update.
+            partial (bool): Whether fields can be left out of the request body.
+        """
+        invoice = Invoice.objects.filter(id=invoice_id).first()
+        if invoice is None:
             return CustomResponse("invoice", "update").not_found_response()
-        invoice = Invoice.objects.get(id=invoice_id)
-        serializer = InvoiceSerializer(invoice, data=request.data, partial=True, context={"request": request})
+        response = conditional_response(request, "invoice", "update", invoice_etag(invoice), invoice.updated_at)
+        if response is not None:
+            return response
+        context = {"request": request}
+        if 'HTTP_IF_MATCH' in request.META or 'HTTP_IF_UNMODIFIED_SINCE' in request.META:
+            context["expected_updated_at"] = invoice.updated_at
+        serializer = InvoiceSerializer(invoice, data=request.data, partial=partial, context=context)
         if serializer.is_valid():
-            serializer.save()
-            return CustomResponse("invoice", "update", data=serializer.data).success_response()
+            return save_invoice_update(serializer)
         return CustomResponse("invoice", "update", data=serializer.errors).failure_response()
     
+    @invalidates_invoice_list
+    @retries_when_locked
     def delete(self, request, invoice_id):
-        if not Invoice.objects.filter(id=invoice_id).exists():
+        invoice = Invoice.objects.filter(id=invoice_id).first()
+        if invoice is None:
             return CustomResponse("invoice", "deletion").not_found_response()
-        invoice = Invoice.objects.get(id=invoice_id)
-        invoice.delete()
-        return CustomResponse("invoice", "deletion").success_response()
+        return delete_invoice(invoice)
 
 class InvoiceDetailEditAPIView(APIView):
     """
@@ -137,23 +390,25 @@ class InvoiceDetailEditAPIView(APIView):
     - delete : delete an existing invoice detail
 
     """
+    @invalidates_invoice_list
+    @retries_when_locked
     def patch(self, request, invoice_detail_id):
-        if not InvoiceDetail.objects.filter(id=invoice_detail_id).exists():
+        invoice_detail = InvoiceDetail.objects.filter(id=invoice_detail_id).first()
+        if invoice_detail is None:
             return CustomResponse("invoice detail", "update").not_found_response()
         
-        invoice_detail = InvoiceDetail.objects.get(id=invoice_detail_id)
         serializer = InvoiceDetailSerializer(invoice_detail, data=request.data, partial=True, context={"request": request})
         if serializer.is_valid():
-            serializer.save()
-            return CustomResponse("invoice detail", "update", data=serializer.data).success_response()
+            return save_invoice_detail_update(serializer)
         return CustomResponse("invoice detail", "update", data=serializer.errors).failure_response()
 
+    @invalidates_invoice_list
+    @retries_when_locked
     def delete(self, request, invoice_detail_id):
-        if not InvoiceDetail.objects.filter(id=invoice_detail_id).exists():
+        invoice_detail = InvoiceDetail.objects.filter(id=invoice_detail_id).first()
+        if invoice_detail is None:
             return CustomResponse("invoice detail", "deletion").not_found_response()
-        invoice_detail = InvoiceDetail.objects.get(id=invoice_detail_id)
-        invoice_detail.delete()
-        return CustomResponse("invoice detail", "deletion").success_response()
+        return delete_invoice_detail(invoice_detail)
     
 class InvoiceDetailCreateAPIView(APIView):
     """
@@ -166,17 +421,320 @@ class InvoiceDetailCreateAPIView(APIView):
              : this method is used to add new details to an existing invoice
              
     """
+    @invalidates_invoice_list
+    @retries_when_locked
     def post(self, request, invoice_id):
-        if not Invoice.objects.filter(id=invoice_id).exists():
+        invoice = Invoice.objects.filter(id=invoice_id).first()
+        if invoice is None:
             return CustomResponse(
                 "invoice detail", 
                 "creation"
                 ).not_found_response(
                     message="invoice object not found - invalid invoice id"
                 )
-        invoice = Invoice.objects.get(id=invoice_id)
         serializer = InvoiceDetailSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            serializer.save(invoice=invoice)
-            return CustomResponse("invoice detail", "creation", data=serializer.data).created_response()
-        return CustomResponse("invoice detail", "creation", data=serializer.errors).failure_response()
\ No newline at end of file
+            return save_invoice_detail(serializer, invoice)
+        return CustomResponse("invoice detail", "creation", data=serializer.errors).failure_response()
+
+class InvoiceDetailRepriceAPIView(APIView):
+    """
+    API endpoint that changes the unit price of many invoice details at once.
+    The following method has been implemented:
+
+    - post   : set a new unit price on the invoice details matching the filters, and recompute their prices
+             : filter with description, customer_name, date_from and date_to (YYYY-MM-DD, invoice dates, both included),
+               at least one of them is required
+             : send either unit_price, the new unit price of every detail, or percent, a change of their current
+               unit price, e.g. -10 for 10% off
+             : send dry_run=true to only get the number of matching details and the change of the invoice totals
+             : the request is refused when more details match than max_rows, or than the REPRICE_MAX_ROWS setting
+             : the details, the totals of their invoices and the report rollups are updated by a few statements
+               in a single transaction, whatever the number of details
+
+    """
+    @invalidates_invoice_list
+    @retries_when_locked
+    def post(self, request):
+        serializer = InvoiceDetailRepriceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return CustomResponse("invoice detail", "repricing", data=serializer.errors).failure_response()
+        data = serializer.validated_data
+        details = details_to_reprice(data.get('description'), data.get('customer_name'), data.get('date_from'), data.get('date_to'))
+        try:
+            result = reprice_invoice_details(
+                details,
+                unit_price=data.get('unit_price'),
+                percent=data.get('percent'),
+                max_rows=min(data.get('max_rows', settings.REPRICE_MAX_ROWS), settings.REPRICE_MAX_ROWS),
+                dry_run=data['dry_run']
+            )
+        except RepricingError as error:
+            return CustomResponse("invoice detail", "repricing").failure_response(message=str(error))
+        return CustomResponse("invoice detail", "repricing", data=result).success_response()
+
+class InvoiceBulkCreateAPIView(APIView):
+    """
+    API endpoint that allows many invoices to be created in a single request.
+    The following method has been implemented:
+
+    - post   : create many new invoices at once
+             : enter a list of invoices in the request body, each in the same format as the invoice-create endpoint
+             : every invoice is validated on its own and the result of each one is reported in the order it was sent
+             : all the valid invoices and their details are inserted together in a single transaction
+             : invalid invoices are skipped and do not stop the valid ones from being created
+
+    """
+    @invalidates_invoice_list
+    @retries_when_locked
+    def post(self, request):
+        if not isinstance(request.data, list) or not request.data:
+            return CustomResponse(
+                "invoice",
+                "bulk creation"
+                ).failure_response(
+                    message="request body must be a non-empty list of invoices"
+                )
+
+        # a single child serializer validates every item, so its fields are only built once per request
+        serializer = InvoiceSerializer(many=True, context={"request": request})
+        results = [None] * len(request.data)
+        valid_invoices = {}
+        for index, invoice_data in enumerate(request.data):
+            try:
+                valid_invoices[index] = serializer.child.run_validation(invoice_data)
+            except ValidationError as error:
+                results[index] = {"index": index, "error": True, "errors": error.detail}
+
+        for index, invoice_id in find_duplicate_invoices(valid_invoices).items():
+            valid_invoices.pop(index)
+            results[index] = {"index": index, "error": True, "errors": duplicate_invoice_error(invoice_id)}
+
+        if not valid_invoices:
+            return CustomResponse(
+                "invoice",
+                "bulk creation",
+                data={"created": 0, "failed": len(results), "results": results}
+                ).failure_response()
+
+        try:
+            invoices = serializer.create(list(valid_invoices.values()))
+        except IntegrityError:
+            return CustomResponse(
+                "invoice",
+                "bulk creation"
+                ).failure_response(
+                    message="some of the invoices were created by another request at the same time, retry the request"
+                )
+        for index, invoice in zip(valid_invoices, invoices):
+            results[index] = {"index": index, "error": False, "id": str(invoice.id)}
+
+        return CustomResponse(
+            "invoice",
+            "bulk creation",
+            data={"created": len(invoices), "failed": len(results) - len(invoices), "results": results}
+            ).created_response(
+                message=f"Successfully created {len(invoices)} of {len(results)} invoices"
+            )
+
+class InvoiceBulkDeleteAPIView(APIView):
+    """
+    API endpoint that deletes many invoices at once.
+    The following method has been implemented:
+
+    - post   : delete the invoices matching the filters, along with their invoice details
+             : filter with customer_name, date_from and date_to (YYYY-MM-DD, invoice dates, both included),
+               at least one of them is required
+             : send dry_run=true to only get the number of matching invoices and invoice details
+             : the invoices are deleted in chunks of 500, each in its own transaction with a few set-based statements,
+               the details go with them through the ON DELETE CASCADE of the database
+             : use the delete_invoices command for very large deletions, it reports its progress after every chunk
+
+    """
+    @invalidates_invoice_list
+    @retries_when_locked
+    def post(self, request):
+        serializer = InvoiceBulkDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return CustomResponse("invoice", "bulk deletion", data=serializer.errors).failure_response()
+        data = serializer.validated_data
+        invoices = invoices_to_purge(data.get('customer_name'), data.get('date_from'), data.get('date_to'))
+        result = purge_invoices(invoices, dry_run=data['dry_run'])
+        return CustomResponse("invoice", "bulk deletion", data=result).success_response()
+
+class InvoiceListCacheStatsAPIView(APIView):
+    """
+    API endpoint that reports how well the invoice list cache performs.
+    The following method has been implemented:
+
+    - get    : returns the number of cache hits and misses of the serving process, the hit rate
+               and the maximum number of entries and time to live of the cache
+             : is useful for sizing the cache
+
+    """
+    def get(self, request):
+        return CustomResponse("invoice list cache", "retrieval", data=invoice_list_cache.stats()).success_response()
+
+def report_months(request) -> tuple:
+    """
+    Returns the first and last months of a report request, either of them None when it is not bounded.
+
+    Raises:
+        InvalidFilter: If a month is not in the YYYY-MM format.
+    """
+    return tuple(
+        parse_month(param, request.query_params[param]) if request.query_params.get(param) else None
+        for param in ('month_from', 'month_to')
+    )
+
+class RevenueReportAPIView(APIView):
+    """
+    API endpoint that reports the revenue of every customer per month.
+    The following method has been implemented:
+
+    - get    : returns the revenue, quantity and number of invoice lines of each customer in each month
+               of the invoice dates, the latest month first and the highest revenue first within a month
+             : month_from and month_to (YYYY-MM, both included) bound the months, customer keeps a single customer
+             : read from rollups kept up to date by every write, so the cost follows the number of rows returned
+               rather than the number of invoice details
+             : the report is paginated and returns 100 rows per page
+
+    """
+    def get(self, request):
+        try:
+            month_from, month_to = report_months(request)
+        except InvalidFilter as error:
+            return CustomResponse("report", "retrieval").failure_response(message=str(error))
+        paginator = PageNumberPagination()
+        paginator.page_size = 100
+        rows = paginator.paginate_queryset(revenue_report(month_from, month_to, request.query_params.get('customer')), request)
+        return label_response(paginator.get_paginated_response({
+            "message": "successfully retrieved the revenue report",
+            "data": [month_row(row) for row in rows]
+            }), "report", "retrieval")
+
+class TopItemsReportAPIView(APIView):
+    """
+    API endpoint that reports the items sold in the largest quantities.
+    The following method has been implemented:
+
+    - get    : returns the items, by invoice detail description, with the highest total quantity over a range of months,
+               along with their revenue and number of invoice lines
+             : month_from and month_to (YYYY-MM, both included) bound the months, limit sets the number of items (10, at most 100)
+             : read from rollups kept up to date by every write
+
+    """
+    def get(self, request):
+        try:
+            month_from, month_to = report_months(request)
+            limit = parse_limit('limit', request.query_params['limit'], 100) if 'limit' in request.query_params else 10
+        except InvalidFilter as error:
+            return CustomResponse("report", "retrieval").failure_response(message=str(error))
+        return CustomResponse("report", "retrieval", data=top_items_report(month_from, month_to, limit)).success_response()
+
+class MetricsAPIView(APIView):
+    """
+    API endpoint that exposes the request metrics for Prometheus.
+    The following method has been implemented:
+
+    - get    : returns the latency histogram, the request count and the error count of every resource and action
+               in the Prometheus text format, e.g. ("invoice", "retrieval") or ("invoice detail", "creation")
+             : the metrics of every worker of the server are added up when the METRICS_DIR setting is set
+             : is useful for alerting on the 99th percentile latency of each operation
+
+    """
+    def get(self, request):
+        return label_response(HttpResponse(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE), "metrics", "retrieval")
+
+class FileFormatAPIView(APIView):
+    """
+    Base of the endpoints taking a `format` query parameter that names a file format,
+    which DRF would otherwise take for the name of a renderer and answer with a 404.
+    """
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(request, force=True)
+
+class InvoiceExportAPIView(FileFormatAPIView):
+    """
+    API endpoint that exports every invoice in a single streamed response.
+    The following method has been implemented:
+
+    - get    : returns all the invoices with their invoice details, without pagination
+             : send format=ndjson (default) to get one JSON invoice per line, in the same format as the other endpoints
+             : send format=csv to get one row per invoice detail, with the invoice columns repeated on each row
+             : the invoices can be filtered with the same search, min_total, max_total, date_from, date_to and created_since query parameters
+               as the invoice list
+             : the invoices are sorted by invoice date and id, and streamed in batches so the memory used does not grow with the number of invoices
+
+    """
+    export_formats = {
+        "ndjson": (export_ndjson, "application/x-ndjson"),
+        "csv": (export_csv, "text/csv"),
+    }
+
+    def get(self, request):
+        export_format = request.query_params.get('format', 'ndjson')
+        if export_format not in self.export_formats:
+            return CustomResponse("invoice", "export").failure_response(
+                message=f"format must be one of {', '.join(self.export_formats)}"
+            )
+        try:
+            invoices = filter_invoices(Invoice.objects.all(), request.query_params)
+        except InvalidFilter as error:
+            return CustomResponse("invoice", "export").failure_response(message=str(error))
+
+        export, content_type = self.export_formats[export_format]
+        response = StreamingHttpResponse(export(invoices.order_by('invoice_date', 'id')), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="invoices.{export_format}"'
+        return label_response(response, "invoice", "export")
+
+class InvoiceImportAPIView(FileFormatAPIView):
+    """
+    API endpoint that imports invoices from an uploaded file.
+    The following method has been implemented:
+
+    - post   : import the invoices of a CSV or NDJSON file, in the format written by the invoice export
+             : upload the file as the file field of a multipart request
+             : the format is taken from the format query parameter, or from the extension of the file name
+             : csv files need the customer_name, description, quantity and unit_price columns, invoice_date is optional,
+               consecutive rows with the same invoice_id, or customer name and invoice date, are one invoice
+             : every invoice is validated like in the invoice-create endpoint and the invalid ones are reported by row number
+             : the file is imported in batches of one transaction each, for very large files use the import_invoices command
+
+    """
+    max_reported_errors = 100
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return CustomResponse("invoice", "import").failure_response(
+                message="upload the invoices as the file field of a multipart request"
+            )
+        import_format = request.query_params.get('format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if import_format not in IMPORT_FORMATS:
+            return CustomResponse("invoice", "import").failure_response(
+                message=f"format must be one of {', '.join(IMPORT_FORMATS)}"
+            )
+
+        errors = []
+        def report_error(error):
+            if len(errors) < self.max_reported_errors:
+                errors.append(error)
+
+        importer = InvoiceImporter(on_error=report_error)
+        try:
+            importer.run(read_invoices(codecs.iterdecode(upload, 'utf-8-sig'), import_format))
+        except (ImportFileError, UnicodeDecodeError) as error:
+            return CustomResponse("invoice", "import").failure_response(message=f"cannot read the file: {error}")
+
+        data = {
+            "imported_invoices": importer.imported_invoices,
+            "imported_lines": importer.imported_lines,
+            "failed_rows": importer.failed_rows,
+            "errors": errors
+        }
+        if not importer.imported_invoices:
+            return CustomResponse("invoice", "import", data=data).failure_response()
+        return CustomResponse("invoice", "import", data=data).created_response(
+            message=f"Successfully imported {importer.imported_invoices} invoices with {importer.imported_lines} invoice details"
+        )
@@ -1,9 +1,23 @@
 import sqlite3
 import uuid
 
+def add_missing_columns(cursor, table, columns):
+    """
+    Adds the given columns to an existing table if they are not there yet.
+
+    Args:
+        cursor (sqlite3.Cursor): A cursor of the SQLite database.
+        table (str): The name of the table.
+        columns (dict): The definition of each column keyed by the column name.
+    """
+    existing_columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
 def create_tables(db_path):
     """
-    Creates the 'invoice' and 'invoice_detail' tables in an SQLite database.
+    Creates the 'invoice' and 'invoice_detail' tables in an SQLite database, along with the search and report tables.
     We use this function to create the tables and not the migrate function of Django to keep a much more tight control on our API.
     Moreover, useless tables are not created in the database.
 
@@ -21,11 +35,43 @@ def create_tables(db_path):
             id TEXT PRIMARY KEY UNIQUE,
             customer_name TEXT NOT NULL,
             invoice_date DATE NOT NULL,
+            total_amount REAL NOT NULL DEFAULT 0,
+            line_count INTEGER NOT NULL DEFAULT 0,
+            total_quantity INTEGER NOT NULL DEFAULT 0,
+            max_price REAL NOT NULL DEFAULT 0,
+            max_unit_price REAL NOT NULL DEFAULT 0,
+            first_description TEXT NOT NULL DEFAULT '',
             created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
             updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
         )
     """)
 
+    # Add the columns introduced after the table was first created to existing databases
+    # run `python manage.py check_invoice_totals --repair` afterwards to fill in the totals
+    add_missing_columns(c, "invoice", {
+        "total_amount": "REAL NOT NULL DEFAULT 0",
+        "line_count": "INTEGER NOT NULL DEFAULT 0",
+        "total_quantity": "INTEGER NOT NULL DEFAULT 0",
+        "max_price": "REAL NOT NULL DEFAULT 0",
+        "max_unit_price": "REAL NOT NULL DEFAULT 0",
+        "first_description": "TEXT NOT NULL DEFAULT ''",
+    })
+
+    # Create the unique index allowing a single invoice per customer and date
+    # this fails on an existing database that already holds duplicate invoices, which have to be merged first
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS invoice_customer_date_uniq ON invoice (customer_name, invoice_date)")
+
+    # Create the indexes used to sort and paginate the invoice list
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_date_id_idx ON invoice (invoice_date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_customer_name_id_idx ON invoice (customer_name, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_total_amount_id_idx ON invoice (total_amount, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_total_quantity_id_idx ON invoice (total_quantity, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_max_price_id_idx ON invoice (max_price, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_max_unit_price_id_idx ON invoice (max_unit_price, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_first_desc_id_idx ON invoice (first_description, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_updated_at_idx ON invoice (updated_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_created_at_idx ON invoice (created_at)")
+
     # Create the 'invoice_detail' table
     c.execute("""
         CREATE TABLE IF NOT EXISTS invoice_detail (
@@ -40,6 +86,38 @@ def create_tables(db_path):
         )
     """)
 
+    # Create the index used to look up the details of an invoice
+    c.execute("CREATE INDEX IF NOT EXISTS invoice_detail_invoice_id_idx ON invoice_detail (invoice_id)")
+
+    # Create the full-text search table, holding one document per invoice
+    # run `python manage.py rebuild_search_index` to fill it for an existing database
+    c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5(
+            invoice_id UNINDEXED,
+            customer_name,
+            descriptions,
+            prefix='2 3'
+        )
+    """)
+
+    # Create the rollup tables of the reports, one row per (customer, month) and per (description, month)
+    # run `python manage.py rebuild_reports` to fill them for an existing database
+    for table, key in (("customer_month_rollup", "customer_name"), ("item_month_rollup", "description")):
+        c.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                {key} TEXT NOT NULL,
+                month DATE NOT NULL,
+                revenue REAL NOT NULL DEFAULT 0,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                line_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS customer_month_rollup_uniq ON customer_month_rollup (customer_name, month)")
+    c.execute("CREATE INDEX IF NOT EXISTS customer_rollup_month_idx ON customer_month_rollup (month, customer_name)")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS item_month_rollup_uniq ON item_month_rollup (description, month)")
+    c.execute("CREATE INDEX IF NOT EXISTS item_rollup_month_idx ON item_month_rollup (month, description)")
+
     conn.commit()
     conn.close()
 
@@ -0,0 +1,32 @@
+import hashlib
+
+# the report rollups are computed from all the details once they are inserted, as `python manage.py rebuild_reports` does
+ROLLUP_SQL = """
+    INSERT INTO {table} ({key}, month, revenue, quantity, line_count)
+    SELECT {source}, date(invoice.invoice_date, 'start of month'), SUM(detail.price), SUM(detail.quantity), COUNT(*)
+    FROM invoice_detail detail JOIN invoice ON invoice.id = detail.invoice_id
+    GROUP BY 1, 2
+"""
+ROLLUPS = (
+    ("customer_month_rollup", "customer_name", "invoice.customer_name"),
+    ("item_month_rollup", "description", "detail.description"),
+)
+
+
+def document_rowid(invoice_id):
+    """
+    Returns the rowid of the search document of an invoice, this has to stay the same as `api.search.document_rowid`.
+    """
+    digest = hashlib.blake2b(str(invoice_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+def compute_rollups(c):
+    """
+    Replaces the rows of the report rollups with the ones computed from all the invoice details.
+
+    Args:
+        c (sqlite3.Cursor): A cursor of the database.
+    """
+    for table, key, source in ROLLUPS:
+        c.execute(f"DELETE FROM {table}")
+        c.execute(ROLLUP_SQL.format(table=table, key=key, source=source))
@@ -0,0 +1,300 @@
+import argparse
+import itertools
+import math
+import random
+import sqlite3
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from create_tables import create_tables
+from derived_data import ROLLUPS, compute_rollups, document_rowid
+
+FIRST_NAMES = (
+    'John', 'Jane', 'Michael', 'Sarah', 'David', 'Emma', 'James', 'Olivia', 'Robert', 'Sophia',
+    'William', 'Isabella', 'Joseph', 'Mia', 'Thomas', 'Amelia', 'Charles', 'Harper', 'Daniel', 'Evelyn',
+    'Matthew', 'Abigail', 'Anthony', 'Emily', 'Mark', 'Elizabeth', 'Paul', 'Sofia', 'Steven', 'Avery',
+)
+LAST_NAMES = (
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Taylor', 'Moore', 'Jackson', 'Martin', 'Lee',
+    'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson', 'Walker',
+)
+ADJECTIVES = (
+    'Steel', 'Copper', 'Plastic', 'Wooden', 'Glass', 'Rubber', 'Ceramic', 'Aluminium', 'Cotton', 'Leather',
+    'Large', 'Small', 'Heavy', 'Compact', 'Premium', 'Basic', 'Industrial', 'Portable', 'Wireless', 'Spare',
+)
+NOUNS = (
+    'Bolt', 'Screw', 'Hinge', 'Cable', 'Bracket', 'Panel', 'Valve', 'Pipe', 'Filter', 'Pump',
+    'Chair', 'Desk', 'Lamp', 'Shelf', 'Cabinet', 'Monitor', 'Keyboard', 'Router', 'Battery', 'Charger',
+    'Gloves', 'Helmet', 'Ladder', 'Drill', 'Hammer', 'Wrench', 'Tape', 'Paint', 'Brush', 'Sealant',
+)
+
+INVOICE_SQL = """
+    INSERT INTO invoice (
+        id, customer_name, invoice_date, total_amount, line_count, total_quantity,
+        max_price, max_unit_price, first_description, created_at, updated_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+DETAIL_SQL = """
+    INSERT INTO invoice_detail (id, invoice_id, description, quantity, unit_price, price, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# the bits of a version 4 UUID that are random and the ones that are set to mark its version and variant
+UUID_RANDOM_BITS = ~(0xf000 << 64 | 0xc000 << 48) & ((1 << 128) - 1)
+UUID_VERSION_BITS = 0x4000 << 64 | 0x8000 << 48
+
+SEARCH_SQL = "INSERT INTO invoice_search (rowid, invoice_id, customer_name, descriptions) VALUES (?, ?, ?, ?)"
+
+
+def zipf_cum_weights(count, exponent):
+    """
+    Returns the cumulative weights of a Zipf distribution over `count` items, the first items being the most frequent.
+    """
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+def customer_name(index):
+    """
+    Returns a distinct customer name for every index.
+    """
+    first, rest = index % len(FIRST_NAMES), index // len(FIRST_NAMES)
+    last, suffix = rest % len(LAST_NAMES), rest // len(LAST_NAMES)
+    name = f"{FIRST_NAMES[first]} {LAST_NAMES[last]}"
+    return f"{name} {suffix + 1}" if suffix else name
+
+class InvoiceGenerator:
+    """
+    Generates a deterministic stream of invoices and invoice details with a realistic skew:
+    a few customers hold most of the invoices, a few products appear on most of the lines,
+    the number of lines per invoice has a long tail and the invoice dates are spread over a range of days.
+    The same seed and parameters always generate the same rows, ids included.
+    """
+    def __init__(self, seed=0, customers=10000, customer_skew=1.0, products=600, product_skew=1.1,
+                 lines_per_invoice=5.0, max_lines=200, start_date=date(2015, 1, 1), days=3650):
+        """
+        Initializes an `InvoiceGenerator` instance.
+
+        Args:
+            seed (int, optional): The seed of the random generator. Defaults to 0.
+            customers (int, optional): The number of distinct customer names. Defaults to 10000.
+            customer_skew (float, optional): The exponent of the Zipf distribution of the customers, 0 for uniform. Defaults to 1.0.
+            products (int, optional): The number of distinct invoice detail descriptions. Defaults to 600.
+            product_skew (float, optional): The exponent of the Zipf distribution of the products, 0 for uniform. Defaults to 1.1.
+            lines_per_invoice (float, optional): The mean number of invoice details per invoice. Defaults to 5.0.
+            max_lines (int, optional): The highest number of invoice details of an invoice. Defaults to 200.
+            start_date (date, optional): The first invoice date. Defaults to 2015-01-01.
+            days (int, optional): The number of days the invoice dates are spread over. Defaults to 3650.
+        """
+        self.random = random.Random(seed)
+        self.customers = customers
+        self.customer_weights = zipf_cum_weights(customers, customer_skew)
+        self.lines_per_invoice = lines_per_invoice
+        self.max_lines = max_lines
+        self.start_date = start_date
+        self.days = days
+
+        names = [f"{adjective} {noun}" for adjective in ADJECTIVES for noun in NOUNS]
+        self.random.shuffle(names)
+        self.products = [
+            (f"{names[index % len(names)]} {index // len(names) + 1}" if index >= len(names) else names[index],
+             self.random.randint(50, 50000))
+            for index in range(products)
+        ]
+        self.product_weights = zipf_cum_weights(products, product_skew)
+
+        # a customer cannot have two invoices on the same day, so the k-th invoice of a customer is dated
+        # (offset + k * stride) days after the start, which walks through every day once before repeating
+        self.stride = next(stride for stride in itertools.count(int(days * 0.618) or 1) if math.gcd(stride, days) == 1)
+        self.offsets = [self.random.randrange(days) for _ in range(customers)]
+        self.invoice_counts = [0] * customers
+        self.full_customers = 0
+
+    def new_id(self):
+        """
+        Returns a random version 4 UUID drawn from the seeded generator, formatted without building a `uuid.UUID`.
+        """
+        value = '%032x' % (self.random.getrandbits(128) & UUID_RANDOM_BITS | UUID_VERSION_BITS)
+        return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+    def pick_customer(self):
+        """
+        Returns the index of the customer of the next invoice, moving on to the next customer
+        when the picked one already has an invoice on every day of the range.
+        """
+        index = bisect_left(self.customer_weights, self.random.random() * self.customer_weights[-1])
+        index = min(index, self.customers - 1)
+        while self.invoice_counts[index] >= self.days:
+            index = (index + 1) % self.customers
+        self.invoice_counts[index] += 1
+        if self.invoice_counts[index] == self.days:
+            self.full_customers += 1
+        return index
+
+    def line_count(self):
+        """
+        Returns the number of invoice details of the next invoice, geometrically distributed around the mean.
+        """
+        if self.lines_per_invoice <= 1:
+            return 1
+        return min(self.max_lines, 1 + int(self.random.expovariate(1 / (self.lines_per_invoice - 1))))
+
+    def invoices(self, count=None, details=None):
+        """
+        Yields invoices until either the number of invoices or the number of invoice details is reached.
+
+        Args:
+            count (int, optional): The number of invoices to generate.
+            details (int, optional): The number of invoice details to generate, the last invoice is cut short to match it exactly.
+
+        Yields:
+            tuple: The invoice row, its invoice detail rows and its search document, in the column order of the insert statements.
+        """
+        generated_invoices = generated_details = 0
+        while (count is None or generated_invoices < count) and (details is None or generated_details < details):
+            if self.full_customers == self.customers:
+                raise ValueError("every customer already has an invoice on every day, use more customers or days")
+            customer = self.pick_customer()
+            invoice_id = self.new_id()
+            day = (self.offsets[customer] + (self.invoice_counts[customer] - 1) * self.stride) % self.days
+            invoice_date = self.start_date + timedelta(days=day)
+            created_at = datetime.combine(invoice_date, datetime.min.time()) + timedelta(seconds=self.random.randrange(86400))
+            timestamp = created_at.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+            lines = self.line_count()
+            if details is not None:
+                lines = min(lines, details - generated_details)
+            detail_rows = []
+            total = quantity_total = max_price = max_unit_price = 0
+            for _ in range(lines):
+                index = bisect_left(self.product_weights, self.random.random() * self.product_weights[-1])
+                description, base_price = self.products[min(index, len(self.products) - 1)]
+                # prices are worked out in cents so the stored totals are exact
+                unit_price = int(base_price * (0.9 + self.random.random() * 0.2))
+                quantity = 1 + int(self.random.expovariate(0.25))
+                price = unit_price * quantity
+                total += price
+                quantity_total += quantity
+                max_price = max(max_price, price)
+                max_unit_price = max(max_unit_price, unit_price)
+                detail_rows.append((self.new_id(), invoice_id, description, quantity, unit_price / 100, price / 100, timestamp, timestamp))
+
+            descriptions = [row[2] for row in detail_rows]
+            name = customer_name(customer)
+            invoice_row = (
+                invoice_id, name, invoice_date.isoformat(), total / 100, lines, quantity_total,
+                max_price / 100, max_unit_price / 100, min(descriptions, default=''), timestamp, timestamp
+            )
+            yield invoice_row, detail_rows, (document_rowid(invoice_id), invoice_id, name, " ".join(descriptions))
+            generated_invoices += 1
+            generated_details += lines
+
+def generate_data(db_path, invoices=None, details=None, batch_size=10000, clear=False, search_index=True, **options):
+    """
+    Fills the 'invoice', 'invoice_detail' and 'invoice_search' tables with generated invoices for load testing,
+    and computes the report rollups from them.
+    The rows are inserted with `executemany`, one transaction per batch of invoices, along with the totals and aggregates
+    stored on every invoice, so the database is ready to be queried as soon as the script ends.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        invoices (int, optional): The number of invoices to generate.
+        details (int, optional): The number of invoice details to generate, instead of or on top of the number of invoices.
+        batch_size (int, optional): The number of invoices inserted per transaction. Defaults to 10000.
+        clear (bool, optional): Whether to delete the existing invoices first. Defaults to False.
+        search_index (bool, optional): Whether to add the full-text search documents. Defaults to True.
+        **options: The arguments of `InvoiceGenerator`.
+
+    Returns:
+        tuple: The number of invoices and of invoice details inserted.
+    """
+    create_tables(db_path)
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    if clear:
+        c.execute("DELETE FROM invoice_detail")
+        c.execute("DELETE FROM invoice")
+        c.execute("DELETE FROM invoice_search")
+        for table, _, _ in ROLLUPS:
+            c.execute(f"DELETE FROM {table}")
+        conn.commit()
+    elif c.execute("SELECT EXISTS (SELECT 1 FROM invoice)").fetchone()[0]:
+        conn.close()
+        raise ValueError(f"'{db_path}' already holds invoices, use --clear to replace them")
+
+    # the generated data can always be generated again, so durability is traded for speed while it is inserted
+    c.execute("PRAGMA synchronous = OFF")
+    c.execute("PRAGMA cache_size = -262144")
+    # the secondary indexes are built once at the end, which is much faster than updating them on every insert,
+    # they are created again by `create_tables` below or by running it after an interrupted run
+    indexes = c.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ('invoice', 'invoice_detail') AND sql IS NOT NULL").fetchall()
+    for (index,) in indexes:
+        c.execute(f"DROP INDEX {index}")
+
+    generator = InvoiceGenerator(**options)
+    rows = generator.invoices(count=invoices, details=details)
+    invoice_count = detail_count = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        # sorted by primary key so the random ids are appended to the indexes page by page
+        invoice_rows = sorted(invoice for invoice, _, _ in batch)
+        detail_rows = sorted(detail for _, invoice_details, _ in batch for detail in invoice_details)
+        c.executemany(INVOICE_SQL, invoice_rows)
+        c.executemany(DETAIL_SQL, detail_rows)
+        if search_index:
+            c.executemany(SEARCH_SQL, sorted(document for _, _, document in batch))
+        conn.commit()
+        invoice_count += len(invoice_rows)
+        detail_count += len(detail_rows)
+        print(f"  {invoice_count} invoices, {detail_count} invoice details")
+
+    print("  computing the report rollups")
+    compute_rollups(c)
+    conn.commit()
+    conn.close()
+    print("  creating the indexes")
+    create_tables(db_path)
+    return invoice_count, detail_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fills the database with generated invoices for load testing.")
+    parser.add_argument('db_path', nargs='?', default="db.sqlite3", help="Path to the SQLite database file.")
+    parser.add_argument('--invoices', type=int, help="Number of invoices to generate, 1000 if neither this nor --details is given.")
+    parser.add_argument('--details', type=int, help="Number of invoice details to generate.")
+    parser.add_argument('--lines-per-invoice', type=float, default=5.0, help="Mean number of invoice details per invoice.")
+    parser.add_argument('--max-lines', type=int, default=200, help="Highest number of invoice details of an invoice.")
+    parser.add_argument('--customers', type=int, default=10000, help="Number of distinct customers.")
+    parser.add_argument('--customer-skew', type=float, default=1.0, help="Zipf exponent of the invoices per customer, 0 for uniform.")
+    parser.add_argument('--products', type=int, default=600, help="Number of distinct invoice detail descriptions.")
+    parser.add_argument('--product-skew', type=float, default=1.1, help="Zipf exponent of the lines per product, 0 for uniform.")
+    parser.add_argument('--start-date', type=date.fromisoformat, default=date(2015, 1, 1), help="First invoice date, YYYY-MM-DD.")
+    parser.add_argument('--days', type=int, default=3650, help="Number of days the invoice dates are spread over.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator, the same seed generates the same data.")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Number of invoices inserted per transaction.")
+    parser.add_argument('--clear', action='store_true', help="Delete the existing invoices first.")
+    parser.add_argument('--no-search-index', dest='search_index', action='store_false', help="Do not add the full-text search documents.")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    invoice_count, detail_count = generate_data(
+        args.db_path,
+        invoices=args.invoices if args.invoices or args.details else 1000,
+        details=args.details,
+        batch_size=args.batch_size,
+        clear=args.clear,
+        search_index=args.search_index,
+        seed=args.seed,
+        customers=args.customers,
+        customer_skew=args.customer_skew,
+        products=args.products,
+        product_skew=args.product_skew,
+        lines_per_invoice=args.lines_per_invoice,
+        max_lines=args.max_lines,
+        start_date=args.start_date,
+        days=args.days,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"{invoice_count} invoices and {detail_count} invoice details generated in '{args.db_path}' in {elapsed:.1f}s")
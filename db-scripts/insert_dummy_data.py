@@ -1,9 +1,11 @@
 import sqlite3
 import uuid
 
+from derived_data import compute_rollups, document_rowid
+
 def insert_dummy_data(db_path):
     """
-    Inserts dummy data into the 'invoice' and 'invoice_detail' tables.
+    Inserts dummy data into the 'invoice' and 'invoice_detail' tables, along with their search documents and the report rollups.
     Can be used to test the API, particularly the pagination feature.
 
     Args:
@@ -58,6 +60,32 @@ def insert_dummy_data(db_path):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, (detail_id, invoice_id, description, quantity, unit_price, price, created_at, updated_at))
 
+    # Fill in the totals and aggregates stored on each invoice from its details
+    c.execute("""
+        UPDATE invoice SET
+            total_amount = (SELECT COALESCE(SUM(price), 0) FROM invoice_detail WHERE invoice_id = invoice.id),
+            line_count = (SELECT COUNT(*) FROM invoice_detail WHERE invoice_id = invoice.id),
+            total_quantity = (SELECT COALESCE(SUM(quantity), 0) FROM invoice_detail WHERE invoice_id = invoice.id),
+            max_price = (SELECT COALESCE(MAX(price), 0) FROM invoice_detail WHERE invoice_id = invoice.id),
+            max_unit_price = (SELECT COALESCE(MAX(unit_price), 0) FROM invoice_detail WHERE invoice_id = invoice.id),
+            first_description = (SELECT COALESCE(MIN(description), '') FROM invoice_detail WHERE invoice_id = invoice.id)
+    """)
+
+    # Add the full-text search document of each invoice, made of its customer name and the descriptions of its details
+    descriptions = {invoice_id: [] for invoice_id, *_ in invoice_data}
+    for _, invoice_id, description, *_ in invoice_detail_data:
+        descriptions[invoice_id].append(description)
+    c.executemany(
+        "INSERT INTO invoice_search (rowid, invoice_id, customer_name, descriptions) VALUES (?, ?, ?, ?)",
+        [
+            (document_rowid(invoice_id), invoice_id, customer_name, " ".join(descriptions[invoice_id]))
+            for invoice_id, customer_name, *_ in invoice_data
+        ]
+    )
+
+    # Compute the report rollups from all the details, as `python manage.py rebuild_reports` does
+    compute_rollups(c)
+
     conn.commit()
     conn.close()
 
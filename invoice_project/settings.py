@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,8 +53,24 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.QueryInstrumentationMiddleware',
 ]
 
+# serve the invoice and invoice detail endpoints with the asynchronous views, for ASGI servers such as uvicorn
+ASYNC_VIEWS = config("ASYNC_VIEWS", default=False, cast=bool)
+
+# return the number and duration of the SQL queries of each request in the X-DB-Queries and X-DB-Time-ms headers
+SQL_INSTRUMENTATION_HEADERS = config("SQL_INSTRUMENTATION_HEADERS", default=DEBUG, cast=bool)
+# log a warning when a request runs the same query more than this many times
+SQL_REPEATED_QUERY_THRESHOLD = config("SQL_REPEATED_QUERY_THRESHOLD", default=10, cast=int)
+
+# latency histograms and request counters of every resource and action, served at /api/metrics
+METRICS_ENABLED = config("METRICS_ENABLED", default=True, cast=bool)
+# directory shared by the worker processes of the server, each writes its counters there for the others to add up
+METRICS_DIR = config("METRICS_DIR", default="")
+# the shortest time in seconds between two writes of the counters of a worker
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=1.0, cast=float)
+
 ROOT_URLCONF = 'invoice_project.urls'
 
 TEMPLATES = [
@@ -85,12 +102,65 @@ DATABASES = {
     }
 }
 
+# PRAGMAs run on every new SQLite connection: "wal" (the default), "wal-mmap" or "rollback", see api/database.py
+SQLITE_PROFILE = config("SQLITE_PROFILE", default="wal")
+# single PRAGMAs overriding the ones of the profile, e.g. SQLITE_MMAP_SIZE=1073741824
+SQLITE_PRAGMAS = {
+    pragma: value
+    for pragma in ("journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "busy_timeout")
+    if (value := config(f"SQLITE_{pragma.upper()}", default=None)) is not None
+}
+# number of times a write view is run again when the database is locked, after a pause doubling from SQLITE_RETRY_BACKOFF seconds
+SQLITE_WRITE_RETRIES = config("SQLITE_WRITE_RETRIES", default=3, cast=int)
+SQLITE_RETRY_BACKOFF = config("SQLITE_RETRY_BACKOFF", default=0.05, cast=float)
+# commit the invoice detail writes of concurrent requests together, collecting them for up to WRITE_COALESCING_WINDOW seconds
+WRITE_COALESCING = config("WRITE_COALESCING", default=False, cast=bool)
+WRITE_COALESCING_WINDOW = config("WRITE_COALESCING_WINDOW", default=0.002, cast=float)
+WRITE_COALESCING_MAX_BATCH = config("WRITE_COALESCING_MAX_BATCH", default=64, cast=int)
+# largest number of invoice details a single bulk repricing may change, a request can only lower it
+REPRICE_MAX_ROWS = config("REPRICE_MAX_ROWS", default=10000, cast=int)
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+INVOICE_LIST_CACHE_MAX_ENTRIES = config("INVOICE_LIST_CACHE_MAX_ENTRIES", default=1000, cast=int)
+# directory shared by the worker processes of the server, holding the generation of the invoice list cache
+# so that a write served by one worker invalidates the cached responses of all of them
+INVOICE_LIST_CACHE_DIR = config("INVOICE_LIST_CACHE_DIR", default=str(BASE_DIR / '.cache'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # responses of the invoice list, invalidated by every write of an invoice through the generation file of INVOICE_LIST_CACHE_DIR
+    # the local memory cache evicts the least recently used entries, culling a single one when it is full
+    'invoice_list': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'invoice-list',
+        'TIMEOUT': config("INVOICE_LIST_CACHE_TIMEOUT", default=30, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': INVOICE_LIST_CACHE_MAX_ENTRIES,
+            'CULL_FREQUENCY': INVOICE_LIST_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+
 MIGRATION_MODULES = {
         app.split('.')[-1]: None for app in INSTALLED_APPS
     }
 
 REST_FRAMEWORK = {
-    'TEST_REQUEST_DEFAULT_FORMAT': 'json'
+    'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    # JSON encoded and decoded with orjson when it is installed, with the same output as the default JSON classes
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 